@@ -3,24 +3,204 @@ Manages bot_commands related to school clubs.
 Note that some commands here have been migrated from slash commands to "regular commands".
 This is because I am waiting for a proper way to handle slash command permissions in nextcord.
 """
-from nextcord.ext import commands
+from nextcord.ext import commands, tasks
 import logging, nextcord, asyncio
 from nextcord import Interaction, SlashOption
 from utils.clubs import *
-from utils.general import generate_error_embed
+from utils.announcements import (
+    create_announcement_job,
+    get_unfinished_announcement_jobs,
+    mark_announcement_recipient,
+    finish_announcement_job,
+)
+from utils.fanout import fan_out, send_direct_message, FanOutResult
+from utils.general import generate_error_embed, get_json, paginate_embed
 from utils.color_const import CLUBS_EMBED_COLOR
-from typing import Optional
+from utils.models import Club, AnnouncementJob
+from typing import List, Optional
 
 logger = logging.getLogger(__name__)
 
 # Create a list of clubs
-club_data = get_clubs_data()
+club_data = get_json(CLUBS_DATA_FILEPATH, copy=False)
 club_name_options = {club["title"]: club["id"] for club in club_data["clubs"]}
 
 
 class Clubs(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.club_registry = club_registry  # In-memory index of all clubs
+        # Announcements are sent out one at a time so that they do not compete for the rate limits
+        self.announcement_lock = asyncio.Lock()
+        # The list of clubs is rendered once and then reused until the club registry changes
+        self.club_list_embeds: List[Embed] = []
+        self.club_list_version: Optional[int] = None
+        self.refresh_club_registry.start()
+        self.resume_announcement_jobs.start()
+
+    def cog_unload(self):
+        """Function that calls when the cog is unloaded.
+        Cancels refreshing of the club registry."""
+        self.refresh_club_registry.cancel()
+        self.resume_announcement_jobs.cancel()
+
+    @tasks.loop(minutes=1)
+    async def refresh_club_registry(self):
+        """Picks up changes made to the clubs file by someone else than the bot, for example by editing it by hand.
+        Changes made by the bot itself are applied to the registry directly."""
+        await self.club_registry.refresh()
+
+    @tasks.loop(count=1)
+    async def resume_announcement_jobs(self):
+        """Continues sending out announcements that were being sent out when the bot was stopped."""
+        await self.bot.wait_until_ready()
+        announcement_jobs = await get_unfinished_announcement_jobs()
+        if len(announcement_jobs) > 0:
+            logger.info(f"Resuming {len(announcement_jobs)} announcement jobs...")
+        for announcement_job in announcement_jobs:
+            await self.run_announcement_job(announcement_job)
+
+    def get_announcement_embed(self, announcement_job: AnnouncementJob) -> Embed:
+        """Creates the message that is sent to the recipients of an announcement.
+
+        :param announcement_job: The announcement job."""
+        club = self.club_registry.get(announcement_job.club_id)
+        club_title = club.title if club is not None else announcement_job.club_id
+        announcement_embed = Embed(
+            title=f"📣 Meddelande från {club_title}",
+            description=announcement_job.message,
+            color=CLUBS_EMBED_COLOR,
+        )
+        announcement_embed.set_footer(
+            text=f"Du får detta meddelande eftersom du prenumererar på klubben. Använd /unsubcribe_to_club {announcement_job.club_id} för att avprenumerera."
+        )
+        return announcement_embed
+
+    async def update_announcement_progress(
+        self, announcement_job: AnnouncementJob, result: FanOutResult
+    ):
+        """Updates the message where the progress of an announcement is reported.
+
+        :param announcement_job: The announcement job.
+
+        :param result: The current result of sending out the announcement."""
+        if announcement_job.progress_channel_id is None:
+            return
+        progress_channel = self.bot.get_channel(announcement_job.progress_channel_id)
+        if progress_channel is None:
+            logger.warning("The channel for announcement progress could not be found.")
+            return
+        # Include recipients that were handled before a restart
+        handled = len(announcement_job.delivered_ids) + len(announcement_job.failed_ids)
+        total = len(announcement_job.recipient_ids)
+        finished = result.finished_at is not None
+        progress_embed = Embed(
+            title="✅ Meddelandet har skickats!"
+            if finished
+            else "📤 Skickar meddelande...",
+            description=f"Meddelandet har hanterats för {handled}/{total} prenumeranter.",
+            color=CLUBS_EMBED_COLOR,
+        )
+        progress_embed.add_field(
+            name="Skickade", value=str(len(announcement_job.delivered_ids))
+        )
+        progress_embed.add_field(
+            name="Misslyckades", value=str(len(announcement_job.failed_ids))
+        )
+        if finished and len(announcement_job.failed_ids) > 0:
+            progress_embed.set_footer(
+                text="Meddelandet kunde inte skickas till vissa prenumeranter. De har förmodligen stängt av sina DMs."
+            )
+        await progress_channel.get_partial_message(
+            announcement_job.progress_message_id
+        ).edit(embed=progress_embed)
+
+    async def run_announcement_job(self, announcement_job: AnnouncementJob):
+        """Sends out an announcement to all recipients that have not received it yet.
+
+        :param announcement_job: The announcement job."""
+        async with self.announcement_lock:
+            announcement_embed = self.get_announcement_embed(announcement_job)
+
+            async def send(user_id: int):
+                """Sends the announcement to a user."""
+                await send_direct_message(self.bot, user_id, embed=announcement_embed)
+
+            async def on_delivered(user_id: int):
+                """Records that the announcement was sent to a user."""
+                await mark_announcement_recipient(announcement_job, user_id, True)
+
+            async def on_failed(user_id: int, exception: Exception):
+                """Records that the announcement could not be sent to a user."""
+                await mark_announcement_recipient(announcement_job, user_id, False)
+
+            async def on_progress(result: FanOutResult):
+                """Reports the progress of the announcement."""
+                await self.update_announcement_progress(announcement_job, result)
+
+            await fan_out(
+                announcement_job.get_pending_recipient_ids(),
+                send,
+                on_delivered=on_delivered,
+                on_failed=on_failed,
+                on_progress=on_progress,
+            )
+            await finish_announcement_job(announcement_job)
+
+    @nextcord.slash_command(
+        description="Skicka ett meddelande till alla som prenumererar på en klubb som du är ansvarig för."
+    )
+    async def announce_to_club(
+        self,
+        interaction: Interaction,
+        club_id: str = SlashOption(
+            name="klubb", description="Den klubb som meddelandet är från"
+        ),
+        message: str = SlashOption(
+            name="meddelande", description="Meddelandet som ska skickas"
+        ),
+    ):
+        logger.info("Got a request to send an announcement to a club!")
+        club = self.club_registry.get(club_id)
+        if club is None:
+            logger.debug("The club does not exist. Returning error...")
+            await interaction.response.send_message(
+                embed=generate_error_embed(
+                    "Klubben existerar inte",
+                    "Klubben du försöker skicka ett meddelande till existerar inte.",
+                ),
+                ephemeral=True,
+            )
+            return
+        if not is_club_owner(club, interaction.user):
+            logger.debug("The user is not an owner of the club. Returning error...")
+            await interaction.response.send_message(
+                embed=generate_error_embed(
+                    "Du är inte ansvarig för klubben",
+                    "Endast ansvariga för en klubb kan skicka meddelanden till dess prenumeranter.",
+                ),
+                ephemeral=True,
+            )
+            return
+        recipient_ids = get_club_recipient_ids(club, interaction.guild)
+        await interaction.response.send_message(
+            embed=Embed(
+                title="📤 Skickar meddelande...",
+                description=f"Meddelandet skickas till {len(recipient_ids)} prenumeranter.",
+                color=CLUBS_EMBED_COLOR,
+            )
+        )
+        progress_message = await interaction.original_message()
+        announcement_job = await create_announcement_job(
+            club.id,
+            interaction.user.id,
+            message,
+            recipient_ids,
+            progress_message.channel.id,
+            progress_message.id,
+        )
+        await self.run_announcement_job(announcement_job)
+        logger.info("Announcement sent.")
 
     @nextcord.slash_command(
         description="Prenumerera på en klubb och få notiser när klubben har något att meddela."
@@ -35,15 +215,15 @@ class Clubs(commands.Cog):
     ):
         logger.info("Got a request to subscribe to a club!")
         # Get club
-        found_club = get_club_by_id(club_id)
+        found_club = self.club_registry.get(club_id)
         # Add user as a subscriber if not already subscribed
         if not is_subscriber_to_club(found_club, interaction.user):
             logger.info("Adding user as subscriber...")
             # Grant role to user
-            role = interaction.guild.get_role(found_club["role_id"])
+            role = interaction.guild.get_role(found_club.role_id)
             if role not in interaction.user.roles:
                 await interaction.user.add_roles(role)
-            add_subscriber_to_club(club_id, interaction.user)
+            await add_subscriber_to_club(club_id, interaction.user)
         logger.info("Addition done. Sending message...")
         final_embed = Embed(
             title="✅ Du lades till!",
@@ -81,7 +261,7 @@ class Clubs(commands.Cog):
     ):
         logger.info("Got a request to unsubscribe to a club.")
         # Check if the user is subscribed
-        club_data = get_club_by_id(club_id)
+        club_data = self.club_registry.get(club_id)
         user_id = interaction.user.id
         if not is_subscriber_to_club(club_data, interaction.user):
             logger.info("The user is not a subscriber to the club!")
@@ -96,10 +276,10 @@ class Clubs(commands.Cog):
         else:
             logger.info("The user is subscribing to the club. Removing...")
             # Remove role from user
-            role = interaction.guild.get_role(club_data["role_id"])
+            role = interaction.guild.get_role(club_data.role_id)
             if role in interaction.user.roles:
                 await interaction.user.remove_roles(role)
-            remove_subscriber_from_club(club_id, interaction.user)
+            await remove_subscriber_from_club(club_id, interaction.user)
         # Send confirmation message
         final_embed = Embed(
             title="✅ Avprenumererad",
@@ -116,29 +296,31 @@ class Clubs(commands.Cog):
         await interaction.message.delete()
         logger.interaction("User message has been deleted.")
 
-    @nextcord.slash_command(
-        description="Detta kommando listar alla klubbar som du kan prenumerera på."
-    )
-    async def list_clubs(self, interaction: Interaction):
-        logger.info("Got a request to list clubs!")
+    def get_club_list_embeds(self) -> List[Embed]:
+        """Gets the embeds that list all clubs. They are only rendered again when the club registry has changed.
+
+        :returns: The list of clubs, split into multiple embeds if it does not fit in one."""
+        if self.club_list_version == self.club_registry.version:
+            return self.club_list_embeds
+        logger.debug("Rendering list of clubs...")
         # Create a pretty list of clubs
-        clubs = get_clubs_data()
+        clubs = self.club_registry.get_all()
         final_embed = Embed(
             title="Klubbar",
             description="Här hittar du en lista på tillgängliga klubbar. Genom att prenumerera på någon av dessa, så får du meddelanden varje gång klubben har något att meddela.",
             color=CLUBS_EMBED_COLOR,
         )
         # Iterate through clubs and add information
-        for club in clubs["clubs"]:
-            logger.debug(f"Handling club data for {club['id']}")
-            club_subscription_command = f"**För att prenumerera på denna klubb, använd kommandot `/subscribe_to_club {club['id']}`**"
+        for club in clubs:
+            logger.debug(f"Handling club data for {club.id}")
+            club_subscription_command = f"**För att prenumerera på denna klubb, använd kommandot `/subscribe_to_club {club.id}`**"
             # To add a description to the club, set the JSON key "description". The bot adds links to informational messages by default.
             description = ""
-            if club["description"] != None:
+            if club.description != None:
                 logger.debug("Adding set club description to message...")
-                description += club["description"]
-            if "links" in club:  # Here, you can add a links about the club
-                for link in club["links"]:
+                description += club.description
+            if len(club.links) > 0:  # Here, you can add a links about the club
+                for link in club.links:
                     # Both dict and string is allowed as configuration here
                     if type(link) == dict:
                         description += f"- [{link['name']}]({link['url']})"
@@ -148,12 +330,25 @@ class Clubs(commands.Cog):
                 f"\n{club_subscription_command}"  # Add command to subscribe to club
             )
             final_embed.add_field(
-                name=f"{club['title']}",
-                value=f"{club['emoji'] if club['emoji'] != None else ''}\n{description}",
+                name=f"{club.title}",
+                value=f"{club.emoji if club.emoji != None else ''}\n{description}",
                 inline=False,
             )
-        logger.info("List of clubs created. Sending message...")
-        await interaction.response.send_message(embed=final_embed)
+        self.club_list_embeds = paginate_embed(final_embed)
+        self.club_list_version = self.club_registry.version
+        logger.info(f"List of clubs rendered to {len(self.club_list_embeds)} embeds.")
+        return self.club_list_embeds
+
+    @nextcord.slash_command(
+        description="Detta kommando listar alla klubbar som du kan prenumerera på."
+    )
+    async def list_clubs(self, interaction: Interaction):
+        logger.info("Got a request to list clubs!")
+        club_list_embeds = self.get_club_list_embeds()
+        logger.info("List of clubs retrieved. Sending message...")
+        await interaction.response.send_message(embed=club_list_embeds[0])
+        for club_list_embed in club_list_embeds[1:]:
+            await interaction.followup.send(embed=club_list_embed)
 
     # Note: what is commented out in the code is the code that was used when this was a slash command.
     @commands.command(description="Detta kommando lägger till en ny klubb.")
@@ -187,20 +382,19 @@ class Clubs(commands.Cog):
             logger.info("Role for responsible person created.")
         else:
             logger.info("Role for responsible person specified. Using it...")
-        club_data = {
-            "title": club_title,
-            "description": club_description,
-            "id": club_id,
-            "emoji": None,
-            "role_id": role.id,
-            "owners_role_id": owners_role.id,
-            "owners": [],
-            "subscribers": [],
-            "created_at": str(get_now()),
-        }
-        clubs_data = get_clubs_data()
-        clubs_data["clubs"].append(club_data)
-        write_clubs_data(clubs_data)
+        club = Club(
+            id=club_id,
+            title=club_title,
+            description=club_description,
+            emoji=None,
+            role_id=role.id,
+            owners_role_id=owners_role.id,
+            owners=[],
+            subscribers={},
+            links=[],
+            created_at=str(get_now()),
+        )
+        await create_club(club)
         logger.info("Club created! Sending message...")
         await ctx.send(
             embed=Embed(  # interaction.response.send_message
@@ -225,7 +419,7 @@ class Clubs(commands.Cog):
     ):  # = SlashOption(name="anvandare", description="Användaren som ska läggas till som ägare/ansvarig för klubben.")):
         logger.info("Got a request to add a club owner!")
         # Get club
-        club_data, club_index = get_club_by_id(club_id, return_index=True)
+        club_data = get_club_by_id(club_id)
         # Validate that the club exists
         if club_data is None:
             logger.debug("The club does not exist. Returning error...")
@@ -235,20 +429,19 @@ class Clubs(commands.Cog):
                     "Klubben du försöker lägga till existerar inte. (skriv in klubbens ID, om du är osäker tagga Albin Seijmer TE20A)",
                 )
             )
-        clubs_data = get_clubs_data()
+            return
         # Add user as owner
-        club_data["owners"].append(user.id)
+        club_data.owners.append(user.id)
         logger.info("Awarding role to new user...")
         owner_role = ctx.guild.get_role(
-            club_data["owners_role_id"]
+            club_data.owners_role_id
         )  # interaction.guild.get_role
         if owner_role not in user.roles:
             await user.add_roles(owner_role)
             logger.info("Role awarded to user.")
         else:
             logger.info("User already has owner role.")
-        clubs_data[club_index] = club_data
-        write_clubs_data(clubs_data)
+        await update_club_data_by_id(club_id, club_data)
         logger.info("Done!")
         await ctx.send(
             embed=Embed(  # interaction.response.send_message
@@ -279,6 +472,7 @@ class Clubs(commands.Cog):
                     "Klubben du försöker ändra existerar inte. (skriv in klubbens ID, om du är osäker tagga Albin Seijmer TE20A)",
                 )
             )
+            return
         ALLOWED_CLUB_CONFIGURATION_PARAMETERS = {
             "title": str,
             "description": str,
@@ -307,10 +501,10 @@ class Clubs(commands.Cog):
         # If value to edit is allowed, check type and handle accordingly.
         value_type = ALLOWED_CLUB_CONFIGURATION_PARAMETERS[parameter_name]
         if value_type == str:
-            club_data[parameter_name] = new_value
+            setattr(club_data, parameter_name, new_value)
         elif value_type == int:
             try:
-                club_data[parameter_name] = int(new_value)
+                setattr(club_data, parameter_name, int(new_value))
             except Exception as e:
                 logger.debug(
                     f"Failed to edit integer parameter in club data: {e} (value was {new_value})"
@@ -340,9 +534,9 @@ class Clubs(commands.Cog):
                 )
                 return
             elif action is None or action == "append":
-                club_data[parameter_name].append(new_value)
+                getattr(club_data, parameter_name).append(new_value)
             elif action == "clear":  # Clear list
-                club_data[parameter_name] = []
+                setattr(club_data, parameter_name, [])
                 logger.info("List cleared.")
             elif action == "remove":  # Remove from list
                 # For this parameter, the value to change to should be the index to remove. Validate it.
@@ -357,7 +551,7 @@ class Clubs(commands.Cog):
                         )
                     )
                     return
-                list_to_edit = club_data[parameter_name]
+                list_to_edit = getattr(club_data, parameter_name)
                 if len(list_to_edit) == 0:
                     logger.debug("Invalid index (empty list).")
                     await ctx.send(
@@ -383,15 +577,15 @@ class Clubs(commands.Cog):
                 f"No value type converter provided for {value_type}. The requested value will not be edited."
             )
         logger.debug(
-            f"{value_type} parameter {parameter_name}  on club {club_id} was changed to {club_data[parameter_name]}."
+            f"{value_type} parameter {parameter_name}  on club {club_id} was changed to {getattr(club_data, parameter_name)}."
         )
-        update_club_data_by_id(club_id, club_data)
-        new_club_data = get_club_by_id(club_id)
+        await update_club_data_by_id(club_id, club_data)
+        new_club_data = get_club_by_id(club_data.id)  # (the ID might have been changed)
         logger.info("Club data updated. Sending...")
         await ctx.send(
             embed=Embed(
                 title="✅ Uppdaterat!",
-                description=f"Parametern `{parameter_name}` för klubben `{club_id}` har uppdaterats till det nya värdet `{new_club_data[parameter_name]}`.",
+                description=f"Parametern `{parameter_name}` för klubben `{club_id}` har uppdaterats till det nya värdet `{getattr(new_club_data, parameter_name)}`.",
                 color=CLUBS_EMBED_COLOR,
             )
         )
@@ -399,20 +593,11 @@ class Clubs(commands.Cog):
     # Autocomplete handlers.
     @subscribe_to_club.on_autocomplete("club_id")
     @unsubcribe_to_club.on_autocomplete("club_id")
+    @announce_to_club.on_autocomplete("club_id")
     # @add_club_owner.on_autocomplete("club_id") Note: This handler has now been commented out until there is a nice way for permission handling slash commands in nextcord.
     async def autocomplete_club_name(self, interaction: Interaction, club_id: str):
         """Function to autocomplete a club name."""
         logger.debug("Autocompleting club name...")
-        club_ids = get_club_ids()
-        # Note: This is based on the autocomplete example from https://github.com/nextcord/nextcord/blob/master/examples/application_commands/autocompleted_command.py
-        if not club_id:  # If no club ID has been sent, send all of them
-            logger.debug("Club name has not been set yet. Providing whole list...")
-            await interaction.response.send_autocomplete(club_ids)
-        else:  # If a club ID has been set, find the closest ones and return
-            logger.debug("Club name has been set. Using closest values...")
-            closest_club_ids = [
-                available_club_id
-                for available_club_id in club_ids
-                if club_id.startswith(available_club_id)
-            ]
-            await interaction.response.send_autocomplete(closest_club_ids)
+        await interaction.response.send_autocomplete(
+            self.club_registry.search_ids(club_id)
+        )
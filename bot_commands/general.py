@@ -3,9 +3,23 @@ Function that contains some general bot tasks, such as changing its status.
 """
 from nextcord.ext.commands import Cog
 from nextcord.ext import tasks, commands
-from nextcord import Status, Embed, Activity
-import logging, aiohttp, os, random
-from utils.general import generate_error_embed, get_now, BOT_GENERAL_STATUSES
+from nextcord import Status, Embed, Activity, ActivityType
+import datetime, logging, aiohttp, asyncio, os, random
+from typing import List, Optional, Tuple
+from utils.general import (
+    generate_error_embed,
+    get_now,
+    get_active_classes,
+    paginate_embed,
+    get_api_url,
+    BOT_GENERAL_STATUSES,
+)
+from utils.document_store import document_store
+from utils.journal import journals
+from utils.http_client import http_client
+from utils.scheduler import scheduler
+from utils.schedule_caching import get_schedule_download_stats
+from utils.schedule_index import ScheduleIndex, get_schedule_index
 
 logger = logging.getLogger(__name__)
 
@@ -16,7 +30,7 @@ properly, and I highly recommend it to anyone.
 The function is optional: you can disable it by not setting the environment variable
 HEALTHCHECKS_PING_URL.
 """
-HEALTHCHECKS_PING_URL = os.environ.get("HEALTHCHECKS_PING_URL")
+HEALTHCHECKS_PING_URL = get_api_url("HEALTHCHECKS_PING_URL", None, "/healthchecks/ping")
 HEALTHCHECKS_PING_FREQ = (
     int(os.environ.get("HEALTHCHECKS_PING_FREQ"))
     if "HEALTHCHECKS_PING_FREQ" in os.environ
@@ -26,6 +40,49 @@ logger.info(
     f"Healthchecks settings: Ping URL: {HEALTHCHECKS_PING_URL}, ping frequency: {HEALTHCHECKS_PING_FREQ} (minutes)"
 )
 
+# Breaks between lessons during this time are shown as the lunch break in the status of the bot
+LUNCH_BREAK_START = datetime.time(10, 30)
+LUNCH_BREAK_END = datetime.time(13, 30)
+# How often (in hours) the random status that is used outside of school hours is changed
+GENERAL_STATUS_ROTATION_HOURS = 2
+
+
+def get_school_status(
+    schedule_index: ScheduleIndex, classes: List[str], at: datetime.datetime
+) -> Optional[Tuple[ActivityType, str]]:
+    """Describes what is happening at school at a certain time, for the status of the bot.
+
+    :param schedule_index: The index of the cached schedules.
+
+    :param classes: The classes to include.
+
+    :param at: The time.
+
+    :returns: (activity type, text), or None if school is not in progress."""
+    classes_in_lessons = 0
+    school_day_started = False
+    school_day_over = True
+    for class_name in classes:
+        if schedule_index.current_lesson(class_name, at) is not None:
+            classes_in_lessons += 1
+            continue
+        previous_lesson = schedule_index.previous_lesson(class_name, at)
+        if previous_lesson is not None and previous_lesson.start.date() == at.date():
+            school_day_started = True
+        next_lesson = schedule_index.next_lesson(class_name, at)
+        if next_lesson is not None and next_lesson.start.date() == at.date():
+            school_day_over = False
+    if classes_in_lessons > 0:
+        return (
+            ActivityType.watching,
+            f"{classes_in_lessons} {'klass' if classes_in_lessons == 1 else 'klasser'} på lektion",
+        )
+    if school_day_started and not school_day_over:
+        if LUNCH_BREAK_START <= at.time() <= LUNCH_BREAK_END:
+            return ActivityType.watching, "lunchrasten"
+        return ActivityType.watching, "rasten"
+    return None
+
 
 class General(Cog):
     def __init__(self, bot):
@@ -42,14 +99,23 @@ class General(Cog):
             logger.warning(
                 "A Healthchecks ping URL has not been specified. (You can ignore this message unless you intend to track the bot using Healthchecks)"
             )
-        # self.change_status_new.start() # Start task for changing status - TODO implement
-        self.change_status.start()  # Start task for changing status every once in a while
+        # The current status as (activity type, text)
+        self.current_activity: Optional[Tuple[ActivityType, str]] = None
+        # The random status that is used when school is not in progress, and the period that it was chosen for
+        self.general_status: Optional[Tuple[ActivityType, str]] = None
+        self.general_status_period: Optional[Tuple[datetime.date, int]] = None
+        # Check if the status should be changed every minute
+        scheduler.add_job(
+            "change_status",
+            "daily 00:00-23:59/1",
+            self.change_status,
+            run_at_start=True,
+        )
 
     def cog_unload(self):
         """Runs when the cog is unloaded."""
         self.report_ping_to_healthchecks.cancel()  # Cancel task on cog unload.
-        # self.change_status_new.start() # Start task for changing status to something schedule related - TODO implement
-        self.change_status.cancel()  # Cancel task for changing status every once in a while
+        scheduler.remove_job("change_status")  # Stop changing status
 
     @Cog.listener()
     async def on_ready(self):
@@ -64,52 +130,48 @@ class General(Cog):
         The function is optional: you can disable it by not setting the environment variable
         HEALTHCHECKS_PING_URL."""
         logger.info("Reporting ping status to Healthchecks...")
-        async with aiohttp.ClientSession() as session:
-            async with session.get(HEALTHCHECKS_PING_URL) as request:
+        try:
+            async with http_client.get(HEALTHCHECKS_PING_URL) as request:
                 if request.status == 200:  # Check if request was successful
                     logger.info("Ping to Healthchecks was successful.")
                 else:
                     logger.warning("Ping to Healthchecks failed!")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # (an exception would stop the loop, and with it all future pings)
+            logger.warning(f"Ping to Healthchecks failed: {e!r}")
 
-    @tasks.loop(hours=1)
-    async def change_status(self):
-        """Changes status of the bot at most every 2 hours"""
-        logger.info("Checking for status change...")
-        await self.bot.wait_until_ready()
-        if random.randint(1, 2) == 1 or self.bot.activity is None:
-            logger.info("Status of bot should be changed. Generating random status...")
+    def get_general_status(self, now: datetime.datetime) -> Tuple[ActivityType, str]:
+        """Gets a random status from BOT_GENERAL_STATUSES. The same status is returned until it is time to rotate it.
+
+        :param now: The current time."""
+        general_status_period = (now.date(), now.hour // GENERAL_STATUS_ROTATION_HOURS)
+        if general_status_period != self.general_status_period:
+            logger.info("Generating random status...")
             new_status = random.choice(BOT_GENERAL_STATUSES)
-            activity = Activity(type=new_status["type"], name=new_status["text"])
-            logger.info(
-                f"Changing status to {new_status['type']}, {new_status['text']}."
-            )
-            await self.bot.change_presence(status=Status.online, activity=activity)
-        else:
-            logger.info("Checked for a status change, but it isn't the time yet.")
+            self.general_status = (new_status["type"], new_status["text"])
+            self.general_status_period = general_status_period
+        return self.general_status
 
-    @tasks.loop(minutes=3)
-    async def change_status_new(self):
-        """Changes the bot status. The status will be changed to something related to current lessons
-        if there is a schedule available. If not, it will be changed to something else."""
-        logger.info("Changing status...")
+    async def change_status(self):
+        """Changes the status of the bot to what is happening at school right now, or to a random status if
+        school is not in progress. The status is only changed if it differs from the current one, since Discord
+        rate limits status changes. Run by the scheduler (see scheduler.py)."""
         now = get_now()
-        # Check if schedules are available
-        schedule = None
-        if now.hour < 9 or now.hour > 17:  # No lessons - set general status
-            general_status = True
-        else:
-            general_status = True if schedule == None else False
-
-        if general_status:
-            logger.info("Using a general status.")
-            status = random.choice(BOT_GENERAL_STATUSES)
-            activity = Activity(type=status["type"], name=status["text"])
-            logger.info(f"New status: {status}. Changing...")
-            await self.bot.change_presence(status=Status.online, activity=activity)
-            logger.info("Bot status set.")
-        else:
-            logger.info("Using informational status.")
-            # TODO: Implement
+        new_activity = get_school_status(
+            await get_schedule_index(), get_active_classes(), now
+        )
+        if new_activity is None:
+            new_activity = self.get_general_status(now)
+        if new_activity == self.current_activity:
+            logger.debug("Status is unchanged.")
+            return
+        activity_type, activity_text = new_activity
+        logger.info(f"Changing status to {activity_type}, {activity_text}.")
+        await self.bot.change_presence(
+            status=Status.online,
+            activity=Activity(type=activity_type, name=activity_text),
+        )
+        self.current_activity = new_activity
 
     @commands.command(name="eval")
     @commands.is_owner()  # Make this only callable by owner
@@ -128,3 +190,54 @@ class General(Cog):
                 "Eval misslyckades", f"Ett fel inträffade: {e}."
             )
         await ctx.send(embed=final_embed)
+
+    @commands.command(name="stats")
+    @commands.is_owner()  # Make this only callable by owner
+    async def stats(self, ctx):
+        """Shows internal statistics about the bot, for example how often data is served from memory."""
+        logger.info("Sending bot statistics...")
+        final_embed = Embed(
+            title="Statistik", description="Intern statistik för boten."
+        )
+        document_store_stats = document_store.get_stats()
+        final_embed.add_field(
+            name="Dokumentcache",
+            value="\n".join(
+                [f"{key}: `{value}`" for key, value in document_store_stats.items()]
+            ),
+            inline=False,
+        )
+        for snapshot_filepath, journal in journals.items():
+            final_embed.add_field(
+                name=f"Journal ({os.path.basename(snapshot_filepath)})",
+                value="\n".join(
+                    [f"{key}: `{value}`" for key, value in journal.get_stats().items()]
+                ),
+                inline=False,
+            )
+        for job_name, job_stats in scheduler.get_stats().items():
+            final_embed.add_field(
+                name=f"Jobb ({job_name})",
+                value="\n".join(
+                    [f"{key}: `{value}`" for key, value in job_stats.items()]
+                ),
+                inline=False,
+            )
+        for class_name, class_stats in get_schedule_download_stats().items():
+            final_embed.add_field(
+                name=f"Schemanedladdning ({class_name})",
+                value="\n".join(
+                    [f"{key}: `{value}`" for key, value in class_stats.items()]
+                ),
+                inline=False,
+            )
+        for host, host_stats in http_client.get_stats().items():
+            final_embed.add_field(
+                name=f"HTTP ({host})",
+                value="\n".join(
+                    [f"{key}: `{value}`" for key, value in host_stats.items()]
+                ),
+                inline=False,
+            )
+        for final_embed_page in paginate_embed(final_embed):
+            await ctx.send(embed=final_embed_page)
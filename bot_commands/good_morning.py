@@ -14,6 +14,7 @@ from utils.good_morning import (
     get_good_morning_data,
     check_is_good_morning_message,
     write_to_good_morning_file,
+    get_good_morning_lock,
     ACTION_SEND_MESSAGE,
     ACTION_REACT,
     GOOD_MORNING_RESPONSES,
@@ -29,15 +30,16 @@ class GoodMorning(Cog):
 
     @Cog.listener("on_message")
     async def on_message(self, message: Message):
-        message_action = check_is_good_morning_message(message, self.bot.user.id)
+        message_action = await check_is_good_morning_message(message, self.bot.user.id)
         # Check if any action s have to be done
         if message_action == ACTION_SEND_MESSAGE:
             self.logger.info("Sending a good morning message...")
             response_string = random.choice(GOOD_MORNING_RESPONSES)
             self.logger.info("Writing fluid_data to file...")
-            good_morning_data = get_good_morning_data()
-            good_morning_data["message_sent_at"] = str(get_now().date())
-            write_to_good_morning_file(good_morning_data)
+            async with get_good_morning_lock():
+                good_morning_data = await get_good_morning_data()
+                good_morning_data["message_sent_at"] = str(get_now().date())
+                await write_to_good_morning_file(good_morning_data)
             self.logger.info("Data were written to file.")
             await message.reply(response_string)
             self.logger.info("Good morning message sent.")
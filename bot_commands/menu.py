@@ -6,12 +6,26 @@ The function mostly uses a task loop
 import datetime
 import time
 import pytz
+import nextcord
 from nextcord.ext.commands import Cog
 from nextcord.ext import tasks
-from nextcord import Embed
+from nextcord import Embed, Interaction, SlashOption
 from utils.menu import *
-from utils.general import get_now, get_current_day_name, MAIN_SERVER_ID, BASE_TIMEZONE
+from utils.menu_archive import menu_archive
+from utils.menu_highlights import render_day_menu
+from utils.fanout import fan_out, send_direct_message
+from utils.managed_messages import send_managed_message, edit_managed_message
+from utils.scheduler import scheduler
+from utils.general import (
+    get_now,
+    get_current_day_name,
+    generate_error_embed,
+    MAIN_SERVER_ID,
+    BASE_TIMEZONE,
+)
 from utils.color_const import MENU_EMBED_COLOR
+from utils.models import DayMenu, WeekMenu
+from typing import Optional
 import utils.subscription as subscription
 
 # Text that links to where you can find the week menu
@@ -22,47 +36,32 @@ class Menu(Cog):
     def __init__(self, bot):
         self.bot = bot
         self.update_menu_message.start()  # Start task for sending and editing menu messages
-        self.send_subscribed_menu_messages.start()  # Start task for sending out subscribed menu messages
+        # Send out subscribed menu messages every hour between 08:00 and 21:00 on school days.
+        # Every subscriber only gets one message per day/week, so the later runs only catch up if the menu was late.
+        scheduler.add_job(
+            "menu_subscriptions",
+            "weekdays 08:00-21:00/60",
+            self.send_subscribed_menu_messages,
+            skip_holidays=True,
+        )
 
     def cog_unload(self):
         """Function that calls when the cog is unloaded.
         Cancels updating of all the menu messages."""
         self.update_menu_message.cancel()
+        scheduler.remove_job("menu_subscriptions")
 
-    def get_dish_text_for(self, dishes, day):
-        """Converts a list of dish names into a human-readable format.
+    async def get_dish_text_for(self, day: DayMenu):
+        """Converts the dishes of a day into a human-readable format, highlighting special features (see menu_highlights.py).
 
-        :param dishes: A list of the dish names.
+        :param day: The menu for the day that information is being sent about."""
+        return await render_day_menu(day)
 
-        :param day: Data for the day that information is being sent about."""
-        day_dishes_text = ""
-        for dish in dishes:
-            dish_text = dish
-            # Highlight certain features - a bit hacky but functioning
-            if day["special_features"]["sweet_tuesday"]:
-                logger.debug("Highlighting Sweet Tuesday...")
-                dish_text = dish_text.replace("Sweet Tuesday", "*🍰 Sweet Tuesday*")
-            elif day["special_features"]["fruity_wednesday"]:
-                logger.debug("Highlighting Fruity Wednesday...")
-                dish_text = dish_text.replace(
-                    "Fruity Wednesday", "*🍓 Fruity Wednesday*"
-                )
-            elif day["special_features"]["pancake_thursday"]:
-                logger.debug("Highlighting Pancake Thursday...")
-                dish_text = dish_text.replace(
-                    "Pancake Thursday", "*🥞 Pancake Thursday*"
-                )
-            elif day["special_features"]["burger_friday"]:
-                logger.debug("Highlighting Burger Friday...")
-                dish_text = dish_text.replace("Burger Friday", "*🍔 Burger Friday")
-            day_dishes_text += "● " + dish_text + "\n"
-        return day_dishes_text
-
-    def menu_is_available(self, menu_data):
+    def menu_is_available(self, menu: Optional[WeekMenu]):
         """Checks if menu fluid_data from today is available.
 
-        :param menu_data: The menu fluid_data received from get_eatery_menu."""
-        return menu_data is not None and get_current_day_name() in menu_data["days"]
+        :param menu: The menu received from get_week_menu."""
+        return menu is not None and get_current_day_name() in menu.days
 
     @tasks.loop(minutes=15)
     async def update_menu_message(self, *args, **kwargs):
@@ -77,30 +76,29 @@ class Menu(Cog):
         search_week = (
             current_week if now.isoweekday() < 6 else current_week + 1
         )  # On weekends, try to search for fluid_data for the next week instead
-        menu_data = await get_eatery_menu(
-            menu_id=DEFAULT_EATERY_MENU_ID, week=search_week
-        )
-        logger.debug(f"Menu fluid_data: {menu_data}.")
-        saved_menu_data = get_menu_data()
-        current_menu_data = get_menu_data()["cached_menu"]
-        if menu_data is not None:
+        menu = await get_week_menu(menu_id=DEFAULT_EATERY_MENU_ID, week=search_week)
+        logger.debug(f"Menu fluid_data: {menu}.")
+        saved_menu_data = await get_menu_data()
+        if menu is not None:
             logger.info("Menu fluid_data is available.")
-            menu_data = menu_data["menu"]
-            saved_menu_data["cached_menu"] = menu_data
+            search_year = (
+                now if search_week == current_week else now + datetime.timedelta(days=7)
+            ).isocalendar()[0]
+            await menu_archive.add_week(search_year, menu)
+            saved_menu_data["cached_menu"] = menu.to_json()
             saved_menu_data["menu_cached_at"] = str(get_now())
             final_message = Embed(
-                title=f"📄 {menu_data['title']}",
-                description=f"Nedan hittar du lunchmenyn för vecka {menu_data['week_number']}.",
+                title=f"📄 {menu.title}",
+                description=f"Nedan hittar du lunchmenyn för vecka {menu.week_number}.",
                 color=MENU_EMBED_COLOR,
                 url="https://20alse.ssis.nu/lunch",
             )
             # For each day, add a field with the day menu items
-            for day in menu_data["days"].values():
+            for day in menu.days.values():
                 logger.debug(f"Adding information for day: {day}")
-                day_name = day["day_name"]["swedish"]
+                day_name = day.swedish_name
                 logger.debug(f"Adding fluid_data for day {day_name}...")
-                day_dishes = day["dishes"]
-                day_dishes_text = self.get_dish_text_for(day_dishes, day)
+                day_dishes_text = await self.get_dish_text_for(day)
                 final_message.add_field(
                     name=day_name, value=day_dishes_text, inline=False
                 )  # Add information about the dish
@@ -135,16 +133,17 @@ class Menu(Cog):
             or week_message_sent_at.isocalendar()[1] != current_week
         ):
             logger.info("Sending new week message...")
-            week_message = await information_channel.send(embed=final_message)
+            week_message = await send_managed_message(
+                information_channel, final_message
+            )
             saved_menu_data["menu_information_message_ids"]["week"] = week_message.id
             saved_menu_data["week_message_sent_at"] = time.time()
         else:
             logger.info("Trying to edit previous week meny message.")
             try:
-                previous_week_message = await information_channel.fetch_message(
-                    previous_week_menu_message_id
+                await edit_managed_message(
+                    information_channel, previous_week_menu_message_id, final_message
                 )
-                await previous_week_message.edit(embed=final_message)
             except Exception as e:
                 logger.info(
                     f"Failed to edit previous week menu message due to an exception: {e}!",
@@ -164,12 +163,12 @@ class Menu(Cog):
             text=f"Drivs av 20alse Eatery Lunch API | Meddelande uppdaterat {get_now().strftime('%Y-%m-%d %H:%M')}."
         )  # Add informational footer about latest update
         if (
-            self.menu_is_available(menu_data) and search_week == current_week
+            self.menu_is_available(menu) and search_week == current_week
         ):  # Check if menu fluid_data for the current day is available
             logger.info("Menu fluid_data for day is available.")
-            today = menu_data["days"][current_day_name]  # Get fluid_data for today
+            today = menu.days[current_day_name]  # Get fluid_data for today
             final_day_message.add_field(
-                name="Idag", value=self.get_dish_text_for(today["dishes"], today)
+                name="Idag", value=await self.get_dish_text_for(today)
             )
             if saved_menu_data.get("day_message_sent_at", None) is not None:
                 last_day_message_sent_at = datetime.datetime.fromtimestamp(
@@ -187,17 +186,20 @@ class Menu(Cog):
                 or last_day_message_sent_at.date() != now.date()
             ):  # If a message for today hasn't been sent
                 logger.info("Sending day information message...")
-                day_message = await information_channel.send(embed=final_day_message)
+                day_message = await send_managed_message(
+                    information_channel, final_day_message
+                )
                 saved_menu_data["menu_information_message_ids"]["day"] = day_message.id
                 saved_menu_data["day_message_sent_at"] = time.time()
             else:
                 try:
                     logger.info("Trying to edit today message...")
-                    previous_day_message = await information_channel.fetch_message(
-                        previous_today_menu_message_id
-                    )
-                    await previous_day_message.edit(embed=final_day_message)
-                    logger.info("Today message was edited.")
+                    if await edit_managed_message(
+                        information_channel,
+                        previous_today_menu_message_id,
+                        final_day_message,
+                    ):
+                        logger.info("Today message was edited.")
                 except Exception as e:
                     logger.warning(
                         "Failed to edit previous today menu message! It will be ignored.",
@@ -209,7 +211,7 @@ class Menu(Cog):
             )
         # Now, update JSON
         logger.info("Updating cached menu JSON...")
-        write_menu_data(saved_menu_data)
+        await write_menu_data(saved_menu_data)
         logger.info("Cached menu JSON written to file.")
 
     async def send_daily_menu_message(self):
@@ -219,24 +221,21 @@ class Menu(Cog):
         now = get_now()
         today_name = get_current_day_name()
         week = now.isocalendar()[1]
-        menu_data = await get_eatery_menu(DEFAULT_EATERY_MENU_ID, week)
-        if menu_data != None:
-            menu_data = menu_data["menu"]
-        if self.menu_is_available(menu_data):
+        menu = await get_week_menu(DEFAULT_EATERY_MENU_ID, week)
+        if self.menu_is_available(menu):
             logger.info("Menu is available.")
             # Get who to send out the message to
             midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            subscribers_to_send_messages_to = subscription.get_users_not_notified_after(
-                midnight, "food", "daily"
+            period = now.date().isoformat()  # Every subscriber gets one message per day
+            subscribers_to_send_messages_to = (
+                await subscription.get_users_not_notified_after(
+                    midnight, "food", "daily", period
+                )
             )
             logger.info(
                 f"Sending menu information messages to {len(subscribers_to_send_messages_to)} subscribers."
             )
-            subscriptions_data = subscription.get_subscriptions()
-            day_menu_data = menu_data["days"][today_name]
-            day_menu_text = self.get_dish_text_for(
-                day_menu_data["dishes"], day_menu_data
-            )
+            day_menu_text = await self.get_dish_text_for(menu.days[today_name])
             daily_menu_message = Embed(
                 title="🍽️ Mat idag på Eatery",
                 description=f"Hej där! Här är dagens meny på Eatery:",
@@ -246,26 +245,19 @@ class Menu(Cog):
             daily_menu_message.add_field(
                 name="Se veckomenyn", value=WEEK_MENU_LINK_TEXT, inline=False
             )
-            for subscriber_user_id in subscribers_to_send_messages_to:
-                try:
-                    user = self.bot.get_user(subscriber_user_id)
-                    if user is not None:
-                        await user.send(embed=daily_menu_message)
-                    else:
-                        raise Exception("User is None.")
-                    logger.info(f"Successfully sent message to {user.mention}.")
-                    subscriptions_data["subscriptions"]["food"]["daily"][
-                        "subscriptions"
-                    ][str(subscriber_user_id)]["last_notified_at"] = str(now)
-                except Exception as e:
-                    logger.warning(
-                        f"Failed to send menu information to {subscriber_user_id}. This might be because their DMs are closed (exception was: {e}).",
-                        exc_info=True,
-                    )
-            # Update subscription fluid_data
-            if len(subscribers_to_send_messages_to) > 0:
-                logger.info("Updating subscription tracking file...")
-                subscription.update_subscriptions(subscriptions_data)
+            # Messages are sent to multiple subscribers at the same time (see fanout.py).
+            # Who has been notified is saved in batches while sending, so a restart does not send anything twice.
+            async with subscription.NotificationCheckpoint(
+                "food", "daily", now, period
+            ) as checkpoint:
+                result = await fan_out(
+                    subscribers_to_send_messages_to,
+                    lambda user_id: send_direct_message(
+                        self.bot, user_id, embed=daily_menu_message
+                    ),
+                    on_delivered=checkpoint.record,
+                )
+            logger.info(f"Daily menu messages sent: {result.get_summary()}")
         else:
             logger.warning("Menu is not available. No daily message will be sent!")
 
@@ -275,72 +267,109 @@ class Menu(Cog):
         now = get_now()
         week_start = now.replace(
             hour=0, minute=0, second=0, microsecond=0
-        ) - datetime.timedelta(days=7 - now.isoweekday())
-        logger.info(week_start)
+        ) - datetime.timedelta(days=now.isoweekday() - 1)
+        iso_year, iso_week, _ = now.isocalendar()
+        period = (
+            f"{iso_year}-W{iso_week:02d}"  # Every subscriber gets one message per week
+        )
         # Check if menu is available
-        menu_data = await get_eatery_menu(DEFAULT_EATERY_MENU_ID, now.isocalendar()[1])
-        if menu_data is not None:
-            menu_data = menu_data["menu"]
-        if self.menu_is_available(menu_data):
+        menu = await get_week_menu(DEFAULT_EATERY_MENU_ID, now.isocalendar()[1])
+        if self.menu_is_available(menu):
             logger.info("Week menu is available.")
             # Get who to send the message to
-            subscribers_to_send_messages_to = subscription.get_users_not_notified_after(
-                week_start, "food", "weekly"
+            subscribers_to_send_messages_to = (
+                await subscription.get_users_not_notified_after(
+                    week_start, "food", "weekly", period
+                )
             )
             menu_message = Embed(
-                title=menu_data["title"],
+                title=menu.title,
                 description="Nedan hittar du menyn.",
                 color=MENU_EMBED_COLOR,
             )
-            subscription_data = subscription.get_subscriptions()
-            for day in menu_data["days"].keys():
-                day_data = menu_data["days"][day]
-                menu_text = self.get_dish_text_for(day_data["dishes"], day_data)
+            for day in menu.days.values():
+                menu_text = await self.get_dish_text_for(day)
                 menu_message.add_field(
-                    name=day_data["day_name"]["swedish"], value=menu_text, inline=False
+                    name=day.swedish_name, value=menu_text, inline=False
                 )
             menu_message.add_field(
                 name="Se menyn", value=WEEK_MENU_LINK_TEXT, inline=False
             )
-            for subscriber_user_id in subscribers_to_send_messages_to:
-                try:
-                    user = self.bot.get_user(subscriber_user_id)
-                    if user is not None:
-                        await user.send(embed=menu_message)
-                        logger.info(
-                            f"Successfully sent weekly menu to user: {user.mention}."
-                        )
-                        subscription_data["subscriptions"]["food"]["weekly"][
-                            "subscriptions"
-                        ][str(subscriber_user_id)]["last_notified_at"] = str(get_now())
-                    else:
-                        raise Exception("User is None.")
-
-                except Exception as e:
-                    logger.warning(
-                        f"Failed to send menu message to user {subscriber_user_id}. The user might have their DMs closed. The error was: {e}.",
-                        exc_info=True,
-                    )
-            logger.info(
-                f"Processed weekly menu messages for {len(subscribers_to_send_messages_to)} subscribers."
-            )
+            # Messages are sent to multiple subscribers at the same time (see fanout.py)
+            async with subscription.NotificationCheckpoint(
+                "food", "weekly", now, period
+            ) as checkpoint:
+                result = await fan_out(
+                    subscribers_to_send_messages_to,
+                    lambda user_id: send_direct_message(
+                        self.bot, user_id, embed=menu_message
+                    ),
+                    on_delivered=checkpoint.record,
+                )
+            logger.info(f"Weekly menu messages sent: {result.get_summary()}")
         else:
             logger.warning(
                 "Week menu is not available! No weekly message will be sent."
             )
 
-    @tasks.loop(hours=1)
     async def send_subscribed_menu_messages(self):
-        """Sends out menu messages to people that have subscribed to the menu if a message hasn't been sent to them today already."""
-        now = get_now()
-        await self.bot.wait_until_ready()  # Wait until the bot is ready
-        logger.info("Checking sending of menu messages...")
-        # Do not send out messages before 8AM and not after 10PM
-        if 9 <= now.hour >= 22:
-            logger.info("Will not send out menu message, is too late.")
-            return
-        logger.info("Checking and sending out messages...")
+        """Sends out menu messages to people that have subscribed to the menu if a message hasn't been sent to them today already.
+        Run by the scheduler (see scheduler.py)."""
+        logger.info("Checking and sending out menu messages...")
         await self.send_daily_menu_message()
         logger.info("Handled daily menu messages. Moving on to weekly ones...")
         await self.send_weekly_menu_message()
         logger.info("Handled weekly menu messages.")
+
+    @nextcord.slash_command(
+        description="Sök efter när en maträtt senast serverades och hur ofta den brukar finnas på menyn."
+    )
+    async def search_menu(
+        self,
+        interaction: Interaction,
+        query: str = SlashOption(
+            name="maträtt", description="Maträtten att söka efter, t.ex. pannkakor"
+        ),
+    ):
+        logger.info("Got a request to search the menu archive!")
+        archived_dishes = await menu_archive.search(query)
+        if len(archived_dishes) == 0:
+            logger.info("No dishes found.")
+            await interaction.response.send_message(
+                embed=generate_error_embed(
+                    "Hittade inget",
+                    f"Jag hittade ingen maträtt som matchar `{query}` bland menyerna som jag har sparat.",
+                ),
+                ephemeral=True,
+            )
+            return
+        served_days = {
+            (archived_dish.year, archived_dish.week_number, archived_dish.day_id)
+            for archived_dish in archived_dishes
+        }
+        served_weeks = {
+            (archived_dish.year, archived_dish.week_number)
+            for archived_dish in archived_dishes
+        }
+        last_served_dish = archived_dishes[0]
+        final_embed = Embed(
+            title=f"🔎 Sökresultat för {query}",
+            description=f"Serverades senast på {last_served_dish.day_name.lower()} vecka {last_served_dish.week_number} {last_served_dish.year}: *{last_served_dish.dish}*",
+            color=MENU_EMBED_COLOR,
+        )
+        final_embed.add_field(
+            name="Hur ofta?",
+            value=f"{len(served_days)} dagar under {len(served_weeks)} av {len(menu_archive.weeks)} sparade veckor.",
+            inline=False,
+        )
+        final_embed.add_field(
+            name="Senaste tillfällena",
+            value="\n".join(
+                [
+                    f"● {archived_dish.date.strftime('%Y-%m-%d') if archived_dish.date is not None else f'v.{archived_dish.week_number} {archived_dish.year}'}: {archived_dish.dish}"
+                    for archived_dish in archived_dishes[:10]
+                ]
+            )[:1024],
+            inline=False,
+        )
+        await interaction.response.send_message(embed=final_embed)
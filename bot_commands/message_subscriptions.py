@@ -15,6 +15,30 @@ class SubscribedMessagesSubscription(Cog):
         self.bot = bot
         self.logger = logging.getLogger(__name__)
 
+    async def ensure_subscription_exists(
+        self, interaction: Interaction, category: str, subcategory: str
+    ) -> bool:
+        """Checks that a subscription exists, and sends an error message to the user if it does not.
+
+        :param interaction: The interaction of the command.
+
+        :param category: The category that the user entered.
+
+        :param subcategory: The subcategory that the user entered.
+
+        :returns: True if the subscription exists, False if not."""
+        if await subscription.subscription_exists(category, subcategory):
+            return True
+        self.logger.info(
+            f"User requested unknown subscription {category}/{subcategory}."
+        )
+        error_embed = generate_error_embed(
+            "Finns inte",
+            f"Jag hittar inget meddelandeutskick som heter `{category}`/`{subcategory}`. Välj ett av alternativen som föreslås när du skriver!",
+        )
+        await interaction.response.send_message(embed=error_embed, delete_after=60)
+        return False
+
     @nextcord.slash_command(description="Prenumerera på ett meddelandeutskick.")
     async def subscribe_to_message(
         self,
@@ -28,8 +52,12 @@ class SubscribedMessagesSubscription(Cog):
     ):
         """Subscribes to a certain subcategory."""
         self.logger.info("Got a request to subscribe to a club category...")
+        if not await self.ensure_subscription_exists(
+            interaction, category, subcategory
+        ):
+            return
         # Check if user is subscribed
-        if subscription.is_subscribed_to(interaction.user, category, subcategory):
+        if await subscription.is_subscribed_to(interaction.user, category, subcategory):
             self.logger.info("User is already subscribed!")
             error_embed = generate_error_embed(
                 "Redan prenumererad",
@@ -38,7 +66,7 @@ class SubscribedMessagesSubscription(Cog):
             await interaction.response.send_message(embed=error_embed, delete_after=60)
             return
         self.logger.info("Subscribing user...")
-        subscription.change_subscriber_status(
+        await subscription.change_subscriber_status(
             category, subcategory, interaction.user, True
         )
         self.logger.info("User was subscribed.")
@@ -73,8 +101,14 @@ class SubscribedMessagesSubscription(Cog):
     ):
         """Unsubscribes to a certain subcategory."""
         self.logger.info("Got a request to unsubscribe to a club category...")
+        if not await self.ensure_subscription_exists(
+            interaction, category, subcategory
+        ):
+            return
         # Check if user is subscribed
-        if not subscription.is_subscribed_to(interaction.user, category, subcategory):
+        if not await subscription.is_subscribed_to(
+            interaction.user, category, subcategory
+        ):
             self.logger.info("User is not subscribed!")
             error_embed = generate_error_embed(
                 "Inte prenumererad",
@@ -83,7 +117,7 @@ class SubscribedMessagesSubscription(Cog):
             await interaction.response.send_message(embed=error_embed, delete_after=60)
             return
         self.logger.info("Unsubscribing user...")
-        subscription.change_subscriber_status(
+        await subscription.change_subscriber_status(
             category, subcategory, interaction.user, False
         )
         self.logger.info("User was unsubscribed.")
@@ -103,39 +137,18 @@ class SubscribedMessagesSubscription(Cog):
     @unsubscribe_to_message.on_autocomplete("category")
     async def autocomplete_category(self, interaction: Interaction, category: str):
         """Function to autocomplete category"""
-        subscriptions = subscription.get_subscriptions()
-        if not category:  # Provide whole list of categories if none exist.
-            self.logger.debug("Autocompleting categories by returning all...")
-            await interaction.response.send_autocomplete(
-                list(subscriptions["subscriptions"].keys())
-            )
-        else:  # If a category ID has been set
-            self.logger.debug("Autocompleting categories by closest values...")
-            closest_category_ids = [
-                available_category
-                for available_category in subscriptions["subscriptions"].keys()
-                if available_category.startswith(category)
-            ]
-            await interaction.response.send_autocomplete(closest_category_ids)
+        self.logger.debug("Autocompleting categories...")
+        await interaction.response.send_autocomplete(
+            await subscription.search_categories(category)
+        )
 
     @subscribe_to_message.on_autocomplete("subcategory")
     @unsubscribe_to_message.on_autocomplete("subcategory")
     async def autocomplete_subcategory(
         self, interaction: Interaction, subcategory: str, category: str
     ):
-        subscriptions = subscription.get_subscriptions()
-        if not subcategory:
-            subcategories = list(subscriptions["subscriptions"][category].keys())
-            if category:
-                self.logger.debug("Autocompleting subcategory list by returning all..")
-                await interaction.response.send_autocomplete(subcategories)
-            else:
-                self.logger.debug(
-                    "Autocompleting subcategory list by closest values..."
-                )
-                closest_subcategory_ids = [
-                    available_subcategory
-                    for available_subcategory in subcategories
-                    if available_subcategory.startswith(subcategory)
-                ]
-                await interaction.response.send_autocomplete(closest_subcategory_ids)
+        """Function to autocomplete subcategory. Only subcategories of the chosen category are suggested."""
+        self.logger.debug("Autocompleting subcategories...")
+        await interaction.response.send_autocomplete(
+            await subscription.search_subcategories(category, subcategory)
+        )
@@ -2,13 +2,14 @@
 Contains commands related to "pentryansvar".
 """
 from nextcord.ext.commands import Cog
-from nextcord.ext import tasks
 from utils.pentry import (
     get_pentryansvar_data,
     get_pentryansvar,
     write_pentryansvar_data,
 )
 from utils.general import get_now, class_name_to_role, find_person_tag
+from utils.managed_messages import send_managed_message, edit_managed_message
+from utils.scheduler import scheduler
 from utils.color_const import PENTRYANSVAR_EMBED_COLOR
 import logging
 from nextcord import Embed
@@ -21,24 +22,27 @@ class Pentry(Cog):
     def __init__(self, bot):
         """Initializes the cog."""
         self.bot = bot
-        self.pentryansvar_task_loop.start()  # Start pentryansvar task loop
+        # Check pentryansvar every hour during school days
+        scheduler.add_job(
+            "pentryansvar",
+            "weekdays 06:00-18:00/60",
+            self.update_pentryansvar_message,
+            skip_holidays=True,
+            run_at_start=True,
+        )
 
     def cog_unload(self):
         """Runs when the cog is unloaded."""
-        self.pentryansvar_task_loop.cancel()  # Cancel task on cog unload
+        scheduler.remove_job("pentryansvar")  # Stop the job on cog unload
 
-    @tasks.loop(hours=1)
-    async def pentryansvar_task_loop(self):
-        """The pentryansvar task loop checks if information about pentryansvar has been sent for the current week, or if the fluid_data has changed.
-        If not, it will try to fix that by downloading information.
+    async def update_pentryansvar_message(self):
+        """Checks if information about pentryansvar has been sent for the current week, or if the fluid_data has changed.
+        If not, it will try to fix that by downloading information. Run by the scheduler (see scheduler.py).
         Since I maintain this server, I think a request per hour is totally reasonable.
         TODO: Make this command callable by admins if needed"""
         logger.info("Checking for pentryansvar information...")
-        logger.info("Waiting until bot is ready...")
-        await self.bot.wait_until_ready()
-        logger.info("Bot is ready.")
         # Don't perform the check on weekends
-        if get_now().isoweekday() <= 7:
+        if get_now().isoweekday() <= 5:
             pentryansvar_data = [
                 {
                     "pentry_name": "Pentry 2",
@@ -66,7 +70,7 @@ class Pentry(Cog):
                 },
             ]
             cached_pentryansvar_data = (
-                get_pentryansvar_data()
+                await get_pentryansvar_data()
             )  # This is some fluid_data that we have saved about the previous message
             if pentryansvar_data == None:
                 logger.warning(
@@ -173,8 +177,8 @@ class Pentry(Cog):
             # Send the message or edit it
             if send_new_information_message:
                 logger.info("Sending new message...")
-                pentry_message = await pentryansvar_message_channel.send(
-                    embed=final_message
+                pentry_message = await send_managed_message(
+                    pentryansvar_message_channel, final_message
                 )
                 logger.info("New pentryansvar message sent.")
                 cached_pentryansvar_data["information_message"] = {
@@ -184,11 +188,12 @@ class Pentry(Cog):
                 logger.debug("Information message parameters updated in memory.")
             else:
                 logger.info("Editing previous message...")
-                previous_message = await pentryansvar_message_channel.fetch_message(
-                    cached_pentryansvar_data["information_message"]["id"]
-                )
-                await previous_message.edit(embed=final_message)
-                logger.info("Previous message edited.")
+                if await edit_managed_message(
+                    pentryansvar_message_channel,
+                    cached_pentryansvar_data["information_message"]["id"],
+                    final_message,
+                ):
+                    logger.info("Previous message edited.")
             cached_pentryansvar_data[
                 "cached_data"
             ] = pentryansvar_data  # Save cached fluid_data
@@ -197,7 +202,7 @@ class Pentry(Cog):
             )  # Update update date
             logger.debug("Cached pentryansvar fluid_data updated in memory.")
             logger.info("Updating previous cached fluid_data...")
-            write_pentryansvar_data(cached_pentryansvar_data)
+            await write_pentryansvar_data(cached_pentryansvar_data)
             logger.info("Updated previous cached fluid_data.")
         else:
             logger.info("It is weekend. A check will not be performed.")
@@ -1,35 +1,253 @@
 """schedule_caching.py
 Contains bot commands related to school schedules as well as tasks
 for downloading them."""
-import logging
+import asyncio, logging
+from typing import Dict, List, Optional
+from nextcord import Embed
 from nextcord.ext.commands import Cog, Bot
-from nextcord.ext import tasks
 from utils import schedule_caching
-from utils.general import get_now
+from utils.color_const import SCHEDULE_EMBED_COLOR
+from utils.fanout import fan_out, send_direct_message
+from utils.general import get_now, get_active_classes
+from utils.schedule_changes import ScheduleDiff
+from utils.schedule_index import Lesson, get_schedule_index
+from utils.schedule_timeline import (
+    ScheduleNotificationEvent,
+    ScheduleTimeline,
+    SCHEDULE_NOTIFICATION_LEAD_TIME,
+    build_schedule_timeline,
+)
+from utils.scheduler import scheduler
+import utils.subscription as subscription
+
+# Schedule subscriptions are in this category, with the lowercase class name as the subcategory
+SCHEDULE_SUBSCRIPTION_CATEGORY = "schema"
+# The longest time (in seconds) that send_schedule_messages() sleeps before checking the time again
+SCHEDULE_TIMELINE_MAX_SLEEP = 3600
+
+
+def get_lesson_text(lesson: Lesson) -> str:
+    """Converts a lesson into a human-readable format.
+
+    :param lesson: The lesson."""
+    lesson_text = f"**{lesson.name}** {lesson.start.strftime('%H:%M')}-{lesson.end.strftime('%H:%M')}"
+    if lesson.room is not None:
+        lesson_text += f" i {lesson.room}"
+    return lesson_text
 
 
 class Schedules(Cog):
     def __init__(self, bot: Bot):
         self.bot = bot
         self.logger = logging.getLogger(__name__)
+        # The schedule notifications for today (see schedule_timeline.py). Rebuilt after every download
+        self.schedule_timeline: Optional[ScheduleTimeline] = None
+        # Set to wake up send_schedule_messages() when the timeline has been rebuilt. Created when it starts running,
+        # since it must be created from the event loop
+        self.schedule_timeline_changed: Optional[asyncio.Event] = None
+        # Download schedules every 30 minutes during school days
+        scheduler.add_job(
+            "schedule_caching",
+            "weekdays 06:00-17:30/30",
+            self.cache_schedules,
+            skip_holidays=True,
+            run_at_start=True,
+        )
+        # Send schedule messages during school days. The job runs until the end of the day
+        scheduler.add_job(
+            "schedule_messages",
+            "weekdays 06:00",
+            self.send_schedule_messages,
+            skip_holidays=True,
+            run_at_start=True,
+        )
+
+    def cog_unload(self):
+        """Runs when the cog is unloaded."""
+        scheduler.remove_job("schedule_caching")
+        scheduler.remove_job("schedule_messages")
 
-    @tasks.loop(minutes=30)
     async def cache_schedules(self):
+        """Downloads schedules and tells the subscribers of every class whose schedule has changed.
+        Run by the scheduler (see scheduler.py)."""
         self.logger.debug("Caching schedules...")
-        await schedule_caching.cache_schedules()
+        schedule_diffs = await schedule_caching.cache_schedules()
         self.logger.debug("Schedule caching complete.")
+        await self.update_schedule_timeline()
+        for schedule_diff in schedule_diffs:
+            await self.send_schedule_change_messages(schedule_diff)
 
-    @tasks.loop(minutes=5)
-    async def send_schedule_messages(self):
-        """Checks for any messages related to the school schedule should be sent.
-        and sends them to subscribed users if available."""
-        self.logger.debug("Sending out schedule messages...")
-        await self.bot.wait_until_ready()
-        self.logger.debug("Bot is ready!")
-        # Get current time
+    def get_schedule_change_embed(self, schedule_diff: ScheduleDiff) -> Embed:
+        """Creates the message that is sent to subscribers when the schedule of their class has changed.
+
+        :param schedule_diff: The changes in the schedule."""
+        schedule_change_embed = Embed(
+            title=f"🗓️ Schemaändring för {schedule_diff.class_name}",
+            description=f"Schemat för {schedule_diff.day.strftime('%Y-%m-%d')} har ändrats:",
+            color=SCHEDULE_EMBED_COLOR,
+        )
+        if len(schedule_diff.moved) > 0:
+            schedule_change_embed.add_field(
+                name="Flyttade lektioner",
+                value="\n".join(
+                    [
+                        f"● {get_lesson_text(old_lesson)} ➡ {get_lesson_text(new_lesson)}"
+                        for old_lesson, new_lesson in schedule_diff.moved
+                    ]
+                )[:1024],
+                inline=False,
+            )
+        if len(schedule_diff.removed) > 0:
+            schedule_change_embed.add_field(
+                name="Inställda lektioner",
+                value="\n".join(
+                    [
+                        f"● ~~{get_lesson_text(lesson)}~~"
+                        for lesson in schedule_diff.removed
+                    ]
+                )[:1024],
+                inline=False,
+            )
+        if len(schedule_diff.added) > 0:
+            schedule_change_embed.add_field(
+                name="Nya lektioner",
+                value="\n".join(
+                    [f"● {get_lesson_text(lesson)}" for lesson in schedule_diff.added]
+                )[:1024],
+                inline=False,
+            )
+        schedule_change_embed.set_footer(
+            text=f"Du får detta meddelande eftersom du prenumererar på schemat för {schedule_diff.class_name}."
+        )
+        return schedule_change_embed
+
+    async def send_schedule_change_messages(self, schedule_diff: ScheduleDiff):
+        """Tells the subscribers of a class that its schedule has changed.
+
+        :param schedule_diff: The changes in the schedule."""
+        subscriber_ids = await subscription.get_subscribers(
+            SCHEDULE_SUBSCRIPTION_CATEGORY, schedule_diff.class_name.lower()
+        )
+        if len(subscriber_ids) == 0:
+            self.logger.info(
+                f"Nobody subscribes to the schedule of {schedule_diff.class_name}."
+            )
+            return
+        schedule_change_embed = self.get_schedule_change_embed(schedule_diff)
+        # Messages are sent to multiple subscribers at the same time (see fanout.py)
+        result = await fan_out(
+            subscriber_ids,
+            lambda user_id: send_direct_message(
+                self.bot, user_id, embed=schedule_change_embed
+            ),
+        )
+        self.logger.info(
+            f"Schedule change messages for {schedule_diff.class_name} sent: {result.get_summary()}"
+        )
+
+    async def update_schedule_timeline(self):
+        """Rebuilds the timeline of schedule notifications from the cached schedules and wakes up the sender."""
         now = get_now()
+        notified_until = now
         if (
-            now.hour < 8 or now.hour > 18
-        ):  # Skicka inte scheman efter ett visst klockslag
-            self.logger.info("Ska inte kolla efter schemameddelanden nu.")
+            self.schedule_timeline is not None
+            and self.schedule_timeline.notified_until.date() == now.date()
+        ):
+            # Do not send the notifications that the previous timeline has already sent again
+            notified_until = self.schedule_timeline.notified_until
+        self.schedule_timeline = build_schedule_timeline(
+            await get_schedule_index(), get_active_classes(), notified_until
+        )
+        if self.schedule_timeline_changed is not None:
+            self.schedule_timeline_changed.set()
+
+    def get_lesson_notification_embed(self, lessons: List[Lesson]) -> Embed:
+        """Creates the message that is sent to subscribers when lessons of their class are about to start.
+
+        :param lessons: The lessons that are about to start, all for the same class."""
+        lesson_notification_embed = Embed(
+            title=f"🔔 Lektion om {SCHEDULE_NOTIFICATION_LEAD_TIME} minuter för {lessons[0].class_name}",
+            description="\n".join(
+                [f"● {get_lesson_text(lesson)}" for lesson in lessons]
+            ),
+            color=SCHEDULE_EMBED_COLOR,
+        )
+        lesson_notification_embed.set_footer(
+            text=f"Du får detta meddelande eftersom du prenumererar på schemat för {lessons[0].class_name}."
+        )
+        return lesson_notification_embed
+
+    async def send_lesson_notifications(
+        self, schedule_notification_events: List[ScheduleNotificationEvent]
+    ):
+        """Sends the notifications for lessons that are about to start to the subscribers of their classes.
+        A subscriber of multiple classes gets one message with the notifications for all of them.
+
+        :param schedule_notification_events: The events to send notifications for."""
+        # Mapping: class name --> lessons that are about to start
+        lessons_by_class: Dict[str, List[Lesson]] = {}
+        for schedule_notification_event in schedule_notification_events:
+            lesson = schedule_notification_event.lesson
+            lessons_by_class.setdefault(lesson.class_name, []).append(lesson)
+        # Mapping: user ID --> messages to send to the user
+        embeds_by_user: Dict[int, List[Embed]] = {}
+        for class_name, lessons in lessons_by_class.items():
+            subscriber_ids = await subscription.get_subscribers(
+                SCHEDULE_SUBSCRIPTION_CATEGORY, class_name.lower()
+            )
+            if len(subscriber_ids) == 0:
+                continue
+            lesson_notification_embed = self.get_lesson_notification_embed(lessons)
+            for subscriber_id in subscriber_ids:
+                embeds_by_user.setdefault(subscriber_id, []).append(
+                    lesson_notification_embed
+                )
+        if len(embeds_by_user) == 0:
+            self.logger.debug(
+                "Nobody subscribes to the lessons that are about to start."
+            )
             return
+        result = await fan_out(
+            list(embeds_by_user.keys()),
+            lambda user_id: send_direct_message(
+                self.bot, user_id, embeds=embeds_by_user[user_id][:10]
+            ),
+        )
+        self.logger.info(
+            f"Lesson notifications for {len(lessons_by_class)} classes sent: {result.get_summary()}"
+        )
+
+    async def send_schedule_messages(self):
+        """Sends notifications about lessons that are about to start to subscribed users, at the times in the schedule timeline.
+        Run by the scheduler (see scheduler.py) at the start of every school day, and sleeps until the next notification
+        is due until the day is over."""
+        self.schedule_timeline_changed = asyncio.Event()
+        started_on = get_now().date()
+        if (
+            self.schedule_timeline is None
+            or self.schedule_timeline.notified_until.date() != started_on
+        ):
+            await self.update_schedule_timeline()
+        while True:
+            self.schedule_timeline_changed.clear()
+            now = get_now()
+            if now.date() != started_on:
+                self.logger.info("The school day is over. Stopping schedule messages.")
+                return
+            due_events = self.schedule_timeline.pop_due(now)
+            if len(due_events) > 0:
+                await self.send_lesson_notifications(due_events)
+            next_event_at = self.schedule_timeline.next_event_at
+            # Sleep until the next notification, or check the date again at most once an hour
+            sleep_time = SCHEDULE_TIMELINE_MAX_SLEEP
+            if next_event_at is not None:
+                sleep_time = min(
+                    max((next_event_at - get_now()).total_seconds(), 0),
+                    SCHEDULE_TIMELINE_MAX_SLEEP,
+                )
+            try:
+                await asyncio.wait_for(
+                    self.schedule_timeline_changed.wait(), sleep_time
+                )
+            except asyncio.TimeoutError:
+                pass
@@ -1,15 +1,17 @@
 """seasonal_profile_pictures.py
 Contains a cog to change bot profile pictures depending on the current season.
 Used to implement special profile pictures for spring, Christmas, etc."""
-from nextcord.ext import commands, tasks
+from nextcord.ext import commands
 import logging, os, datetime, pytz
 from utils.general import (
     SEASONAL_PROFILE_PICTURES_FILEPATH,
-    get_json,
+    aget_json,
+    aread_file,
     get_now,
     SEASONAL_PROFILE_PICTURES_DIRECTORY,
     BASE_TIMEZONE,
 )
+from utils.scheduler import scheduler
 
 
 class SeasonalProfilePictures(commands.Cog):
@@ -17,16 +19,21 @@ class SeasonalProfilePictures(commands.Cog):
         """Initializes the seasonal profile pictures cog."""
         self.bot = bot
         self.logger = logging.getLogger(__name__)
-        self.check_profile_picture_is_correct.start()  # Start task for checking profile picture
+        # Seasons start and end at midnight, so check the profile picture right after that
+        scheduler.add_job(
+            "seasonal_profile_picture",
+            "daily 00:01",
+            self.check_profile_picture_is_correct,
+            run_at_start=True,
+        )
 
     def cog_unload(self):
         """Function that runs each time the cog is unloaded."""
-        self.check_profile_picture_is_correct.cancel()
+        scheduler.remove_job("seasonal_profile_picture")
 
-    @tasks.loop(hours=1)
-    async def check_profile_picture_is_correct(self, *args, **kwargs):
+    async def check_profile_picture_is_correct(self):
         """Checks that the bot's profile picture is correct and matches
-        the current one active for this season."""
+        the current one active for this season. Run by the scheduler (see scheduler.py)."""
         self.logger.info("Ensuring profile picture matches seasonal profile picture...")
         # Since this is essentially optional, allow an optional check
         if not os.path.exists(SEASONAL_PROFILE_PICTURES_FILEPATH):
@@ -34,7 +41,9 @@ class SeasonalProfilePictures(commands.Cog):
                 "No seasonal profile picture path is set! Seasonal profile pictures will be disabled."
             )
             return
-        seasonal_profile_pictures = get_json(SEASONAL_PROFILE_PICTURES_FILEPATH)
+        seasonal_profile_pictures = await aget_json(
+            SEASONAL_PROFILE_PICTURES_FILEPATH, copy=False
+        )
         # Iterate over seasonal profile pictures
         now = get_now()
         currently_active_profile_picture = None
@@ -62,14 +71,13 @@ class SeasonalProfilePictures(commands.Cog):
         else:
             self.logger.info("Found currently active profile picture!")
         # Open image
-        image_data = open(
+        image_data = await aread_file(
             os.path.join(
                 SEASONAL_PROFILE_PICTURES_DIRECTORY,
                 currently_active_profile_picture["filename"],
             ),
             "rb",
-        ).read()
-        await self.bot.wait_until_ready()
+        )
         await self.bot.user.edit(avatar=image_data)
         self.logger.info(
             f"Active image was ensured to {currently_active_profile_picture['filename']}."
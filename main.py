@@ -16,6 +16,9 @@ from bot_commands import (
 )  # Import bot commands
 from dotenv import load_dotenv
 from utils.general import LOGGING_DIRECTORY, LOGGING_HANDLER_FILEPATH
+from utils.document_store import document_store
+from utils.http_client import http_client
+from utils.scheduler import scheduler
 
 load_dotenv()
 # Set up logging
@@ -54,7 +57,27 @@ BOT_TOKEN = os.environ.get("SSIS_BOT_TOKEN")
 intents = (
     nextcord.Intents.all()
 )  # nextcord.Intents(messages=True, message_content=True, members=True)
-bot = commands.Bot(command_prefix="ssisb ", intents=intents)
+
+
+class SSISBot(commands.Bot):
+    async def start(self, *args, **kwargs):
+        """Runs when the bot is starting. Starts the HTTP client that is shared by all cogs
+        and the scheduler that runs their jobs before logging in."""
+        await http_client.start()
+        scheduler.start(self)
+        await super().start(*args, **kwargs)
+
+    async def close(self):
+        """Runs when the bot is shutting down. Makes sure that all data is written to disk
+        and closes the shared HTTP client."""
+        await scheduler.stop()
+        logger.info("Bot is closing. Writing pending data to disk...")
+        document_store.flush()
+        await http_client.close()
+        await super().close()
+
+
+bot = SSISBot(command_prefix="ssisb ", intents=intents)
 logger.info("Adding cogs...")
 cogs = [
     clubs.Clubs,
@@ -62,8 +85,8 @@ cogs = [
     menu.Menu,
     general.General,
     pentry.Pentry,
-    # message_subscriptions.SubscribedMessagesSubscription,
-    # schedules.Schedules,
+    message_subscriptions.SubscribedMessagesSubscription,
+    schedules.Schedules,
     good_morning.GoodMorning,
     seasonal_profile_pictures.SeasonalProfilePictures,
 ]
@@ -0,0 +1,78 @@
+"""test_autocomplete.py
+Tests for the prefix index that autocompletes slash command options (see utils/autocomplete.py)."""
+import unittest
+from utils.autocomplete import (
+    AUTOCOMPLETE_MAX_CHOICES,
+    PrefixIndex,
+    normalize_search_text,
+)
+
+
+class NormalizeSearchTextTests(unittest.TestCase):
+    def test_removes_case_and_diacritics(self):
+        self.assertEqual(normalize_search_text("Elevrådet"), "elevradet")
+        self.assertEqual(normalize_search_text("ÅÄÖ åäö é ü"), "aao aao e u")
+
+    def test_precomposed_and_decomposed_text_are_equal(self):
+        self.assertEqual(
+            normalize_search_text("Sm\u00f6rg\u00e5s"),
+            normalize_search_text("Smo\u0308rga\u030as"),
+        )
+
+    def test_casefolds(self):
+        self.assertEqual(
+            normalize_search_text("STRASSE"), normalize_search_text("Straße")
+        )
+
+
+class PrefixIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.index = PrefixIndex(
+            ["Elevrådet", "elevkåren", "Ekonomi", "Esport", "Fika", "Elevrådet"]
+        )
+
+    def test_duplicates_are_removed(self):
+        self.assertEqual(len(self.index), 5)
+
+    def test_search_ignores_case_and_diacritics(self):
+        self.assertEqual(self.index.search("elevra"), ["Elevrådet"])
+        self.assertEqual(self.index.search("ELEVRÅ"), ["Elevrådet"])
+        self.assertEqual(self.index.search("Elevk"), ["elevkåren"])
+
+    def test_search_returns_all_options_with_prefix_in_order(self):
+        self.assertEqual(self.index.search("el"), ["elevkåren", "Elevrådet"])
+        self.assertEqual(
+            self.index.search("e"), ["Ekonomi", "elevkåren", "Elevrådet", "Esport"]
+        )
+
+    def test_search_boundaries(self):
+        # Before the first and after the last option
+        self.assertEqual(self.index.search("a"), [])
+        self.assertEqual(self.index.search("fika"), ["Fika"])
+        self.assertEqual(self.index.search("fikarum"), [])
+        self.assertEqual(self.index.search("z"), [])
+        # A prefix that sorts between options without matching any of them
+        self.assertEqual(self.index.search("em"), [])
+
+    def test_empty_query_returns_first_options(self):
+        self.assertEqual(
+            self.index.search(None),
+            ["Ekonomi", "elevkåren", "Elevrådet", "Esport", "Fika"],
+        )
+        self.assertEqual(self.index.search(""), self.index.search(None))
+
+    def test_empty_index(self):
+        self.assertEqual(PrefixIndex([]).search("a"), [])
+
+    def test_limit(self):
+        index = PrefixIndex([f"Klubb {number:03}" for number in range(100)])
+        self.assertEqual(len(index.search("klubb")), AUTOCOMPLETE_MAX_CHOICES)
+        self.assertEqual(AUTOCOMPLETE_MAX_CHOICES, 25)
+        self.assertEqual(index.search("klubb")[-1], "Klubb 024")
+        self.assertEqual(
+            index.search("klubb 09", limit=3), ["Klubb 090", "Klubb 091", "Klubb 092"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
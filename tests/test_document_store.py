@@ -0,0 +1,146 @@
+"""test_document_store.py
+Tests for the write-behind document store (see utils/document_store.py)."""
+import asyncio, json, os, tempfile, unittest
+from unittest import mock
+from utils import document_store as document_store_module
+from utils.document_store import DocumentStore, atomic_write_text
+
+
+def write_file(filepath: str, document):
+    """Writes a document to a file, like someone editing it by hand would.
+
+    :param filepath: The path to the file.
+
+    :param document: The document to write."""
+    with open(filepath, "w", encoding="UTF-8") as json_file:
+        json_file.write(json.dumps(document))
+
+
+def read_file(filepath: str):
+    """Reads a document from a file without going through a document store.
+
+    :param filepath: The path to the file."""
+    with open(filepath, encoding="UTF-8") as json_file:
+        return json.loads(json_file.read())
+
+
+def write_without_flushing(store: DocumentStore, filepath: str, document):
+    """Writes a document to a store from an event loop and cancels the scheduled flush,
+    so that the document stays dirty until the test flushes it.
+
+    :param store: The store.
+
+    :param filepath: The path to the document.
+
+    :param document: The new content of the document."""
+
+    async def write():
+        store.write(filepath, document)
+        store.scheduled_flush.cancel()
+        store.scheduled_flush = None
+
+    asyncio.run(write())
+
+
+class DocumentStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.temporary_directory.name, "document.json")
+        write_file(self.filepath, {"value": 1})
+        self.store = DocumentStore(write_behind_window=60)
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def test_reloads_when_file_signature_changes(self):
+        self.assertEqual(self.store.get(self.filepath), {"value": 1})
+        self.assertEqual(self.store.get(self.filepath), {"value": 1})
+        version = self.store.get_version(self.filepath)
+        write_file(self.filepath, {"value": 1000})  # (a different size)
+        self.assertEqual(self.store.get(self.filepath), {"value": 1000})
+        self.assertGreater(self.store.get_version(self.filepath), version)
+        stats = self.store.get_stats()
+        self.assertEqual(stats["invalidations"], 1)
+        self.assertEqual(stats["misses"], 2)
+
+    def test_returned_copies_do_not_change_the_store(self):
+        document = self.store.get(self.filepath)
+        document["value"] = 2
+        self.assertEqual(self.store.get(self.filepath), {"value": 1})
+
+    def test_dirty_document_is_not_overwritten_by_reload(self):
+        self.store.get(self.filepath)
+        write_without_flushing(self.store, self.filepath, {"value": 2})
+        write_file(self.filepath, {"value": 3000})
+        self.assertEqual(self.store.get(self.filepath), {"value": 2})
+        self.store.flush()
+        self.assertEqual(read_file(self.filepath), {"value": 2})
+        self.assertNotIn(self.filepath, self.store.dirty_filepaths)
+
+    def test_flush_clears_dirty_flag_if_version_is_unchanged(self):
+        write_without_flushing(self.store, self.filepath, {"value": 2})
+        self.assertIn(self.filepath, self.store.dirty_filepaths)
+        self.store.flush()
+        self.assertNotIn(self.filepath, self.store.dirty_filepaths)
+        self.assertEqual(self.store.get_stats()["disk_writes"], 1)
+
+    def test_flush_keeps_dirty_flag_if_document_changes_during_write(self):
+        write_without_flushing(self.store, self.filepath, {"value": 2})
+
+        def write_while_changing_document(filepath, text):
+            # Simulates a change made from another thread while the file is being written
+            self.store.update(filepath, lambda document: document.update(value=3))
+            return atomic_write_text(filepath, text)
+
+        with mock.patch.object(
+            document_store_module,
+            "atomic_write_text",
+            side_effect=write_while_changing_document,
+        ):
+            self.store.flush()
+        self.assertEqual(read_file(self.filepath), {"value": 2})
+        self.assertIn(self.filepath, self.store.dirty_filepaths)
+        self.store.flush()
+        self.assertEqual(read_file(self.filepath), {"value": 3})
+        self.assertNotIn(self.filepath, self.store.dirty_filepaths)
+
+    def test_write_without_event_loop_is_written_directly(self):
+        self.store.write(self.filepath, {"value": 2})
+        self.assertEqual(read_file(self.filepath), {"value": 2})
+        self.assertNotIn(self.filepath, self.store.dirty_filepaths)
+
+
+class AtomicWriteTests(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.temporary_directory.name, "document.json")
+        write_file(self.filepath, {"value": 1})
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def test_writes_text_and_keeps_permissions(self):
+        os.chmod(self.filepath, 0o600)
+        bytes_written = atomic_write_text(self.filepath, '{"value": 2}')
+        self.assertEqual(bytes_written, len('{"value": 2}'))
+        self.assertEqual(read_file(self.filepath), {"value": 2})
+        self.assertEqual(os.stat(self.filepath).st_mode & 0o777, 0o600)
+
+    def test_failed_write_leaves_no_partial_file(self):
+        for failing_function in ["fsync", "replace"]:
+            with self.subTest(failing_function=failing_function):
+                with mock.patch.object(
+                    document_store_module.os,
+                    failing_function,
+                    side_effect=OSError("Disk full"),
+                ):
+                    with self.assertRaises(OSError):
+                        atomic_write_text(self.filepath, '{"value": 2, "more": true}')
+                self.assertEqual(read_file(self.filepath), {"value": 1})
+                self.assertEqual(
+                    os.listdir(self.temporary_directory.name), ["document.json"]
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+"""test_fanout.py
+Tests for sending to many recipients at once (see utils/fanout.py)."""
+import asyncio, unittest
+from utils.fanout import fan_out
+
+
+class FanOutTests(unittest.TestCase):
+    def test_delivers_to_everyone(self):
+        sent_to = []
+
+        async def send(user_id: int):
+            await asyncio.sleep(0)
+            sent_to.append(user_id)
+
+        result = asyncio.run(fan_out(range(50), send, concurrency=4))
+        self.assertEqual(sorted(sent_to), list(range(50)))
+        self.assertEqual(result.delivered, 50)
+        self.assertEqual(result.failed, 0)
+
+    def test_failing_callback_does_not_stop_other_sends(self):
+        sent_to = []
+        recorded = []
+
+        async def send(user_id: int):
+            await asyncio.sleep(0)
+            sent_to.append(user_id)
+
+        async def on_delivered(user_id: int):
+            if user_id == 3:
+                raise OSError("Disk full")
+            recorded.append(user_id)
+
+        with self.assertRaises(OSError):
+            asyncio.run(
+                fan_out(range(20), send, on_delivered=on_delivered, concurrency=4)
+            )
+        # Everyone was sent to and recorded before the exception was raised, except the failing record
+        self.assertEqual(sorted(sent_to), list(range(20)))
+        self.assertEqual(sorted(recorded), [i for i in range(20) if i != 3])
+
+    def test_failed_sends_are_reported(self):
+        failed = []
+
+        async def send(user_id: int):
+            if user_id % 2 == 0:
+                raise ValueError("DMs closed")
+
+        async def on_failed(user_id: int, exception: Exception):
+            failed.append(user_id)
+
+        result = asyncio.run(fan_out(range(10), send, on_failed=on_failed))
+        self.assertEqual(sorted(failed), [0, 2, 4, 6, 8])
+        self.assertEqual(result.delivered, 5)
+        self.assertEqual(result.failed, 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
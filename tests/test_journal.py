@@ -0,0 +1,194 @@
+"""test_journal.py
+Tests for the append-only journal (see utils/journal.py)."""
+import asyncio, json, os, tempfile, threading, time, unittest
+from unittest import mock
+from utils.document_store import document_store
+from utils.journal import Journal, journals
+
+
+def add_subscriber(document, record):
+    if record["user_id"] not in document["subscribers"]:
+        document["subscribers"].append(record["user_id"])
+
+
+def remove_subscriber(document, record):
+    if record["user_id"] in document["subscribers"]:
+        document["subscribers"].remove(record["user_id"])
+
+
+OPERATIONS = {"subscribe": add_subscriber, "unsubscribe": remove_subscriber}
+
+
+def read_snapshot(filepath: str):
+    """Reads a snapshot file without going through the document store.
+
+    :param filepath: The path to the snapshot."""
+    with open(filepath, encoding="UTF-8") as json_file:
+        return json.loads(json_file.read())
+
+
+class JournalTests(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        self.snapshot_filepath = os.path.join(
+            self.temporary_directory.name, "subscriptions.json"
+        )
+        with open(self.snapshot_filepath, "w", encoding="UTF-8") as snapshot_file:
+            snapshot_file.write(json.dumps({"subscribers": []}))
+        self.journal = Journal(self.snapshot_filepath, OPERATIONS)
+
+    def tearDown(self):
+        self.forget_document()
+        with document_store.lock:
+            document_store.load_hooks.pop(self.snapshot_filepath, None)
+            document_store.versions.pop(self.snapshot_filepath, None)
+        journals.pop(self.snapshot_filepath, None)
+        self.temporary_directory.cleanup()
+
+    def forget_document(self):
+        """Drops the document from memory without writing it, like a crash would."""
+        with document_store.lock:
+            document_store.documents.pop(self.snapshot_filepath, None)
+            document_store.file_signatures.pop(self.snapshot_filepath, None)
+            document_store.dirty_filepaths.discard(self.snapshot_filepath)
+
+    def restart(self):
+        """Simulates restarting the bot: the document is loaded from the snapshot and the journal is replayed.
+
+        :returns: The loaded document."""
+        self.forget_document()
+        return document_store.get(self.snapshot_filepath)
+
+    def read_journal(self):
+        with open(self.journal.journal_filepath, encoding="UTF-8") as journal_file:
+            return journal_file.read()
+
+    def test_append_and_replay(self):
+        self.journal.append("subscribe", user_id=1)
+        self.journal.append("subscribe", user_id=2)
+        self.journal.append("unsubscribe", user_id=1)
+        self.assertEqual(
+            document_store.get(self.snapshot_filepath), {"subscribers": [2]}
+        )
+        # Nothing has been written to the snapshot, everything is in the journal
+        self.assertEqual(read_snapshot(self.snapshot_filepath), {"subscribers": []})
+        self.assertEqual(self.restart(), {"subscribers": [2]})
+
+    def test_records_are_idempotent(self):
+        self.journal.append("subscribe", user_id=1)
+        self.journal.append("subscribe", user_id=2)
+        document = self.restart()
+        self.assertEqual(self.journal.replay(document), {"subscribers": [1, 2]})
+
+    def test_crash_between_snapshot_and_truncate(self):
+        self.journal.append("subscribe", user_id=1)
+        self.journal.append("subscribe", user_id=2)
+        with mock.patch.object(
+            self.journal, "truncate", side_effect=RuntimeError("Crash")
+        ):
+            with self.assertRaises(RuntimeError):
+                self.journal.compact()
+        # The snapshot contains the records, and so does the journal
+        self.assertEqual(read_snapshot(self.snapshot_filepath), {"subscribers": [1, 2]})
+        self.assertEqual(len(self.read_journal().splitlines()), 2)
+        self.assertEqual(self.restart(), {"subscribers": [1, 2]})
+
+    def test_half_written_last_record_is_skipped(self):
+        self.journal.append("subscribe", user_id=1)
+        with open(self.journal.journal_filepath, "a", encoding="UTF-8") as journal_file:
+            journal_file.write('{"operation": "subscribe", "user_')
+        self.assertEqual(self.restart(), {"subscribers": [1]})
+        # A journal that is opened after the crash does not append to the half-written record
+        journals.pop(self.snapshot_filepath, None)
+        self.journal = Journal(self.snapshot_filepath, OPERATIONS)
+        self.journal.append("subscribe", user_id=2)
+        self.assertEqual(self.restart(), {"subscribers": [1, 2]})
+        self.assertEqual(
+            self.read_journal().splitlines()[1:],
+            [
+                '{"operation": "subscribe", "user_',
+                '{"operation": "subscribe", "user_id": 2}',
+            ],
+        )
+
+    def test_half_written_record_after_failed_write_is_not_appended_to(self):
+        self.journal.append("subscribe", user_id=1)
+        with mock.patch("os.fsync", side_effect=OSError("Disk full")):
+            with self.assertRaises(OSError):
+                self.journal.append("subscribe", user_id=2)
+        # The end of the journal is checked again before the next record is appended
+        self.assertTrue(self.journal.check_last_record)
+        self.journal.append("subscribe", user_id=3)
+        self.assertEqual(self.restart(), {"subscribers": [1, 2, 3]})
+
+    def test_compaction_writes_snapshot_and_empties_journal(self):
+        self.journal.append("subscribe", user_id=1)
+        self.journal.compact()
+        self.assertEqual(read_snapshot(self.snapshot_filepath), {"subscribers": [1]})
+        self.assertEqual(self.read_journal(), "")
+        self.assertEqual(self.restart(), {"subscribers": [1]})
+
+    def test_append_during_compaction_is_not_lost(self):
+        # Regression test: a change that is applied in memory while the journal is being compacted
+        # (as aappend() does from the event loop) must survive the compaction and the next one.
+        self.journal.append("subscribe", user_id=1)
+        append_thread = threading.Thread(
+            target=self.journal.append, args=("subscribe",), kwargs={"user_id": 2}
+        )
+
+        def with_concurrent_append(function):
+            def run_with_concurrent_append(*args, **kwargs):
+                result = function(*args, **kwargs)
+                if append_thread.ident is None:
+                    append_thread.start()
+                    # Wait until the change has been applied in memory. Writing the record waits for the compaction
+                    while (
+                        2
+                        not in document_store.documents[self.snapshot_filepath][
+                            "subscribers"
+                        ]
+                    ):
+                        time.sleep(0.001)
+                return result
+
+            return run_with_concurrent_append
+
+        # The change is applied right after the compaction first touches the document store
+        with mock.patch.object(
+            document_store,
+            "get",
+            side_effect=with_concurrent_append(document_store.get),
+        ), mock.patch.object(
+            document_store,
+            "mark_dirty",
+            side_effect=with_concurrent_append(document_store.mark_dirty),
+        ):
+            self.journal.compact()
+        append_thread.join()
+        self.journal.compact()
+        self.assertEqual(
+            document_store.get(self.snapshot_filepath), {"subscribers": [1, 2]}
+        )
+        self.assertEqual(self.restart(), {"subscribers": [1, 2]})
+
+    def test_compaction_during_concurrent_appends(self):
+        self.journal.compaction_threshold = 200  # (a few records)
+
+        async def append_all():
+            await asyncio.gather(
+                *[
+                    self.journal.aappend("subscribe", user_id=user_id)
+                    for user_id in range(100)
+                ]
+            )
+            # Wait for the compaction that is running in the background, if any
+            while self.journal.compaction_scheduled:
+                await asyncio.sleep(0.01)
+
+        asyncio.run(append_all())
+        self.assertGreater(self.journal.compactions, 0)
+        self.assertEqual(sorted(self.restart()["subscribers"]), list(range(100)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+"""test_menu_archive.py
+Tests for the searchable archive of menus (see utils/menu_archive.py)."""
+import datetime, json, os, tempfile, unittest
+from typing import Dict, List
+from utils.menu_archive import ArchivedDish, MenuArchive
+from utils.models import WeekMenu
+
+DAY_NAMES = {"monday": "Måndag", "tuesday": "Tisdag", "wednesday": "Onsdag"}
+
+
+def create_week_menu(week_number: int, dishes: Dict[str, List[str]]) -> WeekMenu:
+    """Creates a week menu in the format of the menu API.
+
+    :param week_number: The week number of the menu.
+
+    :param dishes: Mapping: day ID --> the dishes of the day."""
+    return WeekMenu.from_json(
+        {
+            "title": "Lunchmeny",
+            "week_number": week_number,
+            "days": {
+                day_id: {
+                    "day_name": {"swedish": DAY_NAMES[day_id], "english": day_id},
+                    "dishes": day_dishes,
+                    "special_features": {},
+                }
+                for day_id, day_dishes in dishes.items()
+            },
+        }
+    )
+
+
+WEEK_42 = create_week_menu(
+    42,
+    {
+        "monday": ["Vegetarisk lasagne", "Pannkakor med sylt"],
+        "tuesday": ["Köttbullar med potatismos"],
+    },
+)
+WEEK_43 = create_week_menu(
+    43,
+    {
+        "monday": ["Lasagne med sallad"],
+        "wednesday": ["Pannkaka med grädde", "Fiskgratäng"],
+    },
+)
+
+
+def get_dishes(archived_dishes: List[ArchivedDish]):
+    return [
+        (archived_dish.week_number, archived_dish.day_id, archived_dish.dish)
+        for archived_dish in archived_dishes
+    ]
+
+
+class MenuArchiveTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temporary_directory.cleanup)
+        self.filepath = os.path.join(
+            self.temporary_directory.name, "menu_archive.jsonl"
+        )
+        self.menu_archive = MenuArchive(self.filepath)
+        self.assertTrue(await self.menu_archive.add_week(2026, WEEK_42))
+        self.assertTrue(await self.menu_archive.add_week(2026, WEEK_43))
+
+    def read_records(self):
+        with open(self.filepath, encoding="UTF-8") as archive_file:
+            return [json.loads(line) for line in archive_file]
+
+    async def test_search_by_word_prefixes(self):
+        # Every word in the query must be the start of a word in the dish, ignoring case and diacritics
+        self.assertEqual(
+            get_dishes(await self.menu_archive.search("veg LASAGN")),
+            [(42, "monday", "Vegetarisk lasagne")],
+        )
+        self.assertEqual(
+            get_dishes(await self.menu_archive.search("kottbull")),
+            [(42, "tuesday", "Köttbullar med potatismos")],
+        )
+        # The word has to start with the query word
+        self.assertEqual(await self.menu_archive.search("sagne"), [])
+        self.assertEqual(await self.menu_archive.search("lasagne fisk"), [])
+        self.assertEqual(await self.menu_archive.search("zucchini"), [])
+        self.assertEqual(await self.menu_archive.search("  ,. "), [])
+
+    async def test_latest_dishes_first(self):
+        self.assertEqual(
+            get_dishes(await self.menu_archive.search("pannkak")),
+            [
+                (43, "wednesday", "Pannkaka med grädde"),
+                (42, "monday", "Pannkakor med sylt"),
+            ],
+        )
+        self.assertEqual(
+            get_dishes(await self.menu_archive.search("lasagne")),
+            [
+                (43, "monday", "Lasagne med sallad"),
+                (42, "monday", "Vegetarisk lasagne"),
+            ],
+        )
+
+    async def test_archived_dish(self):
+        archived_dish = (await self.menu_archive.search("fiskgratang"))[0]
+        self.assertEqual(archived_dish.day_name, "Onsdag")
+        self.assertEqual(archived_dish.date, datetime.date(2026, 10, 21))
+
+    async def test_unchanged_week_is_not_appended_again(self):
+        self.assertFalse(await self.menu_archive.add_week(2026, WEEK_42))
+        self.assertEqual(len(self.read_records()), 2)
+
+    async def test_changed_week_replaces_previous_menu(self):
+        changed_week_43 = create_week_menu(
+            43, {"monday": ["Lasagne med sallad"], "wednesday": ["Fisksoppa"]}
+        )
+        self.assertTrue(await self.menu_archive.add_week(2026, changed_week_43))
+        # The file is only appended to
+        self.assertEqual(
+            [record["week_number"] for record in self.read_records()], [42, 43, 43]
+        )
+        self.assertEqual(
+            get_dishes(await self.menu_archive.search("pannkak")),
+            [(42, "monday", "Pannkakor med sylt")],
+        )
+        self.assertEqual(
+            get_dishes(await self.menu_archive.search("fisk")),
+            [(43, "wednesday", "Fisksoppa")],
+        )
+        # Words that are no longer in any dish are removed from the index
+        self.assertNotIn("grädde", self.menu_archive.index)
+        self.assertNotIn("gradde", self.menu_archive.index)
+        self.assertEqual(
+            self.menu_archive.sorted_words, sorted(self.menu_archive.index)
+        )
+
+    async def test_same_week_number_in_different_years(self):
+        self.assertTrue(await self.menu_archive.add_week(2027, WEEK_42))
+        archived_dishes = await self.menu_archive.search("sylt")
+        self.assertEqual(
+            [archived_dish.year for archived_dish in archived_dishes], [2027, 2026]
+        )
+
+    async def test_archive_is_loaded_from_file(self):
+        changed_week_43 = create_week_menu(43, {"monday": ["Fisksoppa"]})
+        await self.menu_archive.add_week(2026, changed_week_43)
+        with open(self.filepath, "a", encoding="UTF-8") as archive_file:
+            # A line that was only partly written, and a record that is not a valid menu
+            archive_file.write('{"year": 2026, "week_number": 44, "me\n')
+            archive_file.write('{"year": 2026, "week_number": 44, "menu": {}}\n')
+        loaded_menu_archive = MenuArchive(self.filepath)
+        self.assertEqual(
+            get_dishes(await loaded_menu_archive.search("fisk")),
+            [(43, "monday", "Fisksoppa")],
+        )
+        self.assertEqual(sorted(loaded_menu_archive.weeks), [(2026, 42), (2026, 43)])
+        self.assertEqual(loaded_menu_archive.index, self.menu_archive.index)
+
+    async def test_missing_archive_file(self):
+        menu_archive = MenuArchive(
+            os.path.join(self.temporary_directory.name, "missing.jsonl")
+        )
+        self.assertEqual(await menu_archive.search("lasagne"), [])
+        self.assertTrue(menu_archive.loaded)
+
+
+if __name__ == "__main__":
+    unittest.main()
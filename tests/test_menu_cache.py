@@ -0,0 +1,129 @@
+"""test_menu_cache.py
+Tests for caching menus from the menu API (see utils/menu.py). The menu API is replaced by the stub server
+(see utils/stub_server.py), and the menu module is imported again with the menu cache in a temporary directory."""
+import asyncio, importlib, os, sys, tempfile, unittest
+from unittest import mock
+from aiohttp import web
+from utils import general
+from utils.document_store import document_store
+from utils.http_client import http_client
+from utils.stub_server import StubServer, StubServerSettings
+
+
+class MenuCacheTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temporary_directory.cleanup)
+        sys.modules.pop("utils.menu", None)
+        with mock.patch.object(
+            general, "FLUID_DATA_DIRECTORY", self.temporary_directory.name
+        ):
+            self.menu = importlib.import_module("utils.menu")
+        self.addCleanup(sys.modules.pop, "utils.menu", None)
+        self.stub_server = StubServer(
+            StubServerSettings(0, 0, 0, "conditional"), general.STUB_FIXTURES_DIRECTORY
+        )
+        self.runner = web.AppRunner(self.stub_server.create_app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.menu.MENU_API_URL = f"http://127.0.0.1:{port}/menu/api/"
+
+    async def asyncTearDown(self):
+        await http_client.close()
+        await self.runner.cleanup()
+        # The write-behind flush of the menu cache was scheduled on the event loop of this test, which is closed
+        with document_store.lock:
+            if document_store.scheduled_flush is not None:
+                document_store.scheduled_flush.cancel()
+                document_store.scheduled_flush = None
+            for store_data in [
+                document_store.documents,
+                document_store.file_signatures,
+                document_store.versions,
+            ]:
+                store_data.pop(self.menu.MENU_CACHE_PATH, None)
+            document_store.dirty_filepaths.discard(self.menu.MENU_CACHE_PATH)
+
+    def get_menu_stats(self):
+        return self.stub_server.stats.get(
+            "menu", {"requests": 0, "not_modified": 0, "errors": 0}
+        )
+
+    async def test_cached_menu_is_used_until_it_expires(self):
+        menu_data = await self.menu.get_eatery_menu()
+        self.assertEqual(menu_data["menu"]["week_number"], 42)
+        # Changing the returned menu does not change the cached menu
+        menu_data["menu"]["week_number"] = 0
+        self.assertEqual((await self.menu.get_eatery_menu())["menu"]["week_number"], 42)
+        self.assertEqual(self.get_menu_stats()["requests"], 1)
+
+    async def test_menus_are_cached_per_menu_and_week(self):
+        week_menu = await self.menu.get_week_menu("kista-nod", 43)
+        self.assertEqual(week_menu.week_number, 43)
+        self.assertEqual((await self.menu.get_eatery_menu())["menu"]["week_number"], 42)
+        self.assertEqual(
+            (await self.menu.get_eatery_menu("kista-nod", 43))["menu"]["week_number"],
+            43,
+        )
+        self.assertEqual(self.get_menu_stats()["requests"], 2)
+        menu_cache = await general.aget_json(self.menu.MENU_CACHE_PATH)
+        self.assertEqual(sorted(menu_cache["entries"]), ["kista-nod/43", "latest"])
+
+    async def test_expired_menu_is_revalidated(self):
+        await self.menu.get_eatery_menu()
+        menu_cache = await general.aget_json(self.menu.MENU_CACHE_PATH)
+        first_fetched_at = menu_cache["entries"]["latest"]["fetched_at"]
+        self.assertIsNotNone(menu_cache["entries"]["latest"]["etag"])
+        with mock.patch.object(self.menu, "MENU_CACHE_TTL", -1):
+            menu_data = await self.menu.get_eatery_menu()
+        self.assertEqual(menu_data["menu"]["week_number"], 42)
+        # The menu had not changed, so the stub server answered 304 Not Modified
+        self.assertEqual(self.get_menu_stats()["requests"], 2)
+        self.assertEqual(self.get_menu_stats()["not_modified"], 1)
+        menu_cache = await general.aget_json(self.menu.MENU_CACHE_PATH)
+        self.assertGreaterEqual(
+            menu_cache["entries"]["latest"]["fetched_at"], first_fetched_at
+        )
+        self.assertEqual(menu_cache["entries"]["latest"]["menu_data"], menu_data)
+
+    async def test_changed_menu_is_downloaded_again(self):
+        self.stub_server.settings.etag_mode = "changing"
+        await self.menu.get_eatery_menu()
+        with mock.patch.object(self.menu, "MENU_CACHE_TTL", -1):
+            self.assertEqual(
+                (await self.menu.get_eatery_menu())["menu"]["week_number"], 42
+            )
+        self.assertEqual(self.get_menu_stats()["requests"], 2)
+        self.assertEqual(self.get_menu_stats()["not_modified"], 0)
+
+    async def test_expired_menu_is_used_when_menu_api_is_down(self):
+        await self.menu.get_eatery_menu()
+        self.stub_server.settings.error_rate = 1
+        with mock.patch.object(self.menu, "MENU_CACHE_TTL", -1):
+            self.assertEqual(
+                (await self.menu.get_eatery_menu())["menu"]["week_number"], 42
+            )
+            # ...but not if it is too old
+            with mock.patch.object(self.menu, "MENU_CACHE_MAX_STALENESS", -1):
+                self.assertIsNone(await self.menu.get_eatery_menu())
+        self.assertEqual(self.get_menu_stats()["errors"], 2)
+
+    async def test_menu_api_down_without_cached_menu(self):
+        self.stub_server.settings.error_rate = 1
+        self.assertIsNone(await self.menu.get_eatery_menu())
+        self.assertIsNone(await self.menu.get_week_menu())
+
+    async def test_concurrent_requests_share_one_download(self):
+        self.stub_server.settings.latency = 0.05
+        menus = await asyncio.gather(*[self.menu.get_eatery_menu() for _ in range(5)])
+        self.assertEqual(self.get_menu_stats()["requests"], 1)
+        self.assertTrue(all(menu_data == menus[0] for menu_data in menus))
+        # Every caller gets its own copy
+        self.assertEqual(len({id(menu_data) for menu_data in menus}), 5)
+        self.assertEqual(self.menu.menu_downloads_in_progress, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+"""test_menu_highlights.py
+Tests for rendering the dishes of a day with special features highlighted (see utils/menu_highlights.py)."""
+import json, unittest
+from typing import Dict, List
+from utils.general import MENU_HIGHLIGHTS_FILEPATH
+from utils.menu_highlights import MENU_RENDER_MEMO_SIZE, DishHighlighter
+from utils.models import DayMenu
+
+HIGHLIGHTS_DATA = {
+    "highlights": [
+        {"text": "Pancake Thursday", "emoji": "🥞", "feature": "pancake_thursday"},
+        {"text": "Pancake", "emoji": "🍳", "feature": "pancake_thursday"},
+        {"text": "Burger Friday", "emoji": "🍔", "feature": "burger_friday"},
+        {"text": "Vegansk", "emoji": "🌱"},
+    ]
+}
+
+
+def create_day_menu(dishes: List[str], special_features: Dict[str, bool]) -> DayMenu:
+    """Creates the menu of a day in the format of the menu API.
+
+    :param dishes: The dishes of the day.
+
+    :param special_features: Mapping: feature --> active."""
+    return DayMenu.from_json(
+        "thursday",
+        {
+            "day_name": {"swedish": "Torsdag", "english": "Thursday"},
+            "dishes": dishes,
+            "special_features": special_features,
+        },
+    )
+
+
+class DishHighlighterTests(unittest.TestCase):
+    def setUp(self):
+        self.dish_highlighter = DishHighlighter(HIGHLIGHTS_DATA)
+
+    def test_renders_dishes(self):
+        day_menu = create_day_menu(["Fiskgratäng", "Tomatsoppa"], {})
+        self.assertEqual(
+            self.dish_highlighter.render(day_menu), "● Fiskgratäng\n● Tomatsoppa\n"
+        )
+
+    def test_highlights_active_features(self):
+        day_menu = create_day_menu(
+            ["Pancake Thursday: pannkakor med sylt", "Burger Friday-rester"],
+            {"pancake_thursday": True, "burger_friday": False},
+        )
+        self.assertEqual(
+            self.dish_highlighter.render(day_menu),
+            "● *🥞 Pancake Thursday*: pannkakor med sylt\n● Burger Friday-rester\n",
+        )
+
+    def test_several_highlights_on_the_same_day_and_dish(self):
+        day_menu = create_day_menu(
+            [
+                "Vegansk Burger Friday och Pancake",
+                "Pancake Thursday",
+            ],
+            {"pancake_thursday": True, "burger_friday": True},
+        )
+        self.assertEqual(
+            self.dish_highlighter.render(day_menu),
+            "● *🌱 Vegansk* *🍔 Burger Friday* och *🍳 Pancake*\n"
+            # The longest text wins when one text contains another
+            "● *🥞 Pancake Thursday*\n",
+        )
+
+    def test_highlights_without_feature_are_always_highlighted(self):
+        day_menu = create_day_menu(["Vegansk lasagne"], {})
+        self.assertEqual(
+            self.dish_highlighter.render(day_menu), "● *🌱 Vegansk* lasagne\n"
+        )
+
+    def test_texts_are_matched_literally(self):
+        dish_highlighter = DishHighlighter(
+            {"highlights": [{"text": "Fika (gott!)", "emoji": "☕"}]}
+        )
+        day_menu = create_day_menu(["Fika (gott!) och Fika gott"], {})
+        self.assertEqual(
+            dish_highlighter.render(day_menu), "● *☕ Fika (gott!)* och Fika gott\n"
+        )
+
+    def test_no_highlights(self):
+        dish_highlighter = DishHighlighter({"highlights": []})
+        self.assertIsNone(dish_highlighter.regex)
+        day_menu = create_day_menu(["Pancake Thursday"], {"pancake_thursday": True})
+        self.assertEqual(dish_highlighter.render(day_menu), "● Pancake Thursday\n")
+
+    def test_memo(self):
+        day_menu = create_day_menu(["Pancake Thursday"], {"pancake_thursday": True})
+        rendered_text = self.dish_highlighter.render(day_menu)
+        self.assertIs(self.dish_highlighter.render(day_menu), rendered_text)
+        self.assertEqual(len(self.dish_highlighter.memo), 1)
+        # The active features are part of the key
+        inactive_day_menu = create_day_menu(
+            ["Pancake Thursday"], {"pancake_thursday": False}
+        )
+        self.assertEqual(
+            self.dish_highlighter.render(inactive_day_menu), "● Pancake Thursday\n"
+        )
+        self.assertEqual(len(self.dish_highlighter.memo), 2)
+
+    def test_memo_size_is_limited(self):
+        first_day_menu = create_day_menu(["Dish 0"], {})
+        self.dish_highlighter.render(first_day_menu)
+        for dish_number in range(1, MENU_RENDER_MEMO_SIZE + 1):
+            if dish_number == MENU_RENDER_MEMO_SIZE // 2:
+                # Using a memoized day makes it the most recently used
+                self.dish_highlighter.render(first_day_menu)
+            self.dish_highlighter.render(create_day_menu([f"Dish {dish_number}"], {}))
+        self.assertEqual(len(self.dish_highlighter.memo), MENU_RENDER_MEMO_SIZE)
+        self.assertIn((("Dish 0",), frozenset()), self.dish_highlighter.memo)
+        self.assertNotIn((("Dish 1",), frozenset()), self.dish_highlighter.memo)
+
+    def test_highlights_file_is_valid(self):
+        with open(MENU_HIGHLIGHTS_FILEPATH, encoding="UTF-8") as highlights_file:
+            dish_highlighter = DishHighlighter(json.load(highlights_file))
+        day_menu = create_day_menu(
+            ["Sweet Tuesday: kladdkaka"], {"sweet_tuesday": True}
+        )
+        self.assertEqual(
+            dish_highlighter.render(day_menu), "● *🍰 Sweet Tuesday*: kladdkaka\n"
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+"""test_notification_queue.py
+Tests for the queue of subscribers that are due to be notified (see utils/notification_queue.py)."""
+import datetime, unittest
+from utils.notification_queue import COMPACTION_SLACK, NotificationQueue
+
+MIDNIGHT = datetime.datetime(2026, 10, 19, tzinfo=datetime.timezone.utc)
+
+
+def at_hour(hour: int) -> datetime.datetime:
+    return MIDNIGHT + datetime.timedelta(hours=hour)
+
+
+class NotificationQueueTests(unittest.TestCase):
+    def test_from_json(self):
+        notification_queue = NotificationQueue.from_json(
+            {
+                "subscriptions": {
+                    "1": {"last_notified_at": None},
+                    "2": {
+                        "last_notified_at": str(at_hour(8)),
+                        "last_notified_period": "2026-10-19",
+                    },
+                    "3": {"last_notified_at": str(at_hour(12))},
+                }
+            }
+        )
+        self.assertEqual(len(notification_queue), 3)
+        self.assertEqual(notification_queue.get_due(at_hour(10)), [1, 2])
+        self.assertEqual(notification_queue.get_due(at_hour(10), "2026-10-19"), [1])
+
+    def test_get_due_returns_longest_waiting_first_and_keeps_entries(self):
+        notification_queue = NotificationQueue()
+        for user_id in [1, 2, 3]:
+            notification_queue.add(user_id)
+        notification_queue.mark_notified(3, at_hour(1))
+        notification_queue.mark_notified(1, at_hour(2))
+        self.assertEqual(notification_queue.get_due(at_hour(3)), [2, 3, 1])
+        # The users stay due until they are notified
+        self.assertEqual(notification_queue.get_due(at_hour(3)), [2, 3, 1])
+        self.assertEqual(notification_queue.get_due(at_hour(2)), [2, 3])
+
+    def test_notified_users_are_not_due(self):
+        notification_queue = NotificationQueue()
+        notification_queue.add(1)
+        notification_queue.add(2)
+        notification_queue.mark_notified(1, at_hour(10))
+        self.assertEqual(notification_queue.get_due(at_hour(9)), [2])
+        self.assertEqual(notification_queue.get_due(at_hour(11)), [2, 1])
+
+    def test_period_filter(self):
+        notification_queue = NotificationQueue()
+        for user_id in [1, 2, 3]:
+            notification_queue.add(user_id)
+        notification_queue.mark_notified(1, at_hour(1), "2026-10-19")
+        notification_queue.mark_notified(2, at_hour(1), "2026-10-18")
+        # Marking a user as notified without a period keeps the previous period
+        notification_queue.mark_notified(1, at_hour(2))
+        self.assertEqual(notification_queue.get_due(at_hour(3)), [3, 2, 1])
+        self.assertEqual(notification_queue.get_due(at_hour(3), "2026-10-19"), [3, 2])
+        self.assertEqual(notification_queue.get_due(at_hour(3), "2026-10-18"), [3, 1])
+
+    def test_unsubscribed_users_are_not_due(self):
+        notification_queue = NotificationQueue()
+        notification_queue.add(1)
+        notification_queue.add(2)
+        notification_queue.remove(1)
+        self.assertEqual(notification_queue.get_due(at_hour(1)), [2])
+        # Removing a user that is not subscribed does nothing
+        notification_queue.remove(1)
+        self.assertEqual(len(notification_queue), 1)
+
+    def test_lazy_deletion_after_unsubscribing_and_subscribing_again(self):
+        notification_queue = NotificationQueue()
+        notification_queue.add(1)
+        notification_queue.mark_notified(1, at_hour(5))
+        notification_queue.remove(1)
+        notification_queue.add(1)
+        # The old entry from before unsubscribing is still in the heap but is outdated...
+        self.assertIn((at_hour(5).timestamp(), 1), notification_queue.heap)
+        # ...so the user is only returned once, as never notified
+        self.assertEqual(notification_queue.get_due(at_hour(6)), [1])
+        self.assertEqual(notification_queue.get_due(at_hour(1)), [1])
+        # Subscribing again after being notified gives two current entries with the same time
+        notification_queue.remove(1)
+        notification_queue.add(1)
+        self.assertEqual(notification_queue.get_due(at_hour(6)), [1])
+        self.assertEqual(
+            [entry for entry in notification_queue.heap if entry[1] == 1],
+            [(0.0, 1)],
+        )
+
+    def test_adding_a_subscriber_twice_does_nothing(self):
+        notification_queue = NotificationQueue()
+        notification_queue.add(1)
+        notification_queue.mark_notified(1, at_hour(5))
+        notification_queue.add(1)
+        self.assertEqual(notification_queue.get_due(at_hour(4)), [])
+
+    def test_marking_unsubscribed_user_does_nothing(self):
+        notification_queue = NotificationQueue()
+        notification_queue.mark_notified(1, at_hour(5))
+        self.assertEqual(len(notification_queue), 0)
+        self.assertEqual(notification_queue.heap, [])
+
+    def test_compact_if_needed(self):
+        notification_queue = NotificationQueue()
+        notification_queue.add(1)
+        notification_queue.add(2)
+        # Every notification leaves an outdated entry behind, until there are too many of them
+        for minute in range(1, 2 * 2 + COMPACTION_SLACK + 1):
+            notification_queue.mark_notified(
+                1, MIDNIGHT + datetime.timedelta(minutes=minute)
+            )
+            self.assertLessEqual(
+                len(notification_queue.heap),
+                2 * len(notification_queue) + COMPACTION_SLACK,
+            )
+        # The heap has been rebuilt with one entry per subscriber at least once
+        self.assertLess(len(notification_queue.heap), COMPACTION_SLACK)
+        self.assertEqual(notification_queue.get_due(at_hour(10)), [2, 1])
+
+    def test_compaction_after_unsubscribing(self):
+        notification_queue = NotificationQueue()
+        for user_id in range(COMPACTION_SLACK + 10):
+            notification_queue.add(user_id)
+        for user_id in range(COMPACTION_SLACK + 9):
+            notification_queue.remove(user_id)
+            self.assertLessEqual(
+                len(notification_queue.heap),
+                2 * len(notification_queue) + COMPACTION_SLACK,
+            )
+        # The entries of the users that unsubscribed were dropped when the heap was rebuilt
+        self.assertLess(len(notification_queue.heap), 10)
+        self.assertEqual(notification_queue.get_due(at_hour(1)), [COMPACTION_SLACK + 9])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+"""test_paginate_embed.py
+Tests for splitting embeds that are too big to be sent into pages (see paginate_embed() in utils/general.py)."""
+import unittest
+from nextcord import Embed
+from utils.general import EMBED_MAX_CHARACTERS, EMBED_MAX_FIELDS, paginate_embed
+
+
+def create_embed(number_of_fields: int, field_value_length: int = 10) -> Embed:
+    """Creates an embed like the club list.
+
+    :param number_of_fields: How many fields the embed has.
+
+    :param field_value_length: The length of the value of every field."""
+    embed = Embed(
+        title="Klubbar", description="Alla klubbar på skolan.", color=0x123456
+    )
+    for field_number in range(number_of_fields):
+        embed.add_field(
+            name=f"Klubb {field_number}", value="x" * field_value_length, inline=False
+        )
+    embed.set_footer(text="Gå med i en klubb med /join_club.")
+    return embed
+
+
+def get_field_names(pages):
+    return [field.name for page in pages for field in page.fields]
+
+
+class PaginateEmbedTests(unittest.TestCase):
+    def test_small_embed_is_not_split(self):
+        embed = create_embed(EMBED_MAX_FIELDS)
+        pages = paginate_embed(embed)
+        self.assertEqual(len(pages), 1)
+        self.assertIs(pages[0], embed)
+        self.assertEqual(pages[0].title, "Klubbar")
+
+    def test_too_many_fields(self):
+        embed = create_embed(EMBED_MAX_FIELDS * 2 + 1)
+        pages = paginate_embed(embed)
+        self.assertEqual(
+            [len(page.fields) for page in pages],
+            [EMBED_MAX_FIELDS, EMBED_MAX_FIELDS, 1],
+        )
+        # The fields are kept in order
+        self.assertEqual(get_field_names(pages), get_field_names([embed]))
+        self.assertEqual(
+            [page.title for page in pages],
+            ["Klubbar (1/3)", "Klubbar (2/3)", "Klubbar (3/3)"],
+        )
+        # Only the first page has the description and only the last page has the footer
+        self.assertEqual(pages[0].description, "Alla klubbar på skolan.")
+        self.assertFalse(pages[1].description)
+        self.assertFalse(pages[0].footer.text)
+        self.assertEqual(pages[-1].footer.text, "Gå med i en klubb med /join_club.")
+        self.assertTrue(all(page.color == embed.color for page in pages))
+        self.assertFalse(pages[0].fields[0].inline)
+
+    def test_too_many_characters(self):
+        embed = create_embed(10, field_value_length=1000)
+        self.assertGreater(len(embed), EMBED_MAX_CHARACTERS)
+        pages = paginate_embed(embed)
+        self.assertGreater(len(pages), 1)
+        self.assertEqual(get_field_names(pages), get_field_names([embed]))
+        for page in pages:
+            self.assertLessEqual(len(page), EMBED_MAX_CHARACTERS)
+            self.assertLessEqual(len(page.fields), EMBED_MAX_FIELDS)
+
+    def test_too_many_fields_and_characters(self):
+        embed = create_embed(60, field_value_length=500)
+        pages = paginate_embed(embed)
+        self.assertEqual(get_field_names(pages), get_field_names([embed]))
+        for page in pages:
+            self.assertLessEqual(len(page), EMBED_MAX_CHARACTERS)
+            self.assertLessEqual(len(page.fields), EMBED_MAX_FIELDS)
+
+    def test_embed_without_fields_is_not_split(self):
+        embed = Embed(title="Lång text", description="x" * 4096)
+        embed.set_footer(text="y" * 2048)
+        self.assertEqual(paginate_embed(embed), [embed])
+
+
+if __name__ == "__main__":
+    unittest.main()
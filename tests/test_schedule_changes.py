@@ -0,0 +1,123 @@
+"""test_schedule_changes.py
+Tests for finding out how the schedule of a class has changed (see utils/schedule_changes.py)."""
+import datetime, unittest, pytz
+from typing import Optional
+from utils.general import BASE_TIMEZONE
+from utils.schedule_changes import diff_lessons, get_lessons_hash
+from utils.schedule_index import Lesson
+
+TIMEZONE = pytz.timezone(BASE_TIMEZONE)
+DAY = datetime.date(2026, 10, 19)
+
+
+def lesson(name: str, start: str, end: str, room: Optional[str] = "Sal 301") -> Lesson:
+    return Lesson(
+        "TE24A",
+        name,
+        *[
+            TIMEZONE.localize(
+                datetime.datetime.combine(DAY, datetime.time.fromisoformat(time_text))
+            )
+            for time_text in [start, end]
+        ],
+        room,
+    )
+
+
+SCHEDULE = [
+    lesson("Matematik", "08:15", "09:35"),
+    lesson("Engelska", "09:50", "11:00", "Sal 204"),
+    lesson("Matematik", "13:30", "14:50"),
+]
+
+
+class LessonsHashTests(unittest.TestCase):
+    def test_does_not_depend_on_order(self):
+        self.assertEqual(
+            get_lessons_hash(SCHEDULE), get_lessons_hash(list(reversed(SCHEDULE)))
+        )
+
+    def test_changes_with_lessons(self):
+        self.assertNotEqual(
+            get_lessons_hash(SCHEDULE),
+            get_lessons_hash(
+                SCHEDULE[:2] + [lesson("Matematik", "13:30", "14:50", "Sal 302")]
+            ),
+        )
+        self.assertNotEqual(get_lessons_hash(SCHEDULE), get_lessons_hash(SCHEDULE[:2]))
+
+
+class DiffLessonsTests(unittest.TestCase):
+    def test_no_changes(self):
+        schedule_diff = diff_lessons("TE24A", DAY, SCHEDULE, list(reversed(SCHEDULE)))
+        self.assertTrue(schedule_diff.is_empty)
+
+    def test_added_and_removed(self):
+        fysik = lesson("Fysik", "15:00", "16:00")
+        schedule_diff = diff_lessons(
+            "TE24A", DAY, SCHEDULE, [SCHEDULE[0], SCHEDULE[2], fysik]
+        )
+        self.assertEqual(schedule_diff.added, [fysik])
+        self.assertEqual(schedule_diff.removed, [SCHEDULE[1]])
+        self.assertEqual(schedule_diff.moved, [])
+        self.assertFalse(schedule_diff.is_empty)
+
+    def test_moved(self):
+        moved_engelska = lesson("Engelska", "11:00", "12:10", "Sal 204")
+        schedule_diff = diff_lessons(
+            "TE24A", DAY, SCHEDULE, [SCHEDULE[0], moved_engelska, SCHEDULE[2]]
+        )
+        self.assertEqual(schedule_diff.moved, [(SCHEDULE[1], moved_engelska)])
+        self.assertEqual(schedule_diff.added, [])
+        self.assertEqual(schedule_diff.removed, [])
+
+    def test_changed_room(self):
+        new_room = lesson("Matematik", "13:30", "14:50", "Sal 302")
+        schedule_diff = diff_lessons(
+            "TE24A", DAY, SCHEDULE, [SCHEDULE[0], SCHEDULE[1], new_room]
+        )
+        self.assertEqual(schedule_diff.moved, [(SCHEDULE[2], new_room)])
+
+    def test_same_subject_twice_with_one_cancelled_and_one_moved(self):
+        # The morning lesson is cancelled and the afternoon lesson is moved 30 minutes later.
+        # Pairing by name only would match the cancelled morning lesson with the moved afternoon lesson.
+        moved_matematik = lesson("Matematik", "14:00", "15:20")
+        schedule_diff = diff_lessons(
+            "TE24A", DAY, SCHEDULE, [SCHEDULE[1], moved_matematik]
+        )
+        self.assertEqual(schedule_diff.moved, [(SCHEDULE[2], moved_matematik)])
+        self.assertEqual(schedule_diff.removed, [SCHEDULE[0]])
+        self.assertEqual(schedule_diff.added, [])
+
+    def test_same_subject_twice_with_one_room_changed_and_one_added(self):
+        new_room = lesson("Matematik", "13:30", "14:50", "Sal 302")
+        extra_matematik = lesson("Matematik", "11:10", "12:00")
+        schedule_diff = diff_lessons(
+            "TE24A",
+            DAY,
+            SCHEDULE,
+            [SCHEDULE[0], SCHEDULE[1], extra_matematik, new_room],
+        )
+        self.assertEqual(schedule_diff.moved, [(SCHEDULE[2], new_room)])
+        self.assertEqual(schedule_diff.added, [extra_matematik])
+        self.assertEqual(schedule_diff.removed, [])
+
+    def test_same_subject_twice_with_both_moved(self):
+        moved_morning = lesson("Matematik", "08:30", "09:50")
+        moved_afternoon = lesson("Matematik", "13:00", "14:20")
+        schedule_diff = diff_lessons(
+            "TE24A",
+            DAY,
+            SCHEDULE,
+            [moved_afternoon, SCHEDULE[1], moved_morning],
+        )
+        self.assertEqual(
+            schedule_diff.moved,
+            [(SCHEDULE[0], moved_morning), (SCHEDULE[2], moved_afternoon)],
+        )
+        self.assertEqual(schedule_diff.added, [])
+        self.assertEqual(schedule_diff.removed, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,194 @@
+"""test_schedule_index.py
+Tests for looking up lessons in the cached schedules (see utils/schedule_index.py), using the schedules that the
+stub server replays."""
+import datetime, json, os, unittest, pytz
+from utils.general import BASE_TIMEZONE, STUB_FIXTURES_DIRECTORY
+from utils.schedule_index import (
+    ClassSchedule,
+    Lesson,
+    parse_lessons,
+    parse_schedule_index,
+)
+
+TIMEZONE = pytz.timezone(BASE_TIMEZONE)
+# 2026-10-19 is a Monday
+DAY = datetime.date(2026, 10, 19)
+
+
+def at(time_text: str) -> datetime.datetime:
+    return TIMEZONE.localize(
+        datetime.datetime.combine(DAY, datetime.time.fromisoformat(time_text))
+    )
+
+
+def get_stub_schedules():
+    with open(
+        os.path.join(STUB_FIXTURES_DIRECTORY, "schedules.json"), encoding="UTF-8"
+    ) as schedules_file:
+        return json.load(schedules_file)
+
+
+class ScheduleIndexTests(unittest.TestCase):
+    def setUp(self):
+        stub_schedules = get_stub_schedules()
+        cached_at = at("06:00").isoformat()
+        self.schedule_index = parse_schedule_index(
+            {
+                "schedules": {
+                    "TE24A": {
+                        "cached_at": cached_at,
+                        "schedule_content": stub_schedules["TE24A"],
+                    },
+                    "TE24B": {
+                        "cached_at": cached_at,
+                        "schedule_content": stub_schedules["default"],
+                    },
+                    "TE24C": {"schedule_content": stub_schedules["default"]},
+                }
+            }
+        )
+
+    def test_parse_schedule_index(self):
+        # TE24C has no cached_at and is skipped
+        self.assertEqual(
+            sorted(self.schedule_index.class_schedules), ["TE24A", "TE24B"]
+        )
+        self.assertEqual(len(self.schedule_index), 7)
+        first_lesson = self.schedule_index.class_schedules["TE24A"].lessons[0]
+        self.assertEqual(
+            first_lesson,
+            Lesson("TE24A", "Svenska", at("08:30"), at("09:50"), "Sal 105"),
+        )
+
+    def test_current_lesson(self):
+        for time_text, lesson_name in [
+            ("08:29", None),
+            ("08:30", "Svenska"),
+            ("09:49", "Svenska"),
+            ("09:50", None),
+            ("10:15", "Idrott"),
+            ("14:29", "Teknik"),
+            ("14:30", None),
+        ]:
+            with self.subTest(time=time_text):
+                lesson = self.schedule_index.current_lesson("TE24A", at(time_text))
+                self.assertEqual(
+                    lesson.name if lesson is not None else None, lesson_name
+                )
+        self.assertIsNone(self.schedule_index.current_lesson("NA24A", at("10:15")))
+
+    def test_next_lesson(self):
+        self.assertEqual(
+            self.schedule_index.next_lesson("TE24B", at("07:00")).name, "Matematik"
+        )
+        # A lesson that starts exactly now is the current lesson, not the next one
+        self.assertEqual(
+            self.schedule_index.next_lesson("TE24B", at("08:15")).name, "Engelska"
+        )
+        self.assertEqual(
+            self.schedule_index.next_lesson("TE24B", at("11:10")).name,
+            "Programmering",
+        )
+        self.assertIsNone(self.schedule_index.next_lesson("TE24B", at("13:30")))
+        self.assertIsNone(self.schedule_index.next_lesson("NA24A", at("07:00")))
+
+    def test_previous_lesson(self):
+        self.assertIsNone(self.schedule_index.previous_lesson("TE24A", at("08:00")))
+        self.assertEqual(
+            self.schedule_index.previous_lesson("TE24A", at("10:00")).name, "Svenska"
+        )
+
+    def test_free_classes_at(self):
+        self.assertEqual(
+            self.schedule_index.free_classes_at(at("07:00")), ["TE24A", "TE24B"]
+        )
+        # TE24A has a break between Svenska and Idrott
+        self.assertEqual(self.schedule_index.free_classes_at(at("10:00")), ["TE24A"])
+        # TE24B has lunch between Engelska and Programmering
+        self.assertEqual(self.schedule_index.free_classes_at(at("11:30")), ["TE24B"])
+        self.assertEqual(self.schedule_index.free_classes_at(at("13:00")), [])
+        self.assertEqual(
+            self.schedule_index.free_classes_at(at("15:00")), ["TE24A", "TE24B"]
+        )
+
+
+class OverlappingLessonsTests(unittest.TestCase):
+    def setUp(self):
+        # A long lesson that overlaps two shorter lessons that start later
+        self.class_schedule = ClassSchedule(
+            "TE24A",
+            [
+                Lesson("TE24A", "Mentorstid", at("10:30"), at("11:00"), None),
+                Lesson("TE24A", "Temadag", at("08:00"), at("12:00"), None),
+                Lesson("TE24A", "Föreläsning", at("09:00"), at("10:00"), None),
+            ],
+        )
+
+    def test_lessons_are_sorted(self):
+        self.assertEqual(
+            [lesson.name for lesson in self.class_schedule.lessons],
+            ["Temadag", "Föreläsning", "Mentorstid"],
+        )
+        self.assertEqual(
+            self.class_schedule.latest_ends, [at("12:00"), at("12:00"), at("12:00")]
+        )
+
+    def test_current_lesson(self):
+        for time_text, lesson_name in [
+            ("08:30", "Temadag"),
+            # The lesson that started last is returned when lessons overlap
+            ("09:30", "Föreläsning"),
+            # The shorter lesson has ended but the long one is still going on
+            ("10:15", "Temadag"),
+            ("10:45", "Mentorstid"),
+            ("11:30", "Temadag"),
+            ("12:00", None),
+        ]:
+            with self.subTest(time=time_text):
+                lesson = self.class_schedule.current_lesson(at(time_text))
+                self.assertEqual(
+                    lesson.name if lesson is not None else None, lesson_name
+                )
+
+    def test_next_lesson(self):
+        self.assertEqual(
+            self.class_schedule.next_lesson(at("10:15")).name, "Mentorstid"
+        )
+        self.assertIsNone(self.class_schedule.next_lesson(at("10:30")))
+
+
+class ParseLessonsTests(unittest.TestCase):
+    def test_other_formats(self):
+        lessons = parse_lessons(
+            "TE24A",
+            {
+                "events": [
+                    {
+                        "summary": "Kemi",
+                        "dtstart": "2026-10-19T06:15:00Z",
+                        "dtend": "2026-10-19T07:30:00Z",
+                        "location": "Labb 1",
+                    },
+                    {"title": "Historia", "from": "9:00", "to": "10:00"},
+                    # Lessons that can not be parsed or that end before they start are skipped
+                    {"name": "Okänd", "start": "snart", "end": "10:00"},
+                    {"name": "Baklänges", "start": "11:00", "end": "10:00"},
+                    "Lunch",
+                ]
+            },
+            DAY,
+        )
+        self.assertEqual(
+            lessons,
+            [
+                Lesson("TE24A", "Kemi", at("08:15"), at("09:30"), "Labb 1"),
+                Lesson("TE24A", "Historia", at("09:00"), at("10:00"), None),
+            ],
+        )
+
+    def test_unknown_format(self):
+        self.assertEqual(parse_lessons("TE24A", "Inget schema", DAY), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
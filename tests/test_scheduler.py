@@ -0,0 +1,191 @@
+"""test_scheduler.py
+Tests for the schedule rules and holidays of the scheduler (see utils/scheduler.py)."""
+import asyncio, datetime, json, os, tempfile, unittest, pytz
+from unittest import mock
+from utils import scheduler
+from utils.general import BASE_TIMEZONE, HOLIDAYS_FILEPATH
+from utils.models import ModelCache
+from utils.scheduler import ScheduleRule, parse_holidays
+
+TIMEZONE = pytz.timezone(BASE_TIMEZONE)
+
+
+def local_time(*args) -> datetime.datetime:
+    return TIMEZONE.localize(datetime.datetime(*args))
+
+
+class ScheduleRuleParseTests(unittest.TestCase):
+    def test_day_groups(self):
+        self.assertEqual(ScheduleRule.parse("daily 00:05").weekdays, set(range(1, 8)))
+        self.assertEqual(ScheduleRule.parse("weekdays 07:30").weekdays, {1, 2, 3, 4, 5})
+        self.assertEqual(ScheduleRule.parse("weekends 10:00").weekdays, {6, 7})
+
+    def test_day_names(self):
+        self.assertEqual(ScheduleRule.parse("monday 06:00").weekdays, {1})
+        self.assertEqual(ScheduleRule.parse("Sunday 06:00").weekdays, {7})
+        self.assertEqual(ScheduleRule.parse("wed 06:00").weekdays, {3})
+        self.assertEqual(ScheduleRule.parse("thurs 06:00").weekdays, {4})
+
+    def test_lists(self):
+        rule = ScheduleRule.parse("mon,wed,weekends 12:00,08:00,08:00")
+        self.assertEqual(rule.weekdays, {1, 3, 6, 7})
+        # The times are sorted and deduplicated
+        self.assertEqual(rule.times, [datetime.time(8, 0), datetime.time(12, 0)])
+        self.assertEqual(rule.text, "mon,wed,weekends 12:00,08:00,08:00")
+
+    def test_time_ranges(self):
+        self.assertEqual(
+            ScheduleRule.parse("weekdays 08:00-08:20/5").times,
+            [datetime.time(8, minute) for minute in [0, 5, 10, 15, 20]],
+        )
+        # The end of the range is only included if the interval lands on it
+        self.assertEqual(
+            ScheduleRule.parse("daily 23:00-23:59/30").times,
+            [datetime.time(23, 0), datetime.time(23, 30)],
+        )
+        self.assertEqual(
+            ScheduleRule.parse("daily 7:00,08:00-09:00/60").times,
+            [datetime.time(7, 0), datetime.time(8, 0), datetime.time(9, 0)],
+        )
+
+    def test_invalid_rules(self):
+        for text in [
+            "",
+            "weekdays",
+            "weekdays 07:30 extra",
+            "someday 07:30",
+            "mo 07:30",
+            "weekdays 7.30",
+            "weekdays 25:00",
+            "weekdays 07:60",
+            "weekdays 08:00-09:00/0",
+            "weekdays 08:00-09:00",
+        ]:
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    ScheduleRule.parse(text)
+
+
+class ScheduleRuleNextRunTests(unittest.TestCase):
+    def test_next_run_on_same_day(self):
+        rule = ScheduleRule.parse("weekdays 08:00,12:00")
+        # 2026-10-19 is a Monday
+        self.assertEqual(
+            rule.get_next_run(local_time(2026, 10, 19, 9, 0)),
+            local_time(2026, 10, 19, 12, 0),
+        )
+        # A run exactly at the given time is not returned
+        self.assertEqual(
+            rule.get_next_run(local_time(2026, 10, 19, 12, 0)),
+            local_time(2026, 10, 20, 8, 0),
+        )
+
+    def test_skips_days_that_the_rule_does_not_run_on(self):
+        rule = ScheduleRule.parse("weekdays 07:30")
+        self.assertEqual(
+            rule.get_next_run(local_time(2026, 10, 23, 8, 0)),
+            local_time(2026, 10, 26, 7, 30),
+        )
+
+    def test_is_skipped(self):
+        rule = ScheduleRule.parse("weekdays 07:30")
+        skipped_dates = {datetime.date(2026, 10, 26), datetime.date(2026, 10, 27)}
+        self.assertEqual(
+            rule.get_next_run(
+                local_time(2026, 10, 23, 8, 0), lambda date: date in skipped_dates
+            ),
+            local_time(2026, 10, 28, 7, 30),
+        )
+        self.assertIsNone(
+            rule.get_next_run(local_time(2026, 10, 23, 8, 0), lambda date: True)
+        )
+
+    def test_other_timezones(self):
+        rule = ScheduleRule.parse("daily 07:30")
+        # 05:00 UTC is 06:00 in Sweden during winter time
+        next_run = rule.get_next_run(
+            datetime.datetime(2026, 12, 1, 5, 0, tzinfo=datetime.timezone.utc)
+        )
+        self.assertEqual(next_run, local_time(2026, 12, 1, 7, 30))
+        self.assertEqual(next_run.utcoffset(), datetime.timedelta(hours=1))
+
+    def test_daylight_saving_time(self):
+        rule = ScheduleRule.parse("daily 02:30,07:30")
+        # The clocks are moved forward at 02:00 on 2026-03-29, so 02:30 does not exist and is moved to 03:30
+        next_run = rule.get_next_run(local_time(2026, 3, 29, 1, 0))
+        self.assertEqual(
+            next_run.astimezone(pytz.utc),
+            datetime.datetime(2026, 3, 29, 1, 30, tzinfo=pytz.utc),
+        )
+        self.assertEqual(
+            rule.get_next_run(local_time(2026, 3, 29, 4, 0)).utcoffset(),
+            datetime.timedelta(hours=2),
+        )
+        # After the clocks are moved back on 2026-10-25, the rule runs at 07:30 winter time
+        next_run = rule.get_next_run(local_time(2026, 10, 25, 4, 0))
+        self.assertEqual(next_run, local_time(2026, 10, 25, 7, 30))
+        self.assertEqual(next_run.utcoffset(), datetime.timedelta(hours=1))
+
+
+class HolidaysTests(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        self.holidays_filepath = os.path.join(
+            self.temporary_directory.name, "holidays.json"
+        )
+        with open(self.holidays_filepath, "w", encoding="UTF-8") as holidays_file:
+            json.dump(
+                {
+                    "holidays": [
+                        {"name": "Höstlov", "from": "2026-10-26", "to": "2026-10-30"},
+                        {"name": "Nyårsafton", "from": "2026-12-31"},
+                    ]
+                },
+                holidays_file,
+            )
+        for patcher in [
+            mock.patch.object(scheduler, "HOLIDAYS_FILEPATH", self.holidays_filepath),
+            mock.patch.object(
+                scheduler,
+                "holidays_cache",
+                ModelCache(self.holidays_filepath, parse_holidays),
+            ),
+            mock.patch.object(scheduler, "holidays_outdated_warned_at", None),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(self.temporary_directory.cleanup)
+
+    def get_holidays_at(self, now: datetime.datetime):
+        with mock.patch.object(scheduler, "get_now", return_value=now):
+            return asyncio.run(scheduler.get_holidays())
+
+    def test_parse_holidays(self):
+        self.assertEqual(
+            self.get_holidays_at(local_time(2026, 10, 19, 8, 0)),
+            [
+                (datetime.date(2026, 10, 26), datetime.date(2026, 10, 30)),
+                (datetime.date(2026, 12, 31), datetime.date(2026, 12, 31)),
+            ],
+        )
+
+    def test_no_warning_until_all_holidays_have_passed(self):
+        with self.assertNoLogs(scheduler.logger, "WARNING"):
+            self.get_holidays_at(local_time(2026, 12, 31, 23, 0))
+
+    def test_warns_once_a_day_when_all_holidays_have_passed(self):
+        with self.assertLogs(scheduler.logger, "WARNING") as logs:
+            self.get_holidays_at(local_time(2027, 1, 1, 8, 0))
+            self.get_holidays_at(local_time(2027, 1, 1, 9, 0))
+            self.get_holidays_at(local_time(2027, 1, 2, 8, 0))
+        self.assertEqual(len(logs.records), 2)
+
+    def test_holidays_file_is_valid(self):
+        with open(HOLIDAYS_FILEPATH, encoding="UTF-8") as holidays_file:
+            holidays = parse_holidays(json.load(holidays_file))
+        for first_day, last_day in holidays:
+            self.assertLessEqual(first_day, last_day)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+"""test_subscription.py
+Tests for how subscriptions are stored (see utils/subscription.py). The subscription module sets up its storage when it is
+imported, so every test imports it again with the files in a temporary directory."""
+import asyncio, datetime, importlib, os, sys, tempfile, unittest, pytz
+from types import SimpleNamespace
+from unittest import mock
+from utils import general
+from utils.document_store import document_store
+from utils.journal import journals
+
+
+class SubscriptionStorageTests(unittest.TestCase):
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        self.subscriptions_filepath = os.path.join(
+            self.temporary_directory.name, "subscriptions.json"
+        )
+        self.database_filepath = os.path.join(
+            self.temporary_directory.name, "subscriptions.sqlite3"
+        )
+        self.addCleanup(self.temporary_directory.cleanup)
+        self.addCleanup(sys.modules.pop, "utils.subscription", None)
+        self.addCleanup(self.forget_document)
+        # The active classes depend on the date (see get_active_classes())
+        now_patcher = mock.patch.object(
+            general,
+            "get_now",
+            return_value=pytz.timezone(general.BASE_TIMEZONE).localize(
+                datetime.datetime(2026, 10, 19, 8, 0)
+            ),
+        )
+        now_patcher.start()
+        self.addCleanup(now_patcher.stop)
+
+    def forget_document(self):
+        """Drops the subscriptions document and its journal from memory without writing it, like a crash would."""
+        with document_store.lock:
+            for store_data in [
+                document_store.documents,
+                document_store.file_signatures,
+                document_store.versions,
+                document_store.load_hooks,
+            ]:
+                store_data.pop(self.subscriptions_filepath, None)
+            document_store.dirty_filepaths.discard(self.subscriptions_filepath)
+        journals.pop(self.subscriptions_filepath, None)
+
+    def import_subscription_module(self, storage_engine: str):
+        """Imports the subscription module as if the bot was started.
+
+        :param storage_engine: The storage engine to use, "json" or "sqlite"."""
+        sys.modules.pop("utils.subscription", None)
+        with mock.patch.dict(
+            os.environ, {"SSIS_DISCORD_BOT_SUBSCRIPTION_STORAGE": storage_engine}
+        ), mock.patch.object(
+            general, "SUBSCRIPTIONS_DATA_FILEPATH", self.subscriptions_filepath
+        ), mock.patch.object(
+            general, "SUBSCRIPTIONS_DATABASE_FILEPATH", self.database_filepath
+        ):
+            subscription = importlib.import_module("utils.subscription")
+        if subscription.sqlite_storage is not None:
+            self.addCleanup(subscription.sqlite_storage.connection.close)
+        return subscription
+
+    def test_switching_to_sqlite_imports_journaled_changes(self):
+        subscription = self.import_subscription_module("json")
+
+        async def change_subscriptions():
+            for user_id in [1, 2, 3]:
+                await subscription.change_subscriber_status(
+                    "food", "daily", SimpleNamespace(id=user_id)
+                )
+            await subscription.change_subscriber_status(
+                "food", "daily", SimpleNamespace(id=2), add=False
+            )
+            await subscription.mark_users_notified(
+                [1], "food", "daily", general.get_now(), "2026-10-19"
+            )
+
+        asyncio.run(change_subscriptions())
+        # The changes are only in the journal, not in the snapshot file
+        self.assertGreater(
+            os.path.getsize(subscription.subscriptions_journal.journal_filepath), 0
+        )
+        self.forget_document()
+        subscription = self.import_subscription_module("sqlite")
+        self.assertIsNotNone(subscription.sqlite_storage)
+        self.assertEqual(
+            sorted(asyncio.run(subscription.get_subscribers("food", "daily"))), [1, 3]
+        )
+        self.assertEqual(
+            asyncio.run(
+                subscription.get_users_not_notified_after(
+                    general.get_now(), "food", "daily", "2026-10-19"
+                )
+            ),
+            [3],
+        )
+
+    def check_active_classes_can_be_subscribed_to(self, storage_engine: str):
+        """Checks that the active classes are subcategories of the schedule category.
+
+        :param storage_engine: The storage engine to use, "json" or "sqlite"."""
+        subscription = self.import_subscription_module(storage_engine)
+
+        async def subscribe():
+            self.assertTrue(await subscription.subscription_exists("schema", "te26a"))
+            # TE23 graduated in the summer of 2026
+            self.assertFalse(await subscription.subscription_exists("schema", "te23a"))
+            self.assertEqual(await subscription.get_subscribers("schema", "te24b"), [])
+            await subscription.change_subscriber_status(
+                "schema", "te24b", SimpleNamespace(id=1)
+            )
+            return await subscription.get_subscribers("schema", "te24b")
+
+        self.assertEqual(asyncio.run(subscribe()), [1])
+        self.assertEqual(
+            asyncio.run(subscription.search_subcategories("schema", "te26")),
+            ["te26a", "te26b", "te26c", "te26d"],
+        )
+
+    def test_active_classes_can_be_subscribed_to_with_json_storage(self):
+        self.check_active_classes_can_be_subscribed_to("json")
+
+    def test_active_classes_can_be_subscribed_to_with_sqlite_storage(self):
+        self.check_active_classes_can_be_subscribed_to("sqlite")
+
+    def test_class_subcategories_are_added_to_listed_ones(self):
+        subscription = self.import_subscription_module("json")
+        subscriptions_schema = {
+            "schema": {"subcategories": ["te24a", "lärare"]},
+            "food": {"subcategories": ["daily"]},
+        }
+        self.assertEqual(
+            subscription.add_class_subcategories(subscriptions_schema),
+            {
+                "schema": {
+                    "subcategories": ["te24a", "lärare"]
+                    + [
+                        f"te{year}{letter}"
+                        for year in [24, 25, 26]
+                        for letter in "abcd"
+                        if f"te{year}{letter}" != "te24a"
+                    ]
+                },
+                "food": {"subcategories": ["daily"]},
+            },
+        )
+        # The schema is not changed in place
+        self.assertEqual(
+            subscriptions_schema["schema"]["subcategories"], ["te24a", "lärare"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+"""announcements.py
+Contains functions for keeping track of club announcements that are being sent out to subscribers by DM.
+
+Every announcement is a job that is saved before any message is sent. Every recipient that has been handled is then
+recorded in the job, so if the bot is restarted in the middle of sending an announcement, the job can be resumed
+without sending the announcement to anyone twice or skipping anyone. Since a job changes once per recipient,
+the changes are appended to a journal (see journal.py)."""
+from utils.general import (
+    aget_json,
+    write_json,
+    get_now,
+    ANNOUNCEMENT_JOBS_DATA_FILEPATH,
+)
+from utils.journal import Journal
+from utils.models import AnnouncementJob
+from typing import List, Optional
+import logging, os, uuid
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ANNOUNCEMENT_JOBS_JSON = {"jobs": {}}
+
+
+async def get_unfinished_announcement_jobs() -> List[AnnouncementJob]:
+    """Gets all announcement jobs that have not been finished."""
+    announcement_jobs_data = await aget_json(
+        ANNOUNCEMENT_JOBS_DATA_FILEPATH, copy=False
+    )
+    return [
+        AnnouncementJob.from_json(job_data)
+        for job_data in announcement_jobs_data["jobs"].values()
+    ]
+
+
+async def create_announcement_job(
+    club_id: str,
+    author_id: int,
+    message: str,
+    recipient_ids: List[int],
+    progress_channel_id: Optional[int],
+    progress_message_id: Optional[int],
+) -> AnnouncementJob:
+    """Creates and saves a new announcement job.
+
+    :param club_id: The ID of the club that the announcement is from.
+
+    :param author_id: The ID of the user that wrote the announcement.
+
+    :param message: The text of the announcement.
+
+    :param recipient_ids: The IDs of the users to send the announcement to.
+
+    :param progress_channel_id: The ID of the channel of the message where progress should be reported.
+
+    :param progress_message_id: The ID of the message where progress should be reported."""
+    announcement_job = AnnouncementJob(
+        uuid.uuid4().hex,
+        club_id,
+        author_id,
+        message,
+        list(recipient_ids),
+        set(),
+        set(),
+        progress_channel_id,
+        progress_message_id,
+        str(get_now()),
+    )
+    await announcement_jobs_journal.aappend(
+        "add_announcement_job", job=announcement_job.to_json()
+    )
+    logger.info(
+        f"Created announcement job {announcement_job.id} for {len(recipient_ids)} recipients."
+    )
+    return announcement_job
+
+
+async def mark_announcement_recipient(
+    announcement_job: AnnouncementJob, user_id: int, delivered: bool
+):
+    """Records that a recipient of an announcement has been handled.
+
+    :param announcement_job: The announcement job.
+
+    :param user_id: The ID of the recipient.
+
+    :param delivered: True if the announcement was sent to the recipient, False if sending failed.
+    """
+    (announcement_job.delivered_ids if delivered else announcement_job.failed_ids).add(
+        user_id
+    )
+    await announcement_jobs_journal.aappend(
+        "mark_announcement_recipient",
+        job_id=announcement_job.id,
+        user_id=user_id,
+        delivered=delivered,
+    )
+
+
+async def finish_announcement_job(announcement_job: AnnouncementJob):
+    """Removes an announcement job that all recipients have been handled for.
+
+    :param announcement_job: The announcement job."""
+    await announcement_jobs_journal.aappend(
+        "remove_announcement_job", job_id=announcement_job.id
+    )
+    logger.info(f"Announcement job {announcement_job.id} finished.")
+
+
+# Journal operations. These must be idempotent, see journal.py.
+def apply_add_announcement_job(announcement_jobs_data, record):
+    """Applies an add_announcement_job journal record.
+
+    :param announcement_jobs_data: The content of the announcement jobs file.
+
+    :param record: The journal record."""
+    announcement_jobs_data["jobs"].setdefault(record["job"]["id"], record["job"])
+
+
+def apply_mark_announcement_recipient(announcement_jobs_data, record):
+    """Applies a mark_announcement_recipient journal record.
+
+    :param announcement_jobs_data: The content of the announcement jobs file.
+
+    :param record: The journal record."""
+    job_data = announcement_jobs_data["jobs"].get(record["job_id"], None)
+    if job_data is None:  # (the job has been finished)
+        return
+    user_ids = job_data["delivered_ids" if record["delivered"] else "failed_ids"]
+    if record["user_id"] not in user_ids:
+        user_ids.append(record["user_id"])
+
+
+def apply_remove_announcement_job(announcement_jobs_data, record):
+    """Applies a remove_announcement_job journal record.
+
+    :param announcement_jobs_data: The content of the announcement jobs file.
+
+    :param record: The journal record."""
+    announcement_jobs_data["jobs"].pop(record["job_id"], None)
+
+
+# Create file if doesn't exists
+if not os.path.exists(ANNOUNCEMENT_JOBS_DATA_FILEPATH):
+    logger.info("Creating announcement jobs file...")
+    write_json(ANNOUNCEMENT_JOBS_DATA_FILEPATH, DEFAULT_ANNOUNCEMENT_JOBS_JSON)
+announcement_jobs_journal = Journal(
+    ANNOUNCEMENT_JOBS_DATA_FILEPATH,
+    {
+        "add_announcement_job": apply_add_announcement_job,
+        "mark_announcement_recipient": apply_mark_announcement_recipient,
+        "remove_announcement_job": apply_remove_announcement_job,
+    },
+)
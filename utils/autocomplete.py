@@ -0,0 +1,67 @@
+"""autocomplete.py
+Contains a prefix index that is used for autocompleting slash command options.
+
+Discord requires autocomplete responses to be sent within 3 seconds of every keystroke. Instead of loading
+the options and filtering them on every request, the options are kept sorted by their normalized form, so that all options
+starting with what the user has typed can be found with a binary search. Indexes are only rebuilt when the options
+have changed: the index of club IDs is rebuilt together with the club registry (see clubs.py), and other option sources
+build their index with a ModelCache (see models.py).
+
+Matching ignores case and diacritics, so typing "elevradet" finds "elevrådet"."""
+import unicodedata
+from bisect import bisect_left
+from typing import Iterable, List, Optional
+
+# Discord does not allow more choices than this in an autocomplete response
+AUTOCOMPLETE_MAX_CHOICES = 25
+
+
+def normalize_search_text(text: str) -> str:
+    """Normalizes text for case- and diacritic-insensitive matching.
+
+    :param text: The text to normalize.
+
+    :returns: The text in lowercase with diacritics removed, for example "elevradet" for "Elevrådet"."""
+    decomposed_text = unicodedata.normalize("NFKD", text)
+    return "".join(
+        character
+        for character in decomposed_text
+        if not unicodedata.combining(character)
+    ).casefold()
+
+
+class PrefixIndex:
+    def __init__(self, options: Iterable[str]):
+        """Creates an index of options that can be searched by prefix.
+
+        :param options: The options to index."""
+        # List of (normalized option, option), sorted by the normalized option
+        self.entries = sorted(
+            {(normalize_search_text(option), option) for option in options}
+        )
+        self.keys = [normalized_option for normalized_option, _ in self.entries]
+
+    def search(
+        self, query: Optional[str], limit: int = AUTOCOMPLETE_MAX_CHOICES
+    ) -> List[str]:
+        """Finds the options that start with a query.
+
+        :param query: What the user has typed so far. If empty or None, the first options are returned.
+
+        :param limit: The maximum number of options to return.
+
+        :returns: The matching options in alphabetical order."""
+        prefix = normalize_search_text(query or "")
+        matches = []
+        # All options starting with the prefix are next to each other, starting where the prefix would be inserted
+        entry_index = bisect_left(self.keys, prefix)
+        while entry_index < len(self.entries) and len(matches) < limit:
+            normalized_option, option = self.entries[entry_index]
+            if not normalized_option.startswith(prefix):
+                break
+            matches.append(option)
+            entry_index += 1
+        return matches
+
+    def __len__(self) -> int:
+        return len(self.entries)
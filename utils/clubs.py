@@ -1,6 +1,24 @@
 """utils\clubs.py
-Contains helper functions related to getting fluid_data about clubs."""
-from utils.general import get_json, write_json, CLUBS_DATA_FILEPATH, get_now
+Contains helper functions related to getting fluid_data about clubs.
+
+Subscribers are added and removed by appending records to a journal (see journal.py)
+instead of rewriting the whole clubs file.
+
+Clubs are read from a registry (see ClubRegistry) that is kept in memory with indexes and updated on every change,
+so looking up clubs does not touch the disk."""
+from utils.general import (
+    aget_json,
+    get_file_lock,
+    run_file_io,
+    CLUBS_DATA_FILEPATH,
+    get_now,
+)
+from utils.document_store import document_store
+from utils.journal import Journal
+from utils.autocomplete import PrefixIndex
+from utils.models import Club, Subscriber
+from copy import deepcopy
+from typing import Dict, List, Optional
 import logging
 from nextcord import Embed
 
@@ -8,90 +26,220 @@ from nextcord import Embed
 logger = logging.getLogger(__name__)
 
 
-def get_clubs_data():
-    """Shortcut function to get fluid_data about clubs."""
-    return get_json(CLUBS_DATA_FILEPATH)
+async def get_clubs_data(copy=True):
+    """Shortcut function to get fluid_data about clubs.
 
+    :param copy: If False, the in-memory data is returned. Only use this for read-only access."""
+    return await aget_json(CLUBS_DATA_FILEPATH, copy=copy)
 
-def write_clubs_data(club_data):
+
+async def write_clubs_data(club_data):
     """Shortcut function to write fluid_data to the clubs file.
+    If you have read the data before changing it, hold the lock from get_clubs_lock() while doing so.
 
     :param club_data: Data to write."""
-    write_json(CLUBS_DATA_FILEPATH, club_data)
+    await clubs_journal.areplace(club_data)
+    await club_registry.refresh()
+
+
+def get_clubs_lock():
+    """Gets the lock that should be held while doing read-modify-write cycles on the clubs file."""
+    return get_file_lock(CLUBS_DATA_FILEPATH)
+
+
+class ClubRegistry:
+    def __init__(self):
+        """Initializes an empty registry. Use load() to fill it."""
+        # Mapping: club ID --> club (in the same order as in the clubs file)
+        self.clubs_by_id: Dict[str, Club] = {}
+        # Mapping: ID of the subscriber role of a club --> club
+        self.clubs_by_role_id: Dict[int, Club] = {}
+        # Index of club IDs for autocompleting them (see autocomplete.py)
+        self.club_id_index = PrefixIndex([])
+        # The version of the clubs file that the registry matches (see DocumentStore.get_version())
+        self.version: Optional[int] = None
+
+    def load(self, clubs_data, version: int):
+        """Rebuilds the registry from the content of the clubs file.
+
+        :param clubs_data: The content of the clubs file.
+
+        :param version: The version of the clubs file."""
+        clubs = [Club.from_json(club_data) for club_data in clubs_data["clubs"]]
+        self.clubs_by_id = {club.id: club for club in clubs}
+        self.clubs_by_role_id = {club.role_id: club for club in clubs}
+        self.club_id_index = PrefixIndex(self.clubs_by_id.keys())
+        self.version = version
+        logger.debug(f"Club registry loaded with {len(clubs)} clubs.")
+
+    async def refresh(self):
+        """Rebuilds the registry if the clubs file has been changed, for example by someone editing it by hand."""
+        clubs_data, version = await run_file_io(
+            document_store.get_with_version, CLUBS_DATA_FILEPATH
+        )
+        if version != self.version:
+            self.load(clubs_data, version)
+
+    def get(self, club_id: str) -> Optional[Club]:
+        """Gets a club by its ID. The club must not be modified.
+
+        :param club_id: The ID of the club.
+
+        :returns: The club if found, None if the club can not be found."""
+        return self.clubs_by_id.get(club_id, None)
+
+    def search_ids(self, query: Optional[str]) -> List[str]:
+        """Finds the IDs of clubs starting with a query, for autocompleting club IDs.
+
+        :param query: What the user has typed so far."""
+        return self.club_id_index.search(query)
+
+    def get_by_role_id(self, role_id: int) -> Optional[Club]:
+        """Gets a club by the ID of its subscriber role. The club must not be modified.
+
+        :param role_id: The ID of the role.
+
+        :returns: The club if found, None if the club can not be found."""
+        return self.clubs_by_role_id.get(role_id, None)
+
+    def get_all(self) -> List[Club]:
+        """Gets all clubs. The clubs must not be modified."""
+        return list(self.clubs_by_id.values())
+
+    def add_subscriber(self, club_id: str, subscriber: Subscriber, version: int):
+        """Updates the registry after a subscriber has been added to a club.
+
+        :param club_id: The ID of the club.
+
+        :param subscriber: The subscriber that was added.
+
+        :param version: The version of the clubs file after the change."""
+        self.clubs_by_id[club_id].subscribers[subscriber.user_id] = subscriber
+        self.version = version
+
+    def remove_subscriber(self, club_id: str, user_id: int, version: int):
+        """Updates the registry after a subscriber has been removed from a club.
+
+        :param club_id: The ID of the club.
+
+        :param user_id: The ID of the subscriber that was removed.
+
+        :param version: The version of the clubs file after the change."""
+        self.clubs_by_id[club_id].subscribers.pop(user_id, None)
+        self.version = version
+
+
+def get_clubs() -> List[Club]:
+    """Gets all clubs. The returned clubs must not be modified, use get_club_by_id() to get a club to change."""
+    return club_registry.get_all()
 
 
 def get_club_ids():
     """Function to get all IDs of clubs that have been created."""
-    club_ids = []
-    for club in get_clubs_data()["clubs"]:
-        club_ids.append(club["id"])
-    return club_ids  # Return list of club IDs
+    return list(club_registry.clubs_by_id.keys())  # Return list of club IDs
 
 
-def get_club_by_id(requested_club_id, return_index=False):
+def find_club_index(clubs_data, requested_club_id):
+    """Finds the index of a club in the clubs data.
+
+    :param clubs_data: The content of the clubs file.
+
+    :param requested_club_id: The ID of the club.
+
+    :returns: The index of the club if found, None if the club can not be found."""
+    for index, club in enumerate(clubs_data["clubs"]):
+        if club["id"] == requested_club_id:
+            return index
+    return None
+
+
+def get_club_by_id(requested_club_id) -> Optional[Club]:
     """Shortcut function to find a club by its id.
 
     :param requested_club_id: The name of the club.
 
-    :returns the club fluid_data if found, None if the club can not be found."""
-    # Iterate through clubs to try to find the club
-    index = 0
-    for club_id in get_club_ids():
-        if club_id == requested_club_id:
-            for club in get_clubs_data()["clubs"]:
-                if club["id"] == requested_club_id:
-                    club_data = club
-                    break
-            return club_data if not return_index else (club_data, index)
-        index += 1
-    return None if not return_index else (None, None)
-
-
-def get_club_subscribers(club_data):
+    :returns the club if found, None if the club can not be found. The club is a copy which the caller is free to modify.
+    """
+    club = club_registry.get(requested_club_id)
+    return deepcopy(club) if club is not None else None
+
+
+def get_club_subscribers(club: Club):
     """Function to get all subscribers to a club.
 
-    :param club_data: The fluid_data for the club as a dictionary.
+    :param club: The club.
 
     :returns: A list of user IDs that are subscribing to the club
     """
-    return [subscriber["user_id"] for subscriber in club_data["subscribers"]]
+    return list(club.subscribers.keys())
 
 
-def is_subscriber_to_club(club_data, user):
+def is_subscriber_to_club(club: Club, user):
     """Function to check if a user is subscribing to a club or not.
 
-    :param club_data: The fluid_data for the club as a dictionary.
+    :param club: The club.
 
     :param user: The user that you want to check if it is subscribing."""
     logger.debug(
-        f"Checking subscription for {user.mention} with roles {user.roles}. Club role ID is {club_data['role_id']}"
+        f"Checking subscription for {user.mention} with roles {user.roles}. Club role ID is {club.role_id}"
     )
-    return user.id in get_club_subscribers(club_data) or club_data["role_id"] in [
-        role.id for role in user.roles
-    ]
+    return user.id in club.subscribers or any(
+        role.id == club.role_id for role in user.roles
+    )
+
+
+def is_club_owner(club: Club, user):
+    """Function to check if a user is an owner of a club.
+
+    :param club: The club.
+
+    :param user: The user (member) that you want to check if it is an owner."""
+    return user.id in club.owners or any(
+        role.id == club.owners_role_id for role in user.roles
+    )
+
 
+def get_club_recipient_ids(club: Club, guild) -> List[int]:
+    """Gets the IDs of everyone that should receive announcements from a club: subscribers
+    and members that have the subscriber role of the club.
 
-def add_subscriber_to_club(club_id, user):
+    :param club: The club.
+
+    :param guild: The guild that the club is in."""
+    recipient_ids = list(club.subscribers.keys())
+    role = guild.get_role(club.role_id) if guild is not None else None
+    if role is not None:
+        recipient_ids.extend(
+            member.id
+            for member in role.members
+            if member.id not in club.subscribers and not member.bot
+        )
+    return recipient_ids
+
+
+async def add_subscriber_to_club(club_id, user):
     """Function for adding a subscriber to a club.
 
     :param club_id: The club ID to add the subscriber to
 
     :param user: The user ID to add to the club.
     """
-    club_data, club_index = get_club_by_id(club_id, return_index=True)
-    if not is_subscriber_to_club(club_data, user):  # Add subscriber
-        club_data["subscribers"].append(
-            {"user_id": user.id, "added_at": str(get_now())}
-        )
-    else:
-        logger.info("User is not subscribed.")
-    # Update club fluid_data
-    clubs_data = get_clubs_data()
-    clubs_data["clubs"][club_index] = club_data
-    write_clubs_data(clubs_data)
-
-
-def remove_subscriber_from_club(club_id, user):
+    async with get_clubs_lock():
+        club = club_registry.get(club_id)
+        if not is_subscriber_to_club(club, user):  # Add subscriber
+            subscriber = Subscriber(user.id, str(get_now()), None, None)
+            new_version = await clubs_journal.aappend(
+                "add_subscriber_to_club",
+                club_id=club_id,
+                user_id=subscriber.user_id,
+                added_at=subscriber.added_at,
+            )
+            club_registry.add_subscriber(club_id, subscriber, new_version)
+        else:
+            logger.info("User is already subscribed.")
+
+
+async def remove_subscriber_from_club(club_id, user):
     """Function for adding a subscriber to a club.
 
     :param club_id: The club ID to remove the subscriber from
@@ -99,31 +247,91 @@ def remove_subscriber_from_club(club_id, user):
     :param user: The user ID to add to the club.
     """
     logger.info("Removing user from club...")
-    club_data, club_index = get_club_by_id(club_id, return_index=True)
-    club_subscribers = get_club_subscribers(club_data)
-    if is_subscriber_to_club(club_data, user) and user.id in club_subscribers:
-        # Find the subscriber
-        subscriber_index = club_subscribers.index(user.id)
-        club_data["subscribers"].pop(subscriber_index)
-        logger.debug("Change done in memory.")
-    else:
-        logger.info("User is not subscribed to the club (at least not in JSON).")
-    # Update club fluid_data
-    clubs_data = get_clubs_data()
-    clubs_data["clubs"][club_index] = club_data
-    write_clubs_data(clubs_data)
+    async with get_clubs_lock():
+        club = club_registry.get(club_id)
+        if is_subscriber_to_club(club, user) and user.id in club.subscribers:
+            new_version = await clubs_journal.aappend(
+                "remove_subscriber_from_club", club_id=club_id, user_id=user.id
+            )
+            club_registry.remove_subscriber(club_id, user.id, new_version)
+            logger.debug("Change done in memory.")
+        else:
+            logger.info("User is not subscribed to the club (at least not in JSON).")
     logger.info("User unsubscribed to the club.")
 
 
-def update_club_data_by_id(club_id: str, new_data: dict):
+async def update_club_data_by_id(club_id: str, new_club: Club):
     """Allows to update the data of a club using its ID.
 
     :param club_id: The ID of the club.
 
-    :param new_data: The new data to set on the club."""
-    clubs_data = get_clubs_data()
-    club, club_index = get_club_by_id(club_id, return_index=True)
-    if club is None:
-        raise KeyError("The club to update could not be found.")
-    clubs_data["clubs"][club_index] = new_data
-    write_clubs_data(clubs_data)
+    :param new_club: The club with the new data."""
+    async with get_clubs_lock():
+        clubs_data = await get_clubs_data()
+        club_index = find_club_index(clubs_data, club_id)
+        if club_index is None:
+            raise KeyError("The club to update could not be found.")
+        clubs_data["clubs"][club_index] = new_club.to_json()
+        await write_clubs_data(clubs_data)
+
+
+async def create_club(club: Club):
+    """Adds a new club.
+
+    :param club: The club to add."""
+    async with get_clubs_lock():
+        clubs_data = await get_clubs_data()
+        clubs_data["clubs"].append(club.to_json())
+        await write_clubs_data(clubs_data)
+
+
+# Journal operations. These must be idempotent, see journal.py.
+def apply_add_subscriber_to_club(clubs_data, record):
+    """Applies an add_subscriber_to_club journal record.
+
+    :param clubs_data: The content of the clubs file.
+
+    :param record: The journal record."""
+    club_index = find_club_index(clubs_data, record["club_id"])
+    if club_index is None:
+        logger.warning(f"Club {record['club_id']} in journal record does not exist.")
+        return
+    club_data = clubs_data["clubs"][club_index]
+    if all(
+        subscriber["user_id"] != record["user_id"]
+        for subscriber in club_data["subscribers"]
+    ):
+        club_data["subscribers"].append(
+            {"user_id": record["user_id"], "added_at": record["added_at"]}
+        )
+
+
+def apply_remove_subscriber_from_club(clubs_data, record):
+    """Applies a remove_subscriber_from_club journal record.
+
+    :param clubs_data: The content of the clubs file.
+
+    :param record: The journal record."""
+    club_index = find_club_index(clubs_data, record["club_id"])
+    if club_index is None:
+        logger.warning(f"Club {record['club_id']} in journal record does not exist.")
+        return
+    club_data = clubs_data["clubs"][club_index]
+    club_data["subscribers"] = [
+        subscriber
+        for subscriber in club_data["subscribers"]
+        if subscriber["user_id"] != record["user_id"]
+    ]
+
+
+clubs_journal = Journal(
+    CLUBS_DATA_FILEPATH,
+    {
+        "add_subscriber_to_club": apply_add_subscriber_to_club,
+        "remove_subscriber_from_club": apply_remove_subscriber_from_club,
+    },
+)
+
+# The registry is loaded when the bot starts and then kept up to date by the functions above
+club_registry = ClubRegistry()
+club_registry.load(*document_store.get_with_version(CLUBS_DATA_FILEPATH))
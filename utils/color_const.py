@@ -8,3 +8,4 @@ ERROR_EMBED_COLOR = Color.red()
 MENU_EMBED_COLOR = Color.blurple()
 PENTRYANSVAR_EMBED_COLOR = 16777215  # (white)
 MESSAGE_SUBSCRIPTIONS_EMBED_COLOR = Color.green()
+SCHEDULE_EMBED_COLOR = Color.teal()
@@ -0,0 +1,341 @@
+"""document_store.py
+Contains an in-memory store for the JSON documents that the bot uses.
+Without it, every command, autocomplete keystroke and task loop reads and parses the JSON file
+it needs from disk. The store loads each file once, serves reads from memory and reloads a file
+only if it has been written by the bot or changed on disk by someone else (detected using
+the modification time and size of the file).
+
+Writes are write-behind: a written document is updated in memory right away and marked as dirty.
+All dirty documents are then written to disk together once the write-behind window has passed,
+so a burst of writes to the same file results in a single disk write. Files are written atomically
+(to a temporary file which is synced to disk and then renamed over the original file),
+so a crash in the middle of a write can never leave a half-written file behind.
+
+Since the fluid storage might be a network-mounted volume, disk writes scheduled from the event loop are
+run in a small thread pool (file_io_executor) so they can not block the bot. The store can therefore be used
+from multiple threads at once."""
+import asyncio, atexit, copy, json, logging, os, stat, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# How long (in seconds) to wait before writing changed documents to disk. Writes happening within
+# the window are coalesced into one write. Set to 0 to write documents to disk as soon as possible.
+WRITE_BEHIND_WINDOW = float(os.getenv("SSIS_DISCORD_BOT_WRITE_BEHIND_WINDOW", 2))
+# Maximum number of threads used for file I/O
+FILE_IO_WORKERS = int(os.getenv("SSIS_DISCORD_BOT_FILE_IO_WORKERS", 4))
+file_io_executor = ThreadPoolExecutor(
+    max_workers=FILE_IO_WORKERS, thread_name_prefix="file_io"
+)
+
+
+def atomic_write_text(filepath: str, text: str) -> int:
+    """Writes text to a file atomically. The text is written to a temporary file in the same directory,
+    synced to disk and then renamed over the target file.
+
+    :param filepath: The path to the file to write.
+
+    :param text: The text to write.
+
+    :returns: The number of bytes written."""
+    encoded_text = text.encode("UTF-8")
+    directory, filename = os.path.split(os.path.abspath(filepath))
+    file_descriptor, temporary_filepath = tempfile.mkstemp(
+        dir=directory, prefix=f".{filename}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(file_descriptor, "wb") as temporary_file:
+            temporary_file.write(encoded_text)
+            temporary_file.flush()
+            os.fsync(temporary_file.fileno())
+        # Temporary files are only readable by the owner, so keep the permissions of the file that is replaced
+        os.chmod(
+            temporary_filepath,
+            stat.S_IMODE(os.stat(filepath).st_mode)
+            if os.path.exists(filepath)
+            else 0o644,
+        )
+        os.replace(temporary_filepath, filepath)
+    except BaseException:
+        if os.path.exists(temporary_filepath):
+            os.remove(temporary_filepath)
+        raise
+    return len(encoded_text)
+
+
+class DocumentStore:
+    def __init__(self, write_behind_window: float = WRITE_BEHIND_WINDOW):
+        """Initializes an empty document store.
+
+        :param write_behind_window: How long to wait (in seconds) before writing changed documents to disk.
+        """
+        self.write_behind_window = write_behind_window
+        # Mapping: filepath --> parsed document
+        self.documents: Dict[str, object] = {}
+        # Mapping: filepath --> (modification time, size) of the file when the document was loaded
+        self.file_signatures: Dict[str, Tuple[int, int]] = {}
+        # Mapping: filepath --> a number that is increased every time the document changes
+        self.versions: Dict[str, int] = {}
+        # Documents that have been changed in memory but not written to disk yet
+        self.dirty_filepaths: Set[str] = set()
+        self.scheduled_flush: Optional[asyncio.TimerHandle] = None
+        # Mapping: filepath --> function that is called with a document when it has been loaded from disk
+        # and returns the document to store. Used to replay journals on top of snapshot files (see journal.py).
+        self.load_hooks: Dict[str, Callable] = {}
+        # Protects the state of the store. File I/O is done without holding this lock.
+        self.lock = threading.RLock()
+        # Makes sure that only one flush writes files at a time
+        self.flush_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.disk_writes = 0
+        self.bytes_written = 0
+        self.total_write_latency = 0.0
+        self.max_write_latency = 0.0
+
+    @staticmethod
+    def get_file_signature(filepath: str) -> Tuple[int, int]:
+        """Gets a signature of a file on disk that changes when the file is modified.
+
+        :param filepath: The path to the file."""
+        file_stat = os.stat(filepath)
+        return file_stat.st_mtime_ns, file_stat.st_size
+
+    def get_version(self, filepath: str) -> int:
+        """Gets the current version of a document. The version changes every time the
+        document is reloaded or written, which makes it useful for invalidating caches built from the document.
+
+        :param filepath: The path to the document."""
+        return self.get_with_version(filepath)[1]
+
+    def get_with_version(self, filepath: str) -> Tuple[object, int]:
+        """Gets a document from the store together with its current version (see get_version()).
+        The document that is stored in memory is returned, so it must not be modified.
+
+        :param filepath: The path to the document."""
+        self.get(filepath, copy_document=False)  # Make sure that the document is fresh
+        with self.lock:
+            return self.documents[filepath], self.versions[filepath]
+
+    def get(self, filepath: str, copy_document: bool = True):
+        """Gets a document from the store, loading it from disk if needed.
+
+        :param filepath: The path to the document.
+
+        :param copy_document: If True, a copy of the document is returned which the caller is free to modify.
+        If False, the document that is stored in memory is returned. It must then not be modified.
+        """
+        with self.lock:
+            document_is_dirty = filepath in self.dirty_filepaths
+        if not document_is_dirty:
+            file_signature = self.get_file_signature(filepath)
+            with self.lock:
+                document_is_fresh = (
+                    filepath in self.dirty_filepaths
+                    or self.file_signatures.get(filepath) == file_signature
+                )
+            if not document_is_fresh:
+                with open(filepath, encoding="UTF-8") as json_file:
+                    loaded_document = json.loads(json_file.read())
+                if filepath in self.load_hooks:
+                    loaded_document = self.load_hooks[filepath](loaded_document)
+                with self.lock:
+                    # Don't overwrite the document if it was written while we were reading it
+                    if filepath not in self.dirty_filepaths:
+                        if filepath in self.documents:
+                            logger.debug(
+                                f"{filepath} has changed on disk. Reloading..."
+                            )
+                            self.invalidations += 1
+                        self.misses += 1
+                        self.documents[filepath] = loaded_document
+                        self.file_signatures[filepath] = file_signature
+                        self.versions[filepath] = self.versions.get(filepath, 0) + 1
+                    document = self.documents[filepath]
+                    # (documents can be changed in place by update(), so copy while holding the lock)
+                    return copy.deepcopy(document) if copy_document else document
+        with self.lock:
+            self.hits += 1
+            document = self.documents[filepath]
+            return copy.deepcopy(document) if copy_document else document
+
+    def register_load_hook(self, filepath: str, load_hook: Callable):
+        """Registers a function that is called every time a document is loaded from disk.
+        The function is called with the loaded document and should return the document to store.
+
+        :param filepath: The path to the document.
+
+        :param load_hook: The function to call."""
+        with self.lock:
+            self.load_hooks[filepath] = load_hook
+            # Make sure that the hook is applied to the document the next time it is requested
+            if filepath in self.documents and filepath not in self.dirty_filepaths:
+                del self.documents[filepath]
+                del self.file_signatures[filepath]
+
+    def update(self, filepath: str, update_function: Callable):
+        """Changes a document in place in memory without writing it to disk.
+        This is only useful if the change is persisted somewhere else, such as in a journal (see journal.py).
+
+        :param filepath: The path to the document.
+
+        :param update_function: A function that is called with the document and changes it in place.
+
+        :returns: The new version of the document."""
+        with self.lock:
+            document_is_loaded = filepath in self.documents
+        if not document_is_loaded:
+            self.get(filepath, copy_document=False)
+        with self.lock:
+            update_function(self.documents[filepath])
+            self.versions[filepath] += 1
+            return self.versions[filepath]
+
+    def mark_dirty(self, filepath: str):
+        """Marks the document in memory as changed, so that the next flush writes it to disk as it is at that time.
+        Unlike write(), the document is not replaced, so changes made in between (for example with update()) are kept.
+
+        :param filepath: The path to the document."""
+        with self.lock:
+            document_is_loaded = filepath in self.documents
+        if not document_is_loaded:
+            self.get(filepath, copy_document=False)
+        with self.lock:
+            self.dirty_filepaths.add(filepath)
+
+    def write(self, filepath: str, new_document):
+        """Updates a document in memory and queues it to be written to disk.
+
+        :param filepath: The path to the document.
+
+        :param new_document: The new content of the document."""
+        # Store a copy so that changes the caller makes after writing are not reflected in the store
+        new_document = copy.deepcopy(new_document)
+        with self.lock:
+            self.documents[filepath] = new_document
+            self.versions[filepath] = self.versions.get(filepath, 0) + 1
+            self.dirty_filepaths.add(filepath)
+        self.schedule_flush()
+
+    def schedule_flush(self):
+        """Schedules writing of dirty documents to disk after the write-behind window.
+        The write is done in the file I/O thread pool. If there is no running event loop
+        (for example when the bot is starting), documents are written directly."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        with self.lock:
+            if self.scheduled_flush is None:
+                self.scheduled_flush = loop.call_later(
+                    max(self.write_behind_window, 0),
+                    self.flush_in_background,
+                    loop,
+                )
+
+    def flush_in_background(self, loop: asyncio.AbstractEventLoop):
+        """Writes all dirty documents to disk using the file I/O thread pool.
+
+        :param loop: The running event loop."""
+        with self.lock:
+            self.scheduled_flush = None
+        flush_future = loop.run_in_executor(file_io_executor, self.flush)
+        flush_future.add_done_callback(self.log_failed_flush)
+
+    @staticmethod
+    def log_failed_flush(flush_future: asyncio.Future):
+        """Logs an exception if a background flush failed.
+
+        :param flush_future: The future of the flush."""
+        if not flush_future.cancelled() and flush_future.exception() is not None:
+            logger.critical(
+                "Failed to write documents to disk!", exc_info=flush_future.exception()
+            )
+
+    def flush(self, filepath: Optional[str] = None):
+        """Writes dirty documents to disk.
+
+        :param filepath: The path to the document to write. If None, all dirty documents are written.
+        """
+        with self.flush_lock:
+            with self.lock:
+                filepaths = (
+                    [filepath] if filepath is not None else list(self.dirty_filepaths)
+                )
+                # Serialize the documents while holding the lock and write them after releasing it.
+                # Mapping: filepath --> (version of the document, serialized document)
+                serialized_documents = {
+                    filepath_to_write: (
+                        self.versions[filepath_to_write],
+                        json.dumps(self.documents[filepath_to_write], indent=True),
+                    )
+                    for filepath_to_write in filepaths
+                    if filepath_to_write in self.dirty_filepaths
+                }
+            for filepath_to_write, (
+                written_version,
+                serialized_document,
+            ) in serialized_documents.items():
+                write_started_at = time.perf_counter()
+                bytes_written = atomic_write_text(
+                    filepath_to_write, serialized_document
+                )
+                write_latency = time.perf_counter() - write_started_at
+                file_signature = self.get_file_signature(filepath_to_write)
+                with self.lock:
+                    self.file_signatures[filepath_to_write] = file_signature
+                    # The document stays dirty if it was changed while it was being written
+                    if self.versions[filepath_to_write] == written_version:
+                        self.dirty_filepaths.discard(filepath_to_write)
+                    self.disk_writes += 1
+                    self.bytes_written += bytes_written
+                    self.total_write_latency += write_latency
+                    self.max_write_latency = max(self.max_write_latency, write_latency)
+                logger.debug(
+                    f"Wrote {bytes_written} bytes to {filepath_to_write} in {round(write_latency * 1000, 2)} ms."
+                )
+
+    def invalidate(self, filepath: Optional[str] = None):
+        """Removes a document (or all documents) from memory, forcing them to be read from disk again.
+        Documents that have not been written to disk yet are written first.
+
+        :param filepath: The path to the document to invalidate. If None, all documents are invalidated.
+        """
+        self.flush(filepath)
+        with self.lock:
+            filepaths = (
+                [filepath] if filepath is not None else list(self.documents.keys())
+            )
+            for filepath_to_invalidate in filepaths:
+                if filepath_to_invalidate in self.documents:
+                    del self.documents[filepath_to_invalidate]
+                    del self.file_signatures[filepath_to_invalidate]
+                    self.invalidations += 1
+
+    def get_stats(self) -> Dict[str, object]:
+        """Returns statistics about how the store has been used."""
+        with self.lock:
+            return {
+                "documents": len(self.documents),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "pending_writes": len(self.dirty_filepaths),
+                "disk_writes": self.disk_writes,
+                "bytes_written": self.bytes_written,
+                "average_write_latency_ms": round(
+                    self.total_write_latency / self.disk_writes * 1000, 2
+                )
+                if self.disk_writes > 0
+                else None,
+                "max_write_latency_ms": round(self.max_write_latency * 1000, 2),
+            }
+
+
+# The store is shared by the whole process.
+document_store = DocumentStore()
+# Make sure that nothing is lost if the process exits before a scheduled write
+atexit.register(document_store.flush)
@@ -0,0 +1,247 @@
+"""fanout.py
+Contains a generic engine for sending something (usually a direct message) to many users at once.
+
+Messages are sent by a fixed number of workers, so that at most a few requests are in flight at the same time.
+nextcord already waits for Discord's per-route rate limit buckets before sending a request, and retries requests
+that are rate limited anyway. If a request is still rate limited after that (HTTP 429), all workers pause for as long as Discord
+asks and then try again. Other server errors are retried with an exponential backoff, while errors that will not go away
+by retrying (such as a user having their DMs closed) fail the recipient directly."""
+import asyncio, logging, math, os, random, time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+from nextcord import Client, HTTPException, Forbidden, NotFound
+
+logger = logging.getLogger(__name__)
+
+# How many messages that can be sent at the same time
+FANOUT_CONCURRENCY = int(os.getenv("SSIS_DISCORD_BOT_FANOUT_CONCURRENCY", 5))
+FANOUT_MAX_ATTEMPTS = 5  # How many times to try sending to a recipient
+FANOUT_BASE_BACKOFF = (
+    1  # The first backoff (in seconds) after a server error, doubled for every attempt
+)
+FANOUT_PROGRESS_INTERVAL = 5  # How often (in seconds) to report progress
+
+
+@dataclass
+class FanOutResult:
+    __slots__ = (
+        "total",
+        "delivered",
+        "failed",
+        "retries",
+        "rate_limited",
+        "started_at",
+        "finished_at",
+        "send_latencies",
+        "delivered_ids",
+        "failures",
+    )
+    total: int  # The number of recipients
+    delivered: int
+    failed: int
+    retries: int  # The number of sends that had to be retried
+    rate_limited: int  # The number of times that Discord rate limited a send
+    started_at: float  # (time.monotonic())
+    finished_at: Optional[float]
+    send_latencies: List[float]  # The time (in seconds) that each successful send took
+    delivered_ids: List[int]  # The recipients that were sent to
+    failures: Dict[int, str]  # Mapping: recipient that could not be sent to --> error
+
+    @property
+    def processed(self) -> int:
+        """The number of recipients that have been handled, successfully or not."""
+        return self.delivered + self.failed
+
+    @property
+    def elapsed(self) -> float:
+        """The number of seconds that the fan-out has been running for."""
+        return (
+            self.finished_at if self.finished_at is not None else time.monotonic()
+        ) - self.started_at
+
+    @property
+    def throughput(self) -> float:
+        """The number of successful sends per second."""
+        return self.delivered / self.elapsed if self.elapsed > 0 else 0.0
+
+    def get_latency_percentile(self, percentile: float) -> Optional[float]:
+        """Gets a percentile of the send latencies (using the nearest-rank method).
+
+        :param percentile: The percentile to get, for example 95.
+
+        :returns: The latency in seconds, or None if nothing has been sent."""
+        if len(self.send_latencies) == 0:
+            return None
+        sorted_latencies = sorted(self.send_latencies)
+        rank = math.ceil(percentile / 100 * len(sorted_latencies))
+        return sorted_latencies[max(rank, 1) - 1]
+
+    def get_summary(self) -> str:
+        """Gets a human-readable summary of the fan-out, for logging."""
+        p95_latency = self.get_latency_percentile(95)
+        return (
+            f"{self.delivered}/{self.total} delivered, {self.failed} failed, {self.retries} retries "
+            f"({self.rate_limited} rate limited) in {round(self.elapsed, 2)} s "
+            f"({round(self.throughput, 2)} sends/s, p95 send latency "
+            f"{round(p95_latency * 1000) if p95_latency is not None else '-'} ms)."
+        )
+
+
+def get_retry_after(exception: HTTPException) -> float:
+    """Gets how long Discord wants us to wait after a rate limited request.
+
+    :param exception: The exception of the rate limited request."""
+    try:
+        return float(exception.response.headers.get("Retry-After", 1))
+    except (AttributeError, TypeError, ValueError):
+        return 1.0
+
+
+async def fan_out(
+    recipient_ids: Iterable[int],
+    send: Callable[[int], Awaitable],
+    on_delivered: Optional[Callable[[int], Awaitable]] = None,
+    on_failed: Optional[Callable[[int, Exception], Awaitable]] = None,
+    on_progress: Optional[Callable[[FanOutResult], Awaitable]] = None,
+    concurrency: int = FANOUT_CONCURRENCY,
+    progress_interval: float = FANOUT_PROGRESS_INTERVAL,
+) -> FanOutResult:
+    """Sends something to many recipients with bounded concurrency.
+
+    :param recipient_ids: The user IDs of the recipients.
+
+    :param send: A coroutine function that is called with a user ID and sends to the user. It should raise an exception if
+    sending failed.
+
+    :param on_delivered: A coroutine function that is called with the user ID of every recipient that was sent to.
+
+    :param on_failed: A coroutine function that is called with the user ID and the exception of every recipient that could
+    not be sent to.
+
+    :param on_progress: A coroutine function that is called with the current result every progress_interval seconds and once
+    when all recipients have been handled.
+
+    :param concurrency: How many sends that can be in flight at the same time.
+
+    :param progress_interval: How often (in seconds) to call on_progress.
+
+    :returns: The result of the fan-out.
+
+    :raises Exception: The first exception raised by on_delivered or on_failed, once all recipients have been handled.
+    """
+    recipient_queue = asyncio.Queue()
+    for recipient_id in recipient_ids:
+        recipient_queue.put_nowait(recipient_id)
+    result = FanOutResult(
+        recipient_queue.qsize(), 0, 0, 0, 0, time.monotonic(), None, [], [], {}
+    )
+    # When a request is rate limited, all workers wait until this time (time.monotonic()) before sending again
+    paused_until = 0.0
+    logger.info(
+        f"Fanning out to {result.total} recipients with {concurrency} workers..."
+    )
+
+    async def send_to_recipient(recipient_id: int):
+        """Sends to a recipient, retrying if needed."""
+        nonlocal paused_until
+        for attempt in range(1, FANOUT_MAX_ATTEMPTS + 1):
+            pause = paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            send_started_at = time.monotonic()
+            try:
+                await send(recipient_id)
+                result.send_latencies.append(time.monotonic() - send_started_at)
+                return
+            except (Forbidden, NotFound):
+                raise  # Retrying will not help
+            except HTTPException as e:
+                if attempt == FANOUT_MAX_ATTEMPTS:
+                    raise
+                if e.status == 429:
+                    retry_after = get_retry_after(e)
+                    logger.warning(
+                        f"Rate limited while fanning out. Pausing for {retry_after} seconds..."
+                    )
+                    result.rate_limited += 1
+                    paused_until = max(paused_until, time.monotonic() + retry_after)
+                elif e.status >= 500:
+                    backoff = FANOUT_BASE_BACKOFF * 2 ** (attempt - 1)
+                    await asyncio.sleep(backoff + random.uniform(0, backoff / 2))
+                else:
+                    raise
+                result.retries += 1
+
+    # Exceptions raised by on_delivered and on_failed. They are raised once all recipients have been handled, so that
+    # a failing callback (for example when recording a recipient to disk fails) does not stop the other workers halfway
+    callback_errors: List[Exception] = []
+
+    async def run_callback(callback: Callable[..., Awaitable], *args):
+        """Calls on_delivered or on_failed, saving any exception for later."""
+        try:
+            await callback(*args)
+        except Exception as e:
+            logger.critical(
+                f"Fan-out callback failed for {args[0]}: {e!r}", exc_info=True
+            )
+            callback_errors.append(e)
+
+    async def worker():
+        """Sends to recipients from the queue until it is empty."""
+        while True:
+            try:
+                recipient_id = recipient_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                await send_to_recipient(recipient_id)
+            except Exception as e:
+                logger.warning(
+                    f"Failed to send to {recipient_id}: {e}. They might have their DMs closed."
+                )
+                result.failed += 1
+                result.failures[recipient_id] = repr(e)
+                if on_failed is not None:
+                    await run_callback(on_failed, recipient_id, e)
+                continue
+            result.delivered += 1
+            result.delivered_ids.append(recipient_id)
+            if on_delivered is not None:
+                await run_callback(on_delivered, recipient_id)
+
+    async def report_progress():
+        """Reports progress periodically until cancelled."""
+        while True:
+            await asyncio.sleep(progress_interval)
+            try:
+                await on_progress(result)
+            except Exception as e:
+                logger.warning(f"Failed to report fan-out progress: {e}", exc_info=True)
+
+    progress_task = (
+        asyncio.create_task(report_progress()) if on_progress is not None else None
+    )
+    try:
+        await asyncio.gather(*[worker() for _ in range(max(concurrency, 1))])
+    finally:
+        if progress_task is not None:
+            progress_task.cancel()
+    result.finished_at = time.monotonic()
+    logger.info(f"Fan-out finished: {result.get_summary()}")
+    if on_progress is not None:
+        await on_progress(result)
+    if len(callback_errors) > 0:
+        raise callback_errors[0]
+    return result
+
+
+async def send_direct_message(bot: Client, user_id: int, **kwargs):
+    """Sends a direct message to a user. Meant to be used as the send function of fan_out().
+
+    :param bot: The bot to send the message with.
+
+    :param user_id: The ID of the user.
+
+    :param kwargs: The content of the message, passed to User.send() (for example embed)."""
+    user = bot.get_user(user_id) or await bot.fetch_user(user_id)
+    await user.send(**kwargs)
@@ -2,11 +2,12 @@
 Provides utilities related to various functions in the bot
 """
 import asyncio
-import json, os, logging, datetime, pytz, nextcord.utils
+import functools, json, os, logging, datetime, pytz, nextcord.utils
 import shutil
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 
 from utils.color_const import ERROR_EMBED_COLOR
+from utils.document_store import document_store, file_io_executor
 from nextcord import Embed, Activity, ActivityType
 
 # Logging
@@ -57,6 +58,15 @@ CACHED_SCHEDULE_DATA_FILEPATH = os.path.join(
 SUBSCRIPTIONS_DATA_FILEPATH = os.path.join(
     FLUID_DATA_DIRECTORY, "subscribed_schedules.json"
 )  # File for storing schedule subscriptions
+SUBSCRIPTIONS_DATABASE_FILEPATH = os.path.join(
+    FLUID_DATA_DIRECTORY, "subscriptions.sqlite3"
+)  # Database for storing subscriptions when the SQLite storage engine is used (see subscription.py)
+ANNOUNCEMENT_JOBS_DATA_FILEPATH = os.path.join(
+    FLUID_DATA_DIRECTORY, "announcement_jobs.json"
+)  # File for storing club announcements that are being sent out (see announcements.py)
+MANAGED_MESSAGES_DATA_FILEPATH = os.path.join(
+    FLUID_DATA_DIRECTORY, "managed_messages.json"
+)  # File for storing content hashes of messages that the bot edits (see managed_messages.py)
 SUBSCRIPTIONS_SCHEMA_FILEPATH = os.path.join(
     FLUID_DATA_DIRECTORY, "available_subscriptions.json"
 )  # File for defining available subscriptions
@@ -78,6 +88,18 @@ SEASONAL_PROFILE_PICTURES_FILEPATH = os.path.join(
 SEASONAL_PROFILE_PICTURES_DIRECTORY = os.path.join(
     STATIC_DATA_DIRECTORY, "seasonal_profile_pictures"
 )
+MENU_HIGHLIGHTS_FILEPATH = os.path.join(
+    STATIC_DATA_DIRECTORY, "menu_highlights.json"
+)  # Texts in menus that should be highlighted (see menu_highlights.py)
+HOLIDAYS_FILEPATH = os.path.join(
+    STATIC_DATA_DIRECTORY, "holidays.json"
+)  # Days when scheduled jobs that skip holidays do not run (see scheduler.py)
+STUB_FIXTURES_DIRECTORY = os.path.join(
+    STATIC_DATA_DIRECTORY, "stub_fixtures"
+)  # Responses that the stub server replays (see stub_server.py)
+# If set, requests to other services (menu, pentryansvar, schedule, Healthchecks) go to a stub server at this URL
+# instead (see stub_server.py), for example http://127.0.0.1:8080
+STUB_SERVER_URL = os.getenv("SSIS_DISCORD_BOT_STUB_SERVER_URL", None)
 LOGGING_DIRECTORY = os.getenv(
     "SSIS_DISCORD_BOT_LOGGING_DIRECTORY",
     os.path.join(BOT_DIRECTORY, FLUID_STORAGE_BASE_PATH, "logging"),
@@ -118,16 +140,86 @@ BOT_GENERAL_STATUSES = [
 ]
 MAIN_SERVER_ID = 746412815048376371  # Server to retrieve members from. The bot is intended to be used on one single server and therefore this is hard coded.
 # JSON-related functions
-def get_json(filepath):
-    """Retrieves JSON from a certain filepath."""
-    with open(filepath, encoding="UTF-8") as json_file:
-        return json.loads(json_file.read())
+def get_json(filepath, copy=True):
+    """Retrieves JSON from a certain filepath. The content is served from memory
+    unless the file has changed since it was last read (see document_store.py).
+
+    :param filepath: The path to the file.
+
+    :param copy: If False, the in-memory document is returned as-is. Only use this for read-only access.
+    """
+    return document_store.get(filepath, copy_document=copy)
 
 
 def write_json(filepath, new_json):
     """Writes JSON to a file at the provided filepath."""
-    with open(filepath, "w", encoding="UTF-8") as json_file:
-        json_file.write(json.dumps(new_json, indent=True))
+    document_store.write(filepath, new_json)
+
+
+# Asynchronous file-related functions.
+# The fluid storage might be a network-mounted volume, so file I/O in coroutines should use these
+# functions which run the I/O in a thread pool instead of blocking the event loop.
+file_locks: Dict[str, asyncio.Lock] = {}  # Mapping: filepath --> lock for the file
+
+
+def get_file_lock(filepath) -> asyncio.Lock:
+    """Gets a lock for a file. Hold the lock while doing a read-modify-write cycle
+    on the file (reading with aget_json and writing with awrite_json) so that
+    concurrent cycles on the same file can not overwrite each other's changes.
+
+    :param filepath: The path to the file."""
+    if filepath not in file_locks:
+        file_locks[filepath] = asyncio.Lock()
+    return file_locks[filepath]
+
+
+async def run_file_io(function, *args, **kwargs):
+    """Runs a blocking function in the file I/O thread pool and returns its result.
+
+    :param function: The function to run. Any extra arguments are passed to it."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        file_io_executor, functools.partial(function, *args, **kwargs)
+    )
+
+
+async def aget_json(filepath, copy=True):
+    """Asynchronous version of get_json.
+
+    :param filepath: The path to the file.
+
+    :param copy: If False, the in-memory document is returned as-is. Only use this for read-only access.
+    """
+    return await run_file_io(get_json, filepath, copy)
+
+
+async def awrite_json(filepath, new_json):
+    """Asynchronous version of write_json. Note that the file is written
+    to disk in the background (see document_store.py).
+
+    :param filepath: The path to the file.
+
+    :param new_json: The JSON to write."""
+    write_json(filepath, new_json)  # Only updates memory, the disk write is scheduled
+
+
+def read_file(filepath, mode="r"):
+    """Reads the content of a file.
+
+    :param filepath: The path to the file.
+
+    :param mode: The mode to open the file in, "r" for text and "rb" for bytes."""
+    with open(filepath, mode, encoding="UTF-8" if "b" not in mode else None) as file:
+        return file.read()
+
+
+async def aread_file(filepath, mode="r"):
+    """Asynchronous version of read_file.
+
+    :param filepath: The path to the file.
+
+    :param mode: The mode to open the file in, "r" for text and "rb" for bytes."""
+    return await run_file_io(read_file, filepath, mode)
 
 
 # Time-related functions
@@ -171,6 +263,60 @@ def generate_error_embed(
     return error_embed
 
 
+# Discord's limits for a single embed (see https://discord.com/developers/docs/resources/channel#embed-object-embed-limits)
+EMBED_MAX_FIELDS = 25
+EMBED_MAX_CHARACTERS = 6000
+EMBED_PAGE_NUMBER_RESERVE = 16  # Characters reserved for the page number that is added to the title of every page
+
+
+def paginate_embed(embed: Embed) -> List[Embed]:
+    """Splits an embed that has too many fields (or is too long) to be sent into multiple embeds (pages).
+    The first page gets the description and the last page gets the footer. If there is more than one page,
+    the page number is added to the title of every page.
+
+    :param embed: The embed to split.
+
+    :returns: A list of embeds that are within Discord's limits. If the embed does not have to be split, only the embed is returned.
+    """
+    if len(embed.fields) <= EMBED_MAX_FIELDS and len(embed) <= EMBED_MAX_CHARACTERS:
+        return [embed]
+    elif len(embed.fields) == 0:  # (only fields can be split into pages)
+        return [embed]
+    # The number of characters that the fields of a page can have
+    page_character_budget = (
+        EMBED_MAX_CHARACTERS
+        - EMBED_PAGE_NUMBER_RESERVE
+        - len(embed.title or "")
+        - len(embed.description or "")
+        - len(embed.footer.text or "")
+    )
+    pages = []
+    page = None
+    page_length = 0
+    for field in embed.fields:
+        field_length = len(field.name) + len(field.value)
+        if (
+            page is None
+            or len(page.fields) >= EMBED_MAX_FIELDS
+            or page_length + field_length > page_character_budget
+        ):
+            page = Embed(
+                title=embed.title,
+                # Only the first page has a description
+                description=embed.description if len(pages) == 0 else Embed.Empty,
+                color=embed.color,
+            )
+            pages.append(page)
+            page_length = 0
+        page_length += field_length
+        page.add_field(name=field.name, value=field.value, inline=field.inline)
+    if embed.footer.text:
+        pages[-1].set_footer(text=embed.footer.text, icon_url=embed.footer.icon_url)
+    for page_number, page in enumerate(pages, start=1):
+        page.title = f"{embed.title or ''} ({page_number}/{len(pages)})".strip()
+    return pages
+
+
 # Other
 async def class_name_to_role(bot, guild, class_name):
     """Tries to parse a class name to a role that maps for the corresponding class.
@@ -278,15 +424,15 @@ def get_active_classes():
     class_number_start = now.year - 3 if now.month < 8 else now.year - 2
     class_number_end = now.year - 1 if now.month < 8 else now.year
     classes = []
-    for class_year in range(class_number_start, class_number_end):
+    for class_year in range(class_number_start, class_number_end + 1):
         for class_letter in ["A", "B", "C", "D"]:
-            classes.append(f"TE{class_year[-2:]}{class_letter}")
+            classes.append(f"TE{str(class_year)[-2:]}{class_letter}")
     return classes
 
 
-def get_roles():
+async def get_roles():
     """Returns the role file which contains static information about various roles on the server."""
-    return get_json(ROLE_DATA_FILEPATH)
+    return await aget_json(ROLE_DATA_FILEPATH, copy=False)
 
 
 async def ensure_admin_permissions(bot, user, guild, interaction_or_ctx=None):
@@ -302,7 +448,7 @@ async def ensure_admin_permissions(bot, user, guild, interaction_or_ctx=None):
     :returns True if the user is an admin, False if the user isn't."""
     logger.debug(f"Checking permissions for user {user.mention}...")
     # Get the roles
-    roles = get_roles()
+    roles = await get_roles()
     admin_role = roles["administrator_role_id"]
     moderator_role = roles["moderator_role_id"]
     # Check if the user is either a moderator or administrator
@@ -342,6 +488,25 @@ def string_to_localized_datetime(input: str):
     )
 
 
+def get_api_url(environment_variable, default_url, stub_server_path):
+    """Gets the URL of another service that the bot uses.
+
+    :param environment_variable: An environment variable that can be set to override the URL.
+
+    :param default_url: The URL of the real service.
+
+    :param stub_server_path: The path of the service on the stub server (see stub_server.py), used if
+    SSIS_DISCORD_BOT_STUB_SERVER_URL is set.
+
+    :returns: The URL set in the environment variable if any, otherwise the URL on the stub server if it is enabled,
+    otherwise the default URL."""
+    if os.getenv(environment_variable, None) is not None:
+        return os.environ[environment_variable]
+    if STUB_SERVER_URL is not None:
+        return STUB_SERVER_URL.rstrip("/") + stub_server_path
+    return default_url
+
+
 # See the documentation under "FLUID STORAGE" above for information about fluid storage.
 # Here, we copy over all files to the fluid storage volume if they do not exist there already.
 if FLUID_STORAGE_ENABLED:
@@ -3,8 +3,10 @@ Contains some helper functions and constants related to the good morning command
 import datetime
 
 from utils.general import (
-    get_json,
-    write_json,
+    aget_json,
+    awrite_json,
+    get_file_lock,
+    read_file,
     GOOD_MORNING_DATA_FILEPATH,
     GOOD_MORNING_GREETINGS_FILEPATH,
     GOOD_MORNING_RESPONSES_FILEPATH,
@@ -18,9 +20,7 @@ logger = logging.getLogger(__name__)
 
 # Constants related to regex for detecting good morning message. TODO: Exclude bad adjectives in a sexier way
 # Bad morning beginnings, such as "next morning", "bad morning", etc.
-BAD_MORNING_BEGINNINGS = (
-    open(BAD_GOOD_MORNING_STARTS, "r", encoding="UTF-8").read().splitlines()
-)
+BAD_MORNING_BEGINNINGS = read_file(BAD_GOOD_MORNING_STARTS).splitlines()
 BAD_MORNING_BEGINNINGS_TEXT = "|".join(BAD_MORNING_BEGINNINGS)
 GOOD_MORNING_REGEX_TEXT = (
     f"^(?!(({BAD_MORNING_BEGINNINGS_TEXT})))(?=.*mo+r+(g*o+n+|n+i*n+g*))"
@@ -28,12 +28,10 @@ GOOD_MORNING_REGEX_TEXT = (
 GOOD_MORNING_REGEX = re.compile(GOOD_MORNING_REGEX_TEXT, flags=re.IGNORECASE)
 logger.info(f"Loaded {len(BAD_MORNING_BEGINNINGS)} bad morning beginnings")
 # Good morning phrases
-GOOD_MORNING_PHRASES = (
-    open(GOOD_MORNING_GREETINGS_FILEPATH, "r", encoding="UTF-8").read().splitlines()
-)  # Encoding is so funny
-GOOD_MORNING_RESPONSES = (
-    open(GOOD_MORNING_RESPONSES_FILEPATH, "r", encoding="UTF-8").read().splitlines()
-)
+GOOD_MORNING_PHRASES = read_file(
+    GOOD_MORNING_GREETINGS_FILEPATH
+).splitlines()  # Encoding is so funny
+GOOD_MORNING_RESPONSES = read_file(GOOD_MORNING_RESPONSES_FILEPATH).splitlines()
 logger.info(
     f"Loaded {len(GOOD_MORNING_PHRASES)} good morning phrases, {len(GOOD_MORNING_PHRASES)} responses"
 )
@@ -95,16 +93,24 @@ for filepath in REQUIRED_FILES:
         )
 
 
-def write_to_good_morning_file(data):
+async def write_to_good_morning_file(data):
     """Writes new JSON content to the good morning file.
+    If you have read the data before changing it, hold the lock from get_good_morning_lock() while doing so.
 
     :param data: The fluid_data to write."""
-    write_json(GOOD_MORNING_DATA_FILEPATH, data)
+    await awrite_json(GOOD_MORNING_DATA_FILEPATH, data)
+
+
+async def get_good_morning_data(copy=True):
+    """Gets good morning fluid_data file content.
+
+    :param copy: If False, the in-memory data is returned. Only use this for read-only access."""
+    return await aget_json(GOOD_MORNING_DATA_FILEPATH, copy=copy)
 
 
-def get_good_morning_data():
-    """Gets good morning fluid_data file content."""
-    return get_json(GOOD_MORNING_DATA_FILEPATH)
+def get_good_morning_lock():
+    """Gets the lock that should be held while doing read-modify-write cycles on the good morning file."""
+    return get_file_lock(GOOD_MORNING_DATA_FILEPATH)
 
 
 def remove_punctuation(input_string):
@@ -122,7 +128,7 @@ def matches_good_morning(content):
     )
 
 
-def check_is_good_morning_message(message: Message, bot_user_id: int):
+async def check_is_good_morning_message(message: Message, bot_user_id: int):
     """Checks if a message is a good morning message (that is relevant to react to) or not.
 
     :param message: The message that has been sent
@@ -132,7 +138,7 @@ def check_is_good_morning_message(message: Message, bot_user_id: int):
     :returns An action what to do with the message: ACTION_SEND_MESSAGE if message should be sent,
     ACTION_REACT if message should be reacted to, and None if there is no reaction"""
     # Check if channel is the same
-    good_morning_data = get_good_morning_data()
+    good_morning_data = await get_good_morning_data(copy=False)
     now = get_now()
     today_date = str(now.date())
     is_morning = 6 <= now.hour <= 11
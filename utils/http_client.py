@@ -0,0 +1,139 @@
+"""http_client.py
+Contains the HTTP client that the bot uses for all requests to other services than Discord,
+such as the menu API, the pentry API, the schedule API and Healthchecks.
+
+All requests share one long-lived aiohttp session. Its connections are kept alive and reused between requests,
+so a request to a host that has recently been requested does not need a new TCP connection and TLS handshake.
+The number of connections (in total and per host) is limited, DNS lookups are cached and every request has a timeout,
+so a slow service can not make a task hang forever.
+
+The client is started and closed together with the bot (see SSISBot in main.py). If it is used before it has been
+started, it starts itself. The latency of requests is recorded per host and shown by the stats command."""
+import aiohttp, asyncio, logging, os, time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, Optional
+from yarl import URL
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of open connections in total and per host
+HTTP_CONNECTION_LIMIT = int(os.getenv("SSIS_DISCORD_BOT_HTTP_CONNECTION_LIMIT", 20))
+HTTP_CONNECTION_LIMIT_PER_HOST = int(
+    os.getenv("SSIS_DISCORD_BOT_HTTP_CONNECTION_LIMIT_PER_HOST", 4)
+)
+# Maximum time (in seconds) that a request, including reading the response, can take
+HTTP_TIMEOUT = float(os.getenv("SSIS_DISCORD_BOT_HTTP_TIMEOUT", 30))
+HTTP_CONNECT_TIMEOUT = 10  # Maximum time (in seconds) to wait for a connection
+DNS_CACHE_TTL = 300  # How long (in seconds) to cache DNS lookups
+USER_AGENT = "Python/SSIS Discord Bot"
+
+
+@dataclass
+class HostStats:
+    __slots__ = ("requests", "failures", "total_latency", "max_latency")
+    requests: int
+    failures: int  # Requests that raised an exception or got a server error (5xx)
+    total_latency: float  # The total time (in seconds) until the response headers were received
+    max_latency: float
+
+
+class HTTPClient:
+    def __init__(self):
+        """Initializes the client. The session is created when the client is started."""
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.host_stats: Dict[str, HostStats] = {}  # Mapping: host --> statistics
+
+    async def start(self):
+        """Creates the shared session if it has not been created yet."""
+        if self.session is not None and not self.session.closed:
+            return
+        logger.info("Starting HTTP client...")
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=HTTP_CONNECTION_LIMIT,
+                limit_per_host=HTTP_CONNECTION_LIMIT_PER_HOST,
+                ttl_dns_cache=DNS_CACHE_TTL,
+            ),
+            timeout=aiohttp.ClientTimeout(
+                total=HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT
+            ),
+            headers={"User-Agent": USER_AGENT},
+        )
+
+    async def close(self):
+        """Closes the shared session and all of its connections."""
+        if self.session is None or self.session.closed:
+            return
+        logger.info("Closing HTTP client...")
+        await self.session.close()
+        self.session = None
+
+    def record_request(self, host: str, latency: float, failed: bool):
+        """Records a finished request in the statistics of its host.
+
+        :param host: The host that was requested.
+
+        :param latency: The time (in seconds) that the request took.
+
+        :param failed: Whether the request failed."""
+        host_stats = self.host_stats.setdefault(host, HostStats(0, 0, 0.0, 0.0))
+        host_stats.requests += 1
+        host_stats.total_latency += latency
+        host_stats.max_latency = max(host_stats.max_latency, latency)
+        if failed:
+            host_stats.failures += 1
+
+    @asynccontextmanager
+    async def request(
+        self, method: str, url: str, **kwargs
+    ) -> AsyncIterator[aiohttp.ClientResponse]:
+        """Sends a request using the shared session. Use it as an async context manager:
+        async with http_client.request("GET", url) as response: ...
+
+        :param method: The HTTP method, for example "GET".
+
+        :param url: The URL to request.
+
+        :param kwargs: Any other arguments to aiohttp.ClientSession.request(), such as params and headers.
+        """
+        await self.start()
+        host = URL(url).host
+        request_started_at = time.monotonic()
+        response_received = False
+        try:
+            async with self.session.request(method, url, **kwargs) as response:
+                response_received = True
+                self.record_request(
+                    host, time.monotonic() - request_started_at, response.status >= 500
+                )
+                yield response
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            # (errors while reading the response have already been recorded as a successful request)
+            if not response_received:
+                self.record_request(host, time.monotonic() - request_started_at, True)
+            raise
+
+    def get(self, url: str, **kwargs):
+        """Shortcut for sending a GET request (see request()).
+
+        :param url: The URL to request."""
+        return self.request("GET", url, **kwargs)
+
+    def get_stats(self) -> Dict[str, Dict[str, object]]:
+        """Returns statistics about the requests to every host."""
+        return {
+            host: {
+                "requests": host_stats.requests,
+                "failures": host_stats.failures,
+                "average_latency_ms": round(
+                    host_stats.total_latency / host_stats.requests * 1000, 2
+                ),
+                "max_latency_ms": round(host_stats.max_latency * 1000, 2),
+            }
+            for host, host_stats in self.host_stats.items()
+        }
+
+
+# The client is shared by the whole bot.
+http_client = HTTPClient()
@@ -0,0 +1,237 @@
+"""journal.py
+Contains an append-only journal for JSON documents that are changed often in small ways,
+such as the clubs file and the subscriptions file.
+
+Without a journal, adding a single subscriber means rewriting the whole file, so the cost of every
+change grows with the number of subscribers. With a journal, a change is instead appended to a JSON-lines file
+next to the document (the snapshot) as one small record and applied to the document in memory (see document_store.py).
+When the journal has grown past a size threshold, it is compacted in the background: the document
+is written to the snapshot file and the journal is emptied.
+
+When the snapshot is loaded from disk (when the bot starts or if the file has been changed by someone else),
+the records in the journal are replayed on top of it. Records must therefore be idempotent: applying a record twice must give
+the same result as applying it once. This way, nothing goes wrong if the bot crashes after writing the snapshot but
+before emptying the journal."""
+import asyncio, functools, json, logging, os, threading
+from typing import Callable, Dict
+from utils.document_store import document_store, file_io_executor, atomic_write_text
+
+logger = logging.getLogger(__name__)
+
+# The size (in bytes) that a journal can grow to before it is compacted
+JOURNAL_COMPACTION_THRESHOLD = int(
+    os.getenv("SSIS_DISCORD_BOT_JOURNAL_COMPACTION_THRESHOLD", 64 * 1024)
+)
+journals: Dict[str, "Journal"] = {}  # Mapping: snapshot filepath --> journal
+
+
+class Journal:
+    def __init__(
+        self,
+        snapshot_filepath: str,
+        operations: Dict[str, Callable],
+        compaction_threshold: int = JOURNAL_COMPACTION_THRESHOLD,
+    ):
+        """Initializes a journal for a document.
+
+        :param snapshot_filepath: The path to the JSON document that the journal belongs to.
+
+        :param operations: Mapping: operation name --> function that applies a record of the operation.
+        The function is called with the document and the record and must change the document in place.
+
+        :param compaction_threshold: The size (in bytes) that the journal can grow to before it is compacted.
+        """
+        self.snapshot_filepath = snapshot_filepath
+        self.journal_filepath = (
+            os.path.splitext(snapshot_filepath)[0] + ".journal.jsonl"
+        )
+        self.operations = operations
+        self.compaction_threshold = compaction_threshold
+        # Makes sure that records are not appended while the journal is being compacted
+        self.lock = threading.Lock()
+        self.compaction_scheduled = False
+        # Whether the end of the journal file has to be checked for a half-written record before appending to it
+        self.check_last_record = True
+        self.appended_records = 0
+        self.replayed_records = 0
+        self.compactions = 0
+        document_store.register_load_hook(snapshot_filepath, self.replay)
+        journals[snapshot_filepath] = self
+
+    def apply(self, document, record: Dict):
+        """Applies a record to a document.
+
+        :param document: The document to change in place.
+
+        :param record: The record to apply."""
+        self.operations[record["operation"]](document, record)
+
+    def replay(self, document):
+        """Applies all records in the journal to a document that has been loaded from the snapshot.
+
+        :param document: The loaded document.
+
+        :returns: The document with all changes in the journal applied."""
+        if not os.path.exists(self.journal_filepath):
+            return document
+        replayed_records = 0
+        with open(self.journal_filepath, encoding="UTF-8") as journal_file:
+            for line in journal_file:
+                if len(line.strip()) == 0:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The bot might have crashed in the middle of writing the last record
+                    logger.warning(
+                        f"Skipping unreadable record in {self.journal_filepath}: {line!r}"
+                    )
+                    continue
+                self.apply(document, record)
+                replayed_records += 1
+        if replayed_records > 0:
+            logger.info(
+                f"Replayed {replayed_records} records from {self.journal_filepath}."
+            )
+        self.replayed_records += replayed_records
+        return document
+
+    def write_record(self, record: Dict) -> bool:
+        """Appends a record to the journal file. The record must already have been applied to the document in memory.
+
+        :param record: The record to write.
+
+        :returns: True if the journal should be compacted, False if not."""
+        with self.lock:
+            record_line = json.dumps(record) + "\n"
+            if self.check_last_record:
+                if not self.ends_with_complete_record():
+                    # The bot crashed in the middle of writing the last record. The record is started on a new line
+                    # so that it is not merged with the half-written one, which replay() skips.
+                    logger.warning(
+                        f"{self.journal_filepath} ends with a half-written record. Starting a new line."
+                    )
+                    record_line = "\n" + record_line
+                self.check_last_record = False
+            try:
+                with open(self.journal_filepath, "a", encoding="UTF-8") as journal_file:
+                    journal_file.write(record_line)
+                    journal_file.flush()
+                    os.fsync(journal_file.fileno())
+                    journal_size = journal_file.tell()
+            except BaseException:
+                # The record might have been partly written
+                self.check_last_record = True
+                raise
+            self.appended_records += 1
+        return journal_size >= self.compaction_threshold
+
+    def ends_with_complete_record(self) -> bool:
+        """Checks if the journal file is empty or ends with a newline, so that a new record can be appended to it."""
+        if not os.path.exists(self.journal_filepath):
+            return True
+        with open(self.journal_filepath, "rb") as journal_file:
+            if journal_file.seek(0, os.SEEK_END) == 0:
+                return True
+            journal_file.seek(-1, os.SEEK_END)
+            return journal_file.read(1) == b"\n"
+
+    def append(self, operation: str, **arguments):
+        """Applies a change to the document and appends it to the journal.
+        This function blocks, so use aappend() from coroutines.
+
+        :param operation: The name of the operation.
+
+        :param arguments: The arguments of the operation, which are stored in the record."""
+        record = {"operation": operation, **arguments}
+        document_store.update(
+            self.snapshot_filepath, lambda document: self.apply(document, record)
+        )
+        if self.write_record(record):
+            self.compact()
+
+    async def aappend(self, operation: str, **arguments):
+        """Asynchronous version of append(). If the journal has grown too big, it is compacted in the background.
+
+        :param operation: The name of the operation.
+
+        :param arguments: The arguments of the operation, which are stored in the record.
+
+        :returns: The version of the document after the change (see DocumentStore.get_version())."""
+        record = {"operation": operation, **arguments}
+        # The document is changed from the event loop so that coroutines reading it can not see it change
+        # while they are using it. Records are idempotent, so it does not matter if a compaction writes this
+        # change to the snapshot before it has been appended to the journal.
+        new_version = document_store.update(
+            self.snapshot_filepath, lambda document: self.apply(document, record)
+        )
+        loop = asyncio.get_running_loop()
+        compaction_needed = await loop.run_in_executor(
+            file_io_executor, functools.partial(self.write_record, record)
+        )
+        if compaction_needed and not self.compaction_scheduled:
+            logger.info(f"Compacting {self.journal_filepath} in the background...")
+            self.compaction_scheduled = True
+            compaction_future = loop.run_in_executor(file_io_executor, self.compact)
+            compaction_future.add_done_callback(self.log_failed_compaction)
+        return new_version
+
+    def log_failed_compaction(self, compaction_future: asyncio.Future):
+        """Logs an exception if a background compaction failed.
+
+        :param compaction_future: The future of the compaction."""
+        self.compaction_scheduled = False
+        if (
+            not compaction_future.cancelled()
+            and compaction_future.exception() is not None
+        ):
+            logger.critical(
+                f"Failed to compact {self.journal_filepath}!",
+                exc_info=compaction_future.exception(),
+            )
+
+    def replace(self, new_document):
+        """Replaces the whole document. The document is written to the snapshot file directly and the journal is emptied.
+        This function blocks, so use areplace() from coroutines.
+
+        :param new_document: The new content of the document."""
+        with self.lock:
+            document_store.write(self.snapshot_filepath, new_document)
+            document_store.flush(self.snapshot_filepath)
+            self.truncate()
+
+    async def areplace(self, new_document):
+        """Asynchronous version of replace().
+
+        :param new_document: The new content of the document."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            file_io_executor, functools.partial(self.replace, new_document)
+        )
+
+    def compact(self):
+        """Folds the journal into the snapshot file by writing the document in memory to it and emptying the journal."""
+        with self.lock:
+            # The document in memory is written as it is when it is serialized (under the lock of the store), instead of
+            # writing back a copy, since update() might change it from the event loop in the meantime. A change that misses
+            # the snapshot is not lost, since its record can only be appended after the journal has been emptied.
+            document_store.mark_dirty(self.snapshot_filepath)
+            document_store.flush(self.snapshot_filepath)
+            self.truncate()
+            self.compactions += 1
+        logger.info(f"Compacted {self.journal_filepath}.")
+
+    def truncate(self):
+        """Empties the journal file. Only call this while holding the lock and after the snapshot has been written."""
+        atomic_write_text(self.journal_filepath, "")
+
+    def get_stats(self) -> Dict[str, object]:
+        """Returns statistics about how the journal has been used."""
+        return {
+            "journal_size": os.path.getsize(self.journal_filepath)
+            if os.path.exists(self.journal_filepath)
+            else 0,
+            "appended_records": self.appended_records,
+            "replayed_records": self.replayed_records,
+            "compactions": self.compactions,
+        }
@@ -0,0 +1,115 @@
+"""managed_messages.py
+Contains functions for messages that the bot sends once and then keeps up to date by editing them,
+such as the menu messages and the pentryansvar message.
+
+Such messages are usually updated by a task loop, and most of the time, nothing has changed since the last update.
+To avoid unnecessary requests to Discord, a hash of the content of every managed message is saved,
+and the message is only edited if the hash has changed. Footers are not included in the hash,
+since they only contain things like when the message was last updated.
+Messages are edited through a partial message, so they do not have to be fetched before being edited."""
+import hashlib, json, logging, os
+from nextcord import Embed, Message, TextChannel
+from utils.general import (
+    aget_json,
+    awrite_json,
+    get_file_lock,
+    write_json,
+    MANAGED_MESSAGES_DATA_FILEPATH,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MANAGED_MESSAGES_JSON = {"messages": {}}
+# The number of messages to remember hashes for. Older messages are forgotten (and edited the next time they are updated).
+MANAGED_MESSAGES_MAX_COUNT = 100
+
+
+def get_embed_content_hash(embed: Embed) -> str:
+    """Calculates a hash of the content of an embed, excluding the footer and timestamp.
+
+    :param embed: The embed to hash."""
+    embed_data = embed.to_dict()
+    embed_data.pop("footer", None)
+    embed_data.pop("timestamp", None)
+    return hashlib.sha256(
+        json.dumps(embed_data, sort_keys=True).encode("UTF-8")
+    ).hexdigest()
+
+
+def get_managed_message_key(channel_id: int, message_id: int) -> str:
+    """Gets the key that the hash of a message is stored under.
+
+    :param channel_id: The ID of the channel that the message is in.
+
+    :param message_id: The ID of the message."""
+    return f"{channel_id}/{message_id}"
+
+
+async def save_content_hash(channel_id: int, message_id: int, content_hash: str):
+    """Saves the hash of the content of a managed message.
+
+    :param channel_id: The ID of the channel that the message is in.
+
+    :param message_id: The ID of the message.
+
+    :param content_hash: The hash of the content of the message."""
+    async with get_file_lock(MANAGED_MESSAGES_DATA_FILEPATH):
+        managed_messages_data = await aget_json(MANAGED_MESSAGES_DATA_FILEPATH)
+        message_hashes = managed_messages_data["messages"]
+        message_key = get_managed_message_key(channel_id, message_id)
+        message_hashes.pop(message_key, None)  # (moves the message to the end)
+        message_hashes[message_key] = content_hash
+        # Forget the messages that were updated the longest time ago
+        for old_message_key in list(message_hashes.keys())[
+            : max(len(message_hashes) - MANAGED_MESSAGES_MAX_COUNT, 0)
+        ]:
+            del message_hashes[old_message_key]
+        await awrite_json(MANAGED_MESSAGES_DATA_FILEPATH, managed_messages_data)
+
+
+async def send_managed_message(channel: TextChannel, embed: Embed) -> Message:
+    """Sends a new message that will be kept up to date with edit_managed_message().
+
+    :param channel: The channel to send the message to.
+
+    :param embed: The content of the message.
+
+    :returns: The sent message."""
+    message = await channel.send(embed=embed)
+    await save_content_hash(channel.id, message.id, get_embed_content_hash(embed))
+    return message
+
+
+async def edit_managed_message(
+    channel: TextChannel, message_id: int, embed: Embed
+) -> bool:
+    """Edits a managed message if its content has changed. Exceptions from Discord (for example if the message
+    has been deleted) are raised to the caller.
+
+    :param channel: The channel that the message is in.
+
+    :param message_id: The ID of the message.
+
+    :param embed: The new content of the message.
+
+    :returns: True if the message was edited, False if its content had not changed."""
+    content_hash = get_embed_content_hash(embed)
+    managed_messages_data = await aget_json(MANAGED_MESSAGES_DATA_FILEPATH, copy=False)
+    if (
+        managed_messages_data["messages"].get(
+            get_managed_message_key(channel.id, message_id), None
+        )
+        == content_hash
+    ):
+        logger.info(f"Content of message {message_id} has not changed. Not editing.")
+        return False
+    logger.info(f"Content of message {message_id} has changed. Editing...")
+    await channel.get_partial_message(message_id).edit(embed=embed)
+    await save_content_hash(channel.id, message_id, content_hash)
+    return True
+
+
+# Create file if doesn't exists
+if not os.path.exists(MANAGED_MESSAGES_DATA_FILEPATH):
+    logger.info("Creating managed messages file...")
+    write_json(MANAGED_MESSAGES_DATA_FILEPATH, DEFAULT_MANAGED_MESSAGES_JSON)
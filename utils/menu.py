@@ -1,63 +1,230 @@
 """menu.py
 Contains various utilities related to grabbing menu fluid_data and stuff.
+
+Menus from the menu API are cached in a file (menu_cache.json), keyed by menu ID and week, so that the menu
+is not downloaded every time that a task needs it and restarting the bot does not empty the cache.
+A cached menu is used for MENU_CACHE_TTL seconds. After that, it is revalidated with a conditional request
+(using the ETag and Last-Modified headers of the response), which the menu API can answer without sending the menu again
+if it has not changed. If the menu API is down, expired menus are used for up to MENU_CACHE_MAX_STALENESS seconds.
 """
-import aiohttp
+import aiohttp, asyncio
 
-from utils.general import FLUID_DATA_DIRECTORY, get_json, write_json
-import os, logging
+from utils.general import (
+    FLUID_DATA_DIRECTORY,
+    aget_json,
+    awrite_json,
+    write_json,
+    get_file_lock,
+    get_api_url,
+)
+from utils.http_client import http_client
+from utils.models import WeekMenu
+from copy import deepcopy
+from typing import Dict, Optional
+import os, logging, time
 
 # Logging
 logger = logging.getLogger(__name__)
 
 MENU_DATA_PATH = os.path.join(FLUID_DATA_DIRECTORY, "menu.json")
+MENU_CACHE_PATH = os.path.join(FLUID_DATA_DIRECTORY, "menu_cache.json")
+DEFAULT_MENU_CACHE_JSON = {"entries": {}}
+# How long (in seconds) a cached menu is used before it is revalidated
+MENU_CACHE_TTL = int(os.getenv("SSIS_DISCORD_BOT_MENU_CACHE_TTL", 60 * 30))
+# How long (in seconds) after it was last downloaded a cached menu can be used if the menu API is down
+MENU_CACHE_MAX_STALENESS = 60 * 60 * 24 * 7
+# Mapping: menu cache key --> download of the menu that is in progress
+menu_downloads_in_progress: Dict[str, asyncio.Future] = {}
+# The base URL of the menu API
+MENU_API_URL = get_api_url(
+    "SSIS_DISCORD_BOT_MENU_API_URL",
+    "https://lunchmeny.albins.website/api/",
+    "/menu/api/",
+)
 DEFAULT_EATERY_MENU_ID = "kista-nod"  # The default menu ID that Eatery Kista Nod uses for their menues (will be dynamically updated though). You can change the used ID in the code by changing this.
 
 
-def get_menu_data():
+async def get_menu_data():
     """Function to get menu fluid_data.
 
     :returns: Menu fluid_data as a dictionary."""
-    return get_json(MENU_DATA_PATH)
+    return await aget_json(MENU_DATA_PATH)
 
 
-def write_menu_data(new_menu_data):
+async def write_menu_data(new_menu_data):
     """Function for writing menu fluid_data to a file.
 
     :param new_menu_data: The menu fluid_data to write as a dictionary."""
     logger.info("Updating menu fluid_data...")
-    write_json(MENU_DATA_PATH, new_menu_data)
+    await awrite_json(MENU_DATA_PATH, new_menu_data)
 
 
-async def get_eatery_menu(menu_id=None, week=None):
-    """Asynchronous function to get Eatery menu fluid_data. Returns the menu fluid_data as a dictionary.
+def get_menu_url(menu_id=None, week=None) -> str:
+    """Gets the URL of a menu in the menu API.
 
-    :param menu_id: The menu ID to get. Hint: Eatery Kista Nod is 521.
+    :param menu_id: The menu ID to get.
+
+    :param week: The week number to get the menu from. If this or the menu ID is None, the URL of the latest menu is returned.
+    """
+    if menu_id != None and week != None:
+        logger.info(
+            f"Week and menu ID specified for menu request. Requesting menu {menu_id} for week {week}"
+        )
+        return (
+            f"{MENU_API_URL}{menu_id}/{week}"  # Get menu fluid_data for a custom week.
+        )
+    else:
+        logger.info(
+            "Week and menu ID not specified for menu. Requesting latest available menu..."
+        )
+        return MENU_API_URL  # Get menu fluid_data for this week
+
+
+def get_menu_cache_key(menu_id=None, week=None) -> str:
+    """Gets the key that a menu is stored under in the menu cache.
+
+    :param menu_id: The menu ID.
+
+    :param week: The week number of the menu."""
+    if menu_id != None and week != None:
+        return f"{menu_id}/{week}"
+    return "latest"
+
+
+def is_menu_cache_entry_usable(cache_entry: Optional[Dict], max_age: float) -> bool:
+    """Checks if a cached menu was downloaded (or revalidated) recently enough to be used.
+
+    :param cache_entry: The entry in the menu cache, or None if the menu is not cached.
+
+    :param max_age: The maximum age (in seconds) of the entry."""
+    return (
+        cache_entry is not None and time.time() - cache_entry["fetched_at"] <= max_age
+    )
+
+
+async def save_menu_cache_entry(cache_key: str, cache_entry: Dict):
+    """Saves a menu to the menu cache. Menus that are too old to ever be used again are removed.
+
+    :param cache_key: The key of the menu (see get_menu_cache_key()).
+
+    :param cache_entry: The entry to save."""
+    async with get_file_lock(MENU_CACHE_PATH):
+        menu_cache = await aget_json(MENU_CACHE_PATH)
+        menu_cache["entries"] = {
+            other_cache_key: other_cache_entry
+            for other_cache_key, other_cache_entry in menu_cache["entries"].items()
+            if is_menu_cache_entry_usable(other_cache_entry, MENU_CACHE_MAX_STALENESS)
+        }
+        menu_cache["entries"][cache_key] = cache_entry
+        await awrite_json(MENU_CACHE_PATH, menu_cache)
+
+
+async def download_eatery_menu(
+    menu_id, week, cache_key: str, cache_entry: Optional[Dict]
+):
+    """Downloads a menu from the menu API and saves it to the menu cache.
+    If the menu is cached, the request is conditional, so the menu is only downloaded again if it has changed.
+
+    :param menu_id: The menu ID to get.
 
     :param week: The week number to get the menu from.
 
-    :returns: Menu fluid_data as a dictionary if found, None ifthe request failed."""
-    logger.info("Getting Eatery menu...")
-    async with aiohttp.ClientSession() as session:
-        if menu_id != None and week != None:
-            logger.info(
-                f"Week and menu ID specified for menu request. Requesting menu {menu_id} for week {week}"
-            )
-            url = f"https://lunchmeny.albins.website/api/{menu_id}/{week}"  # Get menu fluid_data for a custom week.
-        else:
-            logger.info(
-                "Week and menu ID not specified for menu. Requesting latest available menu..."
-            )
-            url = "https://lunchmeny.albins.website/api/"  # Get menu fluid_data for this week
-        async with session.get(url) as request:
+    :param cache_key: The key of the menu in the cache (see get_menu_cache_key()).
+
+    :param cache_entry: The current entry in the menu cache, or None if the menu is not cached.
+
+    :returns: The menu fluid_data if it could be retrieved, None if it could not."""
+    request_headers = {}
+    if cache_entry is not None:
+        if cache_entry["etag"] is not None:
+            request_headers["If-None-Match"] = cache_entry["etag"]
+        if cache_entry["last_modified"] is not None:
+            request_headers["If-Modified-Since"] = cache_entry["last_modified"]
+    new_cache_entry = None
+    try:
+        async with http_client.get(
+            get_menu_url(menu_id, week), headers=request_headers
+        ) as request:
             logger.info("Retrieval request finished,")
-            if request.status == 200:
+            if request.status == 304 and cache_entry is not None:
+                logger.info("The menu has not changed since it was cached.")
+                new_cache_entry = {**cache_entry, "fetched_at": time.time()}
+            elif request.status == 200:
                 logger.debug(
                     "Request finished with status code 200. Getting menu fluid_data..."
                 )
-                menu_data = await request.json()
-                logger.info("Menu fluid_data retrieved. Returning...")
-                return menu_data  # Return the menu fluid_data
+                new_cache_entry = {
+                    "fetched_at": time.time(),
+                    "etag": request.headers.get("ETag", None),
+                    "last_modified": request.headers.get("Last-Modified", None),
+                    "menu_data": await request.json(),
+                }
+                logger.info("Menu fluid_data retrieved.")
             else:
                 logger.warning(
                     f"The menu retrieval request failed with status code {request.status}!"
                 )
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning(f"The menu retrieval request failed: {e!r}")
+    if new_cache_entry is None:
+        # If the menu API is down, a menu that has expired is better than no menu at all
+        if is_menu_cache_entry_usable(cache_entry, MENU_CACHE_MAX_STALENESS):
+            logger.warning("Using an expired cached menu since the request failed.")
+            return cache_entry["menu_data"]
+        return None
+    await save_menu_cache_entry(cache_key, new_cache_entry)
+    return new_cache_entry["menu_data"]
+
+
+async def get_eatery_menu(menu_id=None, week=None):
+    """Asynchronous function to get Eatery menu fluid_data. Returns the menu fluid_data as a dictionary.
+    Menus are cached (see the top of this file), so the menu API is only requested if the cached menu has expired.
+
+    :param menu_id: The menu ID to get. Hint: Eatery Kista Nod is 521.
+
+    :param week: The week number to get the menu from.
+
+    :returns: Menu fluid_data as a dictionary if found, None ifthe request failed."""
+    logger.info("Getting Eatery menu...")
+    cache_key = get_menu_cache_key(menu_id, week)
+    menu_cache = await aget_json(MENU_CACHE_PATH, copy=False)
+    cache_entry = menu_cache["entries"].get(cache_key, None)
+    if is_menu_cache_entry_usable(cache_entry, MENU_CACHE_TTL):
+        logger.info("Returning cached menu...")
+        return deepcopy(cache_entry["menu_data"])
+    # Everyone that wants the same menu while it is being downloaded waits for the same download
+    if cache_key not in menu_downloads_in_progress:
+        menu_download = asyncio.ensure_future(
+            download_eatery_menu(menu_id, week, cache_key, cache_entry)
+        )
+        menu_downloads_in_progress[cache_key] = menu_download
+        menu_download.add_done_callback(
+            lambda _: menu_downloads_in_progress.pop(cache_key, None)
+        )
+    # (shielded so that one waiting coroutine being cancelled does not cancel the download for everyone else)
+    menu_data = await asyncio.shield(menu_downloads_in_progress[cache_key])
+    return deepcopy(menu_data)
+
+
+async def get_week_menu(menu_id=None, week=None) -> Optional[WeekMenu]:
+    """Gets Eatery menu fluid_data and validates it.
+
+    :param menu_id: The menu ID to get.
+
+    :param week: The week number to get the menu from.
+
+    :returns: The menu if found and valid, None if the request failed or the menu is invalid."""
+    menu_data = await get_eatery_menu(menu_id=menu_id, week=week)
+    if menu_data is None:
+        return None
+    try:
+        return WeekMenu.from_json(menu_data["menu"])
+    except (KeyError, ValueError) as e:
+        logger.warning(f"Received invalid menu fluid_data: {e}", exc_info=True)
+        return None
+
+
+# Create file if doesn't exists
+if not os.path.exists(MENU_CACHE_PATH):
+    logger.info("Creating menu cache file...")
+    write_json(MENU_CACHE_PATH, DEFAULT_MENU_CACHE_JSON)
@@ -0,0 +1,254 @@
+"""menu_archive.py
+Contains an archive of all menus that the bot has retrieved, which can be searched for dishes.
+
+Every week menu is appended as one line to a JSON-lines file (menu_archive.jsonl). If the menu for a week changes,
+a new line is appended and the latest line for the week is used. When the archive is loaded, an inverted index is built:
+it maps every word in a dish (normalized, see autocomplete.py) to the dishes that contain it.
+Searching for "pannkaka" therefore only looks at the dishes containing a word starting with "pannkaka"
+instead of going through every menu in the archive. The index is updated as new weeks are added."""
+import datetime, hashlib, json, logging, os, re
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+from utils.autocomplete import normalize_search_text
+from utils.general import FLUID_DATA_DIRECTORY, get_file_lock, run_file_io
+from utils.models import WeekMenu
+
+logger = logging.getLogger(__name__)
+
+MENU_ARCHIVE_PATH = os.path.join(FLUID_DATA_DIRECTORY, "menu_archive.jsonl")
+WORD_REGEX = re.compile(r"\w+")
+WEEKDAYS = [
+    "monday",
+    "tuesday",
+    "wednesday",
+    "thursday",
+    "friday",
+    "saturday",
+    "sunday",
+]  # Day IDs of the menu API, in order
+
+# (year, week number)
+ArchivedWeek = Tuple[int, int]
+# (year, week number, day ID, index of the dish in the day)
+DishLocation = Tuple[int, int, str, int]
+
+
+@dataclass
+class ArchivedDish:
+    __slots__ = ("year", "week_number", "day_id", "day_name", "dish")
+    year: int
+    week_number: int
+    day_id: str  # For example "monday"
+    day_name: str  # The Swedish name of the day
+    dish: str
+
+    @property
+    def date(self) -> Optional[datetime.date]:
+        """The date that the dish was served, or None if it can not be determined."""
+        try:
+            return datetime.date.fromisocalendar(
+                self.year, self.week_number, WEEKDAYS.index(self.day_id) + 1
+            )
+        except ValueError:
+            return None
+
+
+def tokenize(text: str) -> List[str]:
+    """Splits text into normalized words for the index.
+
+    :param text: The text to split."""
+    return WORD_REGEX.findall(normalize_search_text(text))
+
+
+def get_menu_hash(week_menu: WeekMenu) -> str:
+    """Calculates a hash of a week menu, used for checking if an archived menu has changed.
+
+    :param week_menu: The menu."""
+    return hashlib.sha256(
+        json.dumps(week_menu.to_json(), sort_keys=True).encode("UTF-8")
+    ).hexdigest()
+
+
+class MenuArchive:
+    def __init__(self, filepath: str = MENU_ARCHIVE_PATH):
+        """Initializes the archive. It is loaded from disk the first time it is used.
+
+        :param filepath: The path to the archive file."""
+        self.filepath = filepath
+        self.loaded = False
+        self.weeks: Dict[ArchivedWeek, WeekMenu] = {}
+        self.week_hashes: Dict[ArchivedWeek, str] = {}
+        # Mapping: normalized word --> locations of the dishes that contain it
+        self.index: Dict[str, Set[DishLocation]] = {}
+        # All words in the index, sorted, so that words starting with a prefix can be found with a binary search
+        self.sorted_words: List[str] = []
+
+    def read_records(self) -> List[Dict]:
+        """Reads all records in the archive file. This function blocks."""
+        if not os.path.exists(self.filepath):
+            return []
+        records = []
+        with open(self.filepath, encoding="UTF-8") as archive_file:
+            for line in archive_file:
+                if len(line.strip()) == 0:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    logger.warning(
+                        f"Skipping unreadable line in menu archive: {line!r}"
+                    )
+        return records
+
+    def write_record(self, record: Dict):
+        """Appends a record to the archive file. This function blocks.
+
+        :param record: The record to append."""
+        with open(self.filepath, "a", encoding="UTF-8") as archive_file:
+            archive_file.write(json.dumps(record) + "\n")
+            archive_file.flush()
+            os.fsync(archive_file.fileno())
+
+    async def ensure_loaded(self):
+        """Loads the archive from disk and builds the index if that has not been done yet.
+        Only call this while holding the lock of the archive file (see get_file_lock())."""
+        if self.loaded:
+            return
+        records = await run_file_io(self.read_records)
+        for record in records:
+            try:
+                week_menu = WeekMenu.from_json(record["menu"])
+                self.index_week((record["year"], record["week_number"]), week_menu)
+            except (KeyError, ValueError) as e:
+                logger.warning(f"Skipping invalid record in menu archive: {e}")
+        self.loaded = True
+        logger.info(
+            f"Menu archive loaded with {len(self.weeks)} weeks and {len(self.index)} words."
+        )
+
+    def index_week(self, archived_week: ArchivedWeek, week_menu: WeekMenu):
+        """Adds a week to the archive in memory, replacing any previous menu for the week.
+
+        :param archived_week: The year and week number of the menu.
+
+        :param week_menu: The menu."""
+        year, week_number = archived_week
+        previous_week_menu = self.weeks.get(archived_week, None)
+        if previous_week_menu is not None:  # Remove the previous menu from the index
+            for day_id, dish_index, dish in self.iterate_dishes(previous_week_menu):
+                for word in set(tokenize(dish)):
+                    dish_locations = self.index[word]
+                    dish_locations.discard((year, week_number, day_id, dish_index))
+                    if len(dish_locations) == 0:
+                        del self.index[word]
+                        del self.sorted_words[bisect_left(self.sorted_words, word)]
+        self.weeks[archived_week] = week_menu
+        self.week_hashes[archived_week] = get_menu_hash(week_menu)
+        for day_id, dish_index, dish in self.iterate_dishes(week_menu):
+            for word in set(tokenize(dish)):
+                if word not in self.index:
+                    self.index[word] = set()
+                    insort(self.sorted_words, word)
+                self.index[word].add((year, week_number, day_id, dish_index))
+
+    @staticmethod
+    def iterate_dishes(week_menu: WeekMenu):
+        """Iterates over all dishes in a week menu.
+
+        :param week_menu: The menu.
+
+        :returns: A generator of (day ID, index of the dish in the day, dish)."""
+        for day_id, day_menu in week_menu.days.items():
+            for dish_index, dish in enumerate(day_menu.dishes):
+                yield day_id, dish_index, dish
+
+    async def add_week(self, year: int, week_menu: WeekMenu) -> bool:
+        """Adds a week menu to the archive if it is not already archived with the same content.
+
+        :param year: The (ISO) year of the menu.
+
+        :param week_menu: The menu.
+
+        :returns: True if the menu was added, False if it was already archived."""
+        archived_week = (year, week_menu.week_number)
+        async with get_file_lock(self.filepath):
+            await self.ensure_loaded()
+            if self.week_hashes.get(archived_week, None) == get_menu_hash(week_menu):
+                return False
+            logger.info(f"Archiving menu for week {week_menu.week_number} {year}...")
+            await run_file_io(
+                self.write_record,
+                {
+                    "year": year,
+                    "week_number": week_menu.week_number,
+                    "menu": week_menu.to_json(),
+                },
+            )
+            self.index_week(archived_week, week_menu)
+            return True
+
+    def find_dish_locations(self, word: str) -> Set[DishLocation]:
+        """Finds all dishes that contain a word starting with a prefix.
+
+        :param word: The normalized prefix."""
+        dish_locations = set()
+        word_index = bisect_left(self.sorted_words, word)
+        while word_index < len(self.sorted_words) and self.sorted_words[
+            word_index
+        ].startswith(word):
+            dish_locations |= self.index[self.sorted_words[word_index]]
+            word_index += 1
+        return dish_locations
+
+    async def search(self, query: str) -> List[ArchivedDish]:
+        """Searches the archive for dishes. A dish matches if every word in the query is the start of a word in the dish,
+        so "veg lasagn" finds "Vegetarisk lasagne".
+
+        :param query: What to search for.
+
+        :returns: The matching dishes, the most recently served first."""
+        query_words = tokenize(query)
+        if len(query_words) == 0:
+            return []
+        async with get_file_lock(self.filepath):
+            await self.ensure_loaded()
+            # Start with the rarest word so that the intersection stays small
+            matching_locations = None
+            for dish_locations in sorted(
+                [self.find_dish_locations(word) for word in query_words], key=len
+            ):
+                matching_locations = (
+                    dish_locations
+                    if matching_locations is None
+                    else matching_locations & dish_locations
+                )
+                if len(matching_locations) == 0:
+                    return []
+            archived_dishes = []
+            for year, week_number, day_id, dish_index in matching_locations:
+                day_menu = self.weeks[(year, week_number)].days[day_id]
+                archived_dishes.append(
+                    ArchivedDish(
+                        year,
+                        week_number,
+                        day_id,
+                        day_menu.swedish_name,
+                        day_menu.dishes[dish_index],
+                    )
+                )
+        archived_dishes.sort(
+            key=lambda archived_dish: (
+                archived_dish.year,
+                archived_dish.week_number,
+                WEEKDAYS.index(archived_dish.day_id)
+                if archived_dish.day_id in WEEKDAYS
+                else 0,
+            ),
+            reverse=True,
+        )
+        return archived_dishes
+
+
+# The archive is shared by the whole bot.
+menu_archive = MenuArchive()
@@ -0,0 +1,102 @@
+"""menu_highlights.py
+Contains functions for rendering the dishes of a day as text, with special features such as "Pancake Thursday" highlighted.
+
+The texts to highlight are listed in menu_highlights.json in the static data directory. Every entry has the text to
+highlight, an emoji to put in front of it and optionally the special feature of the menu API (see DayMenu) that must be
+active for the day for the text to be highlighted. All texts are compiled into one regular expression, so every dish is
+only scanned once no matter how many highlights there are, and any number of them can be highlighted on the same day.
+
+The menu of a day is rendered for every menu message and every subscriber message, but rarely changes, so rendered days
+are memoized by their content. The memo is emptied when the highlights file changes."""
+import logging, re
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+from utils.general import MENU_HIGHLIGHTS_FILEPATH
+from utils.models import DayMenu, ModelCache
+
+logger = logging.getLogger(__name__)
+
+MENU_RENDER_MEMO_SIZE = 64  # How many rendered days to remember
+
+
+@dataclass
+class MenuHighlight:
+    __slots__ = ("text", "emoji", "feature")
+    text: str  # The text to highlight, for example "Pancake Thursday"
+    emoji: str
+    # The special feature that must be active for the text to be highlighted, or None to always highlight it
+    feature: Optional[str]
+
+
+class DishHighlighter:
+    def __init__(self, highlights_data: Dict):
+        """Compiles the highlights in the highlights file.
+
+        :param highlights_data: The content of the highlights file."""
+        # Mapping: text to highlight --> highlight
+        self.highlights: Dict[str, MenuHighlight] = {
+            highlight["text"]: MenuHighlight(
+                highlight["text"], highlight["emoji"], highlight.get("feature", None)
+            )
+            for highlight in highlights_data["highlights"]
+        }
+        # Longer texts first, so that a text that contains another text wins
+        self.regex = (
+            re.compile(
+                "|".join(
+                    re.escape(text)
+                    for text in sorted(self.highlights.keys(), key=len, reverse=True)
+                )
+            )
+            if len(self.highlights) > 0
+            else None
+        )
+        # Mapping: (dishes, active special features) --> rendered text, the most recently used last
+        self.memo: "OrderedDict[Tuple, str]" = OrderedDict()
+
+    def render(self, day: DayMenu) -> str:
+        """Converts the dishes of a day into a human-readable format.
+
+        :param day: The menu for the day."""
+        active_features = frozenset(
+            feature for feature, active in day.special_features.items() if active
+        )
+        memo_key = (tuple(day.dishes), active_features)
+        if memo_key in self.memo:
+            self.memo.move_to_end(memo_key)
+            return self.memo[memo_key]
+
+        def highlight_match(match: re.Match) -> str:
+            highlight = self.highlights[match.group(0)]
+            if (
+                highlight.feature is not None
+                and highlight.feature not in active_features
+            ):
+                return match.group(0)
+            return f"*{highlight.emoji} {match.group(0)}*"
+
+        rendered_text = "".join(
+            "● "
+            + (
+                self.regex.sub(highlight_match, dish)
+                if self.regex is not None
+                else dish
+            )
+            + "\n"
+            for dish in day.dishes
+        )
+        self.memo[memo_key] = rendered_text
+        if len(self.memo) > MENU_RENDER_MEMO_SIZE:
+            self.memo.popitem(last=False)
+        return rendered_text
+
+
+dish_highlighter_cache = ModelCache(MENU_HIGHLIGHTS_FILEPATH, DishHighlighter)
+
+
+async def render_day_menu(day: DayMenu) -> str:
+    """Converts the dishes of a day into a human-readable format, with special features highlighted.
+
+    :param day: The menu for the day."""
+    return (await dish_highlighter_cache.get()).render(day)
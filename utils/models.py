@@ -0,0 +1,414 @@
+"""models.py
+Contains typed models for data that the bot passes around: clubs, subscriptions, menus and announcements.
+Data is validated once when it is loaded and converted to these models, so that the rest of the code does not have to
+look up keys in nested dictionaries or convert user IDs between strings and integers (user IDs are always integers here).
+Every model can be converted back to the JSON layout used in the data files and APIs with to_json().
+
+The models are dataclasses with __slots__, which makes every instance smaller than a dictionary with the same content.
+(__slots__ is set manually since dataclass(slots=True) requires Python 3.10, and fields can therefore not have defaults)
+"""
+import datetime, logging, pytz
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from utils.general import BASE_TIMEZONE, run_file_io
+from utils.document_store import document_store
+
+logger = logging.getLogger(__name__)
+
+
+def get_validated(data: Dict, key: str, expected_type, nullable: bool = False):
+    """Gets a value from JSON data and validates its type.
+
+    :param data: The JSON data to get the value from.
+
+    :param key: The key of the value.
+
+    :param expected_type: The type (or tuple of types) that the value should have.
+
+    :param nullable: Whether the value is allowed to be None.
+
+    :raises ValueError: If the key is missing or the value has the wrong type."""
+    if not isinstance(data, dict):
+        raise ValueError(f"Expected an object with the key {key!r}, got {data!r}.")
+    if key not in data:
+        raise ValueError(f"Missing key {key!r} in {data!r}.")
+    value = data[key]
+    if value is None and nullable:
+        return None
+    # (bool is a subclass of int, but a boolean is never a valid ID)
+    if not isinstance(value, expected_type) or (
+        isinstance(value, bool) and expected_type is int
+    ):
+        raise ValueError(
+            f"Expected {key!r} to be of type {expected_type}, got {value!r}."
+        )
+    return value
+
+
+def parse_timestamp(timestamp: Optional[str]) -> Optional[datetime.datetime]:
+    """Parses a timestamp stored in a data file.
+
+    :param timestamp: The timestamp as an ISO-formatted string, or None."""
+    if timestamp is None:
+        return None
+    return datetime.datetime.fromisoformat(timestamp).astimezone(
+        tz=pytz.timezone(BASE_TIMEZONE)
+    )
+
+
+@dataclass
+class Subscriber:
+    __slots__ = ("user_id", "added_at", "last_notified_at", "last_notified_period")
+    user_id: int
+    added_at: Optional[str]  # When the user subscribed (only stored for clubs)
+    last_notified_at: Optional[datetime.datetime]  # (only stored for subscriptions)
+    # The period that the user was last notified for, for example "2023-03-13" (only stored for subscriptions)
+    last_notified_period: Optional[str]
+
+    @classmethod
+    def from_club_json(cls, data: Dict) -> "Subscriber":
+        """Creates a subscriber from an entry in the "subscribers" list of a club.
+
+        :param data: The JSON data for the subscriber."""
+        return cls(
+            get_validated(data, "user_id", int),
+            data.get("added_at", None),
+            None,
+            None,
+        )
+
+    def to_club_json(self) -> Dict:
+        """Converts the subscriber to an entry in the "subscribers" list of a club."""
+        return {"user_id": self.user_id, "added_at": self.added_at}
+
+
+@dataclass
+class Club:
+    __slots__ = (
+        "id",
+        "title",
+        "description",
+        "emoji",
+        "role_id",
+        "owners_role_id",
+        "owners",
+        "subscribers",
+        "links",
+        "created_at",
+    )
+    id: str
+    title: str
+    description: Optional[str]
+    emoji: Optional[str]
+    role_id: int
+    owners_role_id: int
+    owners: List[int]
+    subscribers: Dict[int, Subscriber]  # Mapping: user ID --> subscriber
+    links: List  # Links can be strings or dictionaries with a name and URL
+    created_at: Optional[str]
+
+    @classmethod
+    def from_json(cls, data: Dict) -> "Club":
+        """Creates a club from its entry in the clubs file.
+
+        :param data: The JSON data for the club.
+
+        :raises ValueError: If the data is invalid."""
+        owners = get_validated(data, "owners", list)
+        if not all(isinstance(owner, int) for owner in owners):
+            raise ValueError(f"Expected all owners to be user IDs, got {owners!r}.")
+        subscribers = [
+            Subscriber.from_club_json(subscriber_data)
+            for subscriber_data in get_validated(data, "subscribers", list)
+        ]
+        return cls(
+            get_validated(data, "id", str),
+            get_validated(data, "title", str),
+            get_validated(data, "description", str, nullable=True),
+            get_validated(data, "emoji", str, nullable=True),
+            get_validated(data, "role_id", int),
+            get_validated(data, "owners_role_id", int),
+            owners,
+            {subscriber.user_id: subscriber for subscriber in subscribers},
+            get_validated(data, "links", list) if "links" in data else [],
+            data.get("created_at", None),
+        )
+
+    def to_json(self) -> Dict:
+        """Converts the club to its entry in the clubs file."""
+        return {
+            "title": self.title,
+            "description": self.description,
+            "id": self.id,
+            "emoji": self.emoji,
+            "role_id": self.role_id,
+            "owners_role_id": self.owners_role_id,
+            "owners": list(self.owners),
+            "subscribers": [
+                subscriber.to_club_json() for subscriber in self.subscribers.values()
+            ],
+            "links": list(self.links),
+            "created_at": self.created_at,
+        }
+
+
+@dataclass
+class SubscriptionBucket:
+    __slots__ = ("category", "subcategory", "subscribers")
+    category: str
+    subcategory: str
+    subscribers: Dict[int, Subscriber]  # Mapping: user ID --> subscriber
+
+    @classmethod
+    def from_json(
+        cls, category: str, subcategory: str, data: Dict
+    ) -> "SubscriptionBucket":
+        """Creates a bucket from a subcategory in the subscriptions file.
+
+        :param category: The name of the category, for example "food".
+
+        :param subcategory: The name of the subcategory, for example "daily".
+
+        :param data: The JSON data for the subcategory.
+
+        :raises ValueError: If the data is invalid."""
+        subscribers = {}
+        for user_id, subscription_data in get_validated(
+            data, "subscriptions", dict
+        ).items():
+            if not user_id.isdigit():
+                raise ValueError(f"Invalid user ID {user_id!r} in subscriptions.")
+            subscribers[int(user_id)] = Subscriber(
+                int(user_id),
+                None,
+                parse_timestamp(
+                    get_validated(
+                        subscription_data, "last_notified_at", str, nullable=True
+                    )
+                ),
+                # (files written before notification periods were introduced do not have them)
+                get_validated(subscription_data, "last_notified_period", str, True)
+                if "last_notified_period" in subscription_data
+                else None,
+            )
+        return cls(category, subcategory, subscribers)
+
+    def to_json(self) -> Dict:
+        """Converts the bucket to a subcategory in the subscriptions file."""
+        return {
+            "subscriptions": {
+                str(user_id): {
+                    "last_notified_at": str(subscriber.last_notified_at)
+                    if subscriber.last_notified_at is not None
+                    else None,
+                    "last_notified_period": subscriber.last_notified_period,
+                }
+                for user_id, subscriber in self.subscribers.items()
+            }
+        }
+
+    def get_users_not_notified_after(
+        self, timestamp: datetime.datetime, period: Optional[str] = None
+    ) -> List[int]:
+        """Gets the users in the bucket that have not been notified after a certain time.
+
+        :param timestamp: Any users not notified after or at this will be returned.
+
+        :param period: If set, users that have already been notified for this period are not returned."""
+        return [
+            user_id
+            for user_id, subscriber in self.subscribers.items()
+            if (
+                subscriber.last_notified_at is None
+                or subscriber.last_notified_at < timestamp
+            )
+            and (period is None or subscriber.last_notified_period != period)
+        ]
+
+
+@dataclass
+class DayMenu:
+    __slots__ = ("day_id", "swedish_name", "english_name", "dishes", "special_features")
+    day_id: str  # For example "monday"
+    swedish_name: str
+    english_name: str
+    dishes: List[str]
+    special_features: Dict[
+        str, bool
+    ]  # Mapping: feature, e.g. "sweet_tuesday" --> active
+
+    @classmethod
+    def from_json(cls, day_id: str, data: Dict) -> "DayMenu":
+        """Creates a day menu from the menu API format.
+
+        :param day_id: The ID of the day, for example "monday".
+
+        :param data: The JSON data for the day.
+
+        :raises ValueError: If the data is invalid."""
+        day_name = get_validated(data, "day_name", dict)
+        dishes = get_validated(data, "dishes", list)
+        if not all(isinstance(dish, str) for dish in dishes):
+            raise ValueError(f"Expected all dishes to be strings, got {dishes!r}.")
+        return cls(
+            day_id,
+            get_validated(day_name, "swedish", str),
+            get_validated(day_name, "english", str),
+            dishes,
+            {
+                feature: bool(active)
+                for feature, active in get_validated(
+                    data, "special_features", dict
+                ).items()
+            },
+        )
+
+    def to_json(self) -> Dict:
+        """Converts the day menu to the menu API format."""
+        return {
+            "day_name": {"swedish": self.swedish_name, "english": self.english_name},
+            "dishes": list(self.dishes),
+            "special_features": dict(self.special_features),
+        }
+
+
+@dataclass
+class WeekMenu:
+    __slots__ = ("title", "week_number", "url", "days", "footer")
+    title: str
+    week_number: int
+    url: Optional[str]
+    days: Dict[str, DayMenu]  # Mapping: day ID, e.g. "monday" --> menu for the day
+    footer: Optional[
+        str
+    ]  # Extra information from the restaurant, such as allergy notes
+
+    @classmethod
+    def from_json(cls, data: Dict) -> "WeekMenu":
+        """Creates a week menu from the menu API format (the "menu" key of the API response).
+
+        :param data: The JSON data for the menu.
+
+        :raises ValueError: If the data is invalid."""
+        return cls(
+            get_validated(data, "title", str),
+            get_validated(data, "week_number", int),
+            data.get("url", None),
+            {
+                day_id: DayMenu.from_json(day_id, day_data)
+                for day_id, day_data in get_validated(data, "days", dict).items()
+            },
+            data.get("footer", None),
+        )
+
+    def to_json(self) -> Dict:
+        """Converts the week menu to the menu API format."""
+        return {
+            "title": self.title,
+            "week_number": self.week_number,
+            "url": self.url,
+            "days": {day_id: day.to_json() for day_id, day in self.days.items()},
+            "footer": self.footer,
+        }
+
+
+@dataclass
+class AnnouncementJob:
+    __slots__ = (
+        "id",
+        "club_id",
+        "author_id",
+        "message",
+        "recipient_ids",
+        "delivered_ids",
+        "failed_ids",
+        "progress_channel_id",
+        "progress_message_id",
+        "created_at",
+    )
+    id: str
+    club_id: str
+    author_id: int
+    message: str
+    recipient_ids: List[int]  # Everyone that the announcement should be sent to
+    delivered_ids: Set[int]  # Recipients that the announcement has been sent to
+    failed_ids: Set[int]  # Recipients that the announcement could not be sent to
+    # The message where the progress of the job is reported
+    progress_channel_id: Optional[int]
+    progress_message_id: Optional[int]
+    created_at: str
+
+    @classmethod
+    def from_json(cls, data: Dict) -> "AnnouncementJob":
+        """Creates an announcement job from its entry in the announcement jobs file.
+
+        :param data: The JSON data for the job.
+
+        :raises ValueError: If the data is invalid."""
+        user_id_lists = {}
+        for key in ["recipient_ids", "delivered_ids", "failed_ids"]:
+            user_id_lists[key] = get_validated(data, key, list)
+            if not all(isinstance(user_id, int) for user_id in user_id_lists[key]):
+                raise ValueError(f"Expected {key!r} to only contain user IDs.")
+        return cls(
+            get_validated(data, "id", str),
+            get_validated(data, "club_id", str),
+            get_validated(data, "author_id", int),
+            get_validated(data, "message", str),
+            user_id_lists["recipient_ids"],
+            set(user_id_lists["delivered_ids"]),
+            set(user_id_lists["failed_ids"]),
+            get_validated(data, "progress_channel_id", int, nullable=True),
+            get_validated(data, "progress_message_id", int, nullable=True),
+            get_validated(data, "created_at", str),
+        )
+
+    def to_json(self) -> Dict:
+        """Converts the job to its entry in the announcement jobs file."""
+        return {
+            "id": self.id,
+            "club_id": self.club_id,
+            "author_id": self.author_id,
+            "message": self.message,
+            "recipient_ids": list(self.recipient_ids),
+            "delivered_ids": sorted(self.delivered_ids),
+            "failed_ids": sorted(self.failed_ids),
+            "progress_channel_id": self.progress_channel_id,
+            "progress_message_id": self.progress_message_id,
+            "created_at": self.created_at,
+        }
+
+    def get_pending_recipient_ids(self) -> List[int]:
+        """Gets the recipients that have not been handled yet."""
+        return [
+            recipient_id
+            for recipient_id in self.recipient_ids
+            if recipient_id not in self.delivered_ids
+            and recipient_id not in self.failed_ids
+        ]
+
+
+class ModelCache:
+    def __init__(self, filepath: str, parse_function: Callable):
+        """Caches models parsed from a JSON document. The document is only parsed again when it has changed.
+
+        :param filepath: The path to the document.
+
+        :param parse_function: A function that is called with the document and returns the models.
+        """
+        self.filepath = filepath
+        self.parse_function = parse_function
+        self.version: Optional[int] = None
+        self.models = None
+
+    async def get(self):
+        """Gets the models for the document. They must not be modified."""
+        document, version = await run_file_io(
+            document_store.get_with_version, self.filepath
+        )
+        if version != self.version:
+            logger.debug(f"Parsing models from {self.filepath}...")
+            # The document is parsed from the event loop since journals change it in place from there (see journal.py)
+            self.models = self.parse_function(document)
+            self.version = version
+        return self.models
@@ -0,0 +1,141 @@
+"""notification_queue.py
+Contains a priority queue that keeps track of which subscribers of a subscription subcategory are due to be notified.
+
+Without it, finding out who should be notified means going through every subscriber of the subcategory
+and parsing their last notification time. Here, the subscribers are instead kept in a min-heap ordered by when they were
+last notified (as a UNIX timestamp that is parsed once, when the queue is built). Everyone that was last notified before
+a certain time is at the top of the heap, so the k subscribers that are due are found by popping k entries
+(O(k log n)) instead of looking at every subscriber.
+
+Entries are never removed from the middle of the heap. When a subscriber unsubscribes or is notified, their old entry is
+left in the heap and dropped when it reaches the top (lazy deletion). If too many old entries pile up, the heap is rebuilt.
+The queues are built from the stored subscriptions when the bot starts and kept up to date by subscription.py."""
+import datetime, heapq
+from typing import Dict, List, Optional, Tuple
+
+# Last notification time of subscribers that have never been notified
+NEVER_NOTIFIED = 0.0
+# The heap is rebuilt when it has this many more entries than subscribers (see compact_if_needed())
+COMPACTION_SLACK = 64
+
+
+class NotificationQueue:
+    def __init__(self):
+        """Initializes an empty queue."""
+        # Entries of (last notification time, user ID). Outdated entries are skipped, see is_current()
+        self.heap: List[Tuple[float, int]] = []
+        # Mapping: user ID --> (last notification time, period that the user was last notified for)
+        self.subscribers: Dict[int, Tuple[float, Optional[str]]] = {}
+
+    @classmethod
+    def from_json(cls, subcategory_data: Dict) -> "NotificationQueue":
+        """Builds a queue from the subscribers of a subcategory in the subscriptions file.
+
+        :param subcategory_data: The subcategory data in the subscriptions file."""
+        notification_queue = cls()
+        for user_id, subscription_data in subcategory_data["subscriptions"].items():
+            last_notified_at = subscription_data.get("last_notified_at", None)
+            notification_queue.subscribers[int(user_id)] = (
+                datetime.datetime.fromisoformat(last_notified_at).timestamp()
+                if last_notified_at is not None
+                else NEVER_NOTIFIED,
+                subscription_data.get("last_notified_period", None),
+            )
+        notification_queue.rebuild_heap()
+        return notification_queue
+
+    def is_current(self, entry: Tuple[float, int]) -> bool:
+        """Checks if a heap entry still describes a subscriber, or if it has been replaced or the subscriber has unsubscribed.
+
+        :param entry: The heap entry."""
+        last_notified_at, user_id = entry
+        return (
+            user_id in self.subscribers
+            and self.subscribers[user_id][0] == last_notified_at
+        )
+
+    def add(self, user_id: int):
+        """Adds a subscriber that has never been notified. Does nothing if the user is already a subscriber.
+
+        :param user_id: The ID of the user."""
+        if user_id in self.subscribers:
+            return
+        self.subscribers[user_id] = (NEVER_NOTIFIED, None)
+        heapq.heappush(self.heap, (NEVER_NOTIFIED, user_id))
+        self.compact_if_needed()
+
+    def remove(self, user_id: int):
+        """Removes a subscriber.
+
+        :param user_id: The ID of the user."""
+        if self.subscribers.pop(user_id, None) is not None:
+            self.compact_if_needed()
+
+    def mark_notified(
+        self,
+        user_id: int,
+        notified_at: datetime.datetime,
+        period: Optional[str] = None,
+    ):
+        """Records that a subscriber has been notified. Does nothing if the user is not a subscriber.
+
+        :param user_id: The ID of the user.
+
+        :param notified_at: When the user was notified.
+
+        :param period: The period that the user was notified for. If None, the previous period is kept.
+        """
+        if user_id not in self.subscribers:  # (the user might have unsubscribed)
+            return
+        last_notified_at, last_notified_period = self.subscribers[user_id]
+        notified_at_timestamp = notified_at.timestamp()
+        self.subscribers[user_id] = (
+            notified_at_timestamp,
+            period if period is not None else last_notified_period,
+        )
+        if notified_at_timestamp != last_notified_at:
+            heapq.heappush(self.heap, (notified_at_timestamp, user_id))
+            self.compact_if_needed()
+
+    def get_due(
+        self, timestamp: datetime.datetime, period: Optional[str] = None
+    ) -> List[int]:
+        """Gets the subscribers that have not been notified after a certain time.
+
+        :param timestamp: Any users not notified after or at this will be returned.
+
+        :param period: If set, users that have already been notified for this period are not returned.
+
+        :returns: The IDs of the users, the ones that have waited the longest first."""
+        cutoff = timestamp.timestamp()
+        # Pop every entry that was last notified before the cutoff. Outdated entries are dropped on the way,
+        # while the current ones are pushed back afterwards since the users stay due until they are notified.
+        current_entries = {}  # Mapping: user ID --> entry
+        while len(self.heap) > 0 and self.heap[0][0] < cutoff:
+            entry = heapq.heappop(self.heap)
+            if self.is_current(entry):
+                # (a user that unsubscribed and subscribed again can have two current entries)
+                current_entries[entry[1]] = entry
+        for entry in current_entries.values():
+            heapq.heappush(self.heap, entry)
+        return [
+            user_id
+            for user_id in current_entries.keys()
+            if period is None or self.subscribers[user_id][1] != period
+        ]
+
+    def compact_if_needed(self):
+        """Rebuilds the heap without outdated entries if too many of them have piled up."""
+        if len(self.heap) > 2 * len(self.subscribers) + COMPACTION_SLACK:
+            self.rebuild_heap()
+
+    def rebuild_heap(self):
+        """Builds the heap from the subscribers, with one entry per subscriber."""
+        self.heap = [
+            (last_notified_at, user_id)
+            for user_id, (last_notified_at, _) in self.subscribers.items()
+        ]
+        heapq.heapify(self.heap)
+
+    def __len__(self) -> int:
+        return len(self.subscribers)
@@ -1,23 +1,36 @@
 """pentry.py
 Contains various utilities related to grabbing pentry fluid_data.
 """
-import aiohttp, logging
-from utils.general import get_json, write_json, PENTRYANSVAR_DATA_FILEPATH
+import aiohttp, asyncio, logging
+from utils.general import (
+    aget_json,
+    awrite_json,
+    get_api_url,
+    PENTRYANSVAR_DATA_FILEPATH,
+)
+from utils.http_client import http_client
 
 logger = logging.getLogger(__name__)
 
+# pentryansvar.albins.website will be up again soon. The one provided here is ran locally on the SSIS tnetwork.
+PENTRYANSVAR_API_URL = get_api_url(
+    "SSIS_DISCORD_BOT_PENTRYANSVAR_API_URL",
+    "https://pentryansvar.albins.website/api/pentryansvar",
+    "/pentry/api/pentryansvar",
+)
 
-def get_pentryansvar_data():
+
+async def get_pentryansvar_data():
     """Loads the pentryansvar file, which contains information
     about the current message that has been sent, etc."""
-    return get_json(PENTRYANSVAR_DATA_FILEPATH)
+    return await aget_json(PENTRYANSVAR_DATA_FILEPATH)
 
 
-def write_pentryansvar_data(new_data):
+async def write_pentryansvar_data(new_data):
     """Writes fluid_data to the file containing pentryansvar fluid_data.
 
     :param new_data: The new fluid_data to write to the file."""
-    write_json(
+    await awrite_json(
         PENTRYANSVAR_DATA_FILEPATH, new_data
     )  # Write the new fluid_data to the file
 
@@ -27,10 +40,8 @@ async def get_pentryansvar():
 
     :returns The JSON if the request succeeded, None if it didn't."""
     logger.info("Retrieving pentryansvar...")
-    async with aiohttp.ClientSession() as session:
-        async with session.get(
-            "https://pentryansvar.albins.website/api/pentryansvar"
-        ) as request:  # pentryansvar.albins.website will be up again soon. The one provided here is ran locally on the SSIS tnetwork.
+    try:
+        async with http_client.get(PENTRYANSVAR_API_URL) as request:
             if request.status == 200:  # If the request succeeded
                 logger.info("Pentryansvar request succeeded. Retrieving JSON...")
                 pentry_data = await request.json()
@@ -39,3 +50,6 @@ async def get_pentryansvar():
             else:
                 logger.warning("Pentryansvar request returned unknown status code!")
                 return None
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning(f"Pentryansvar request failed: {e!r}")
+        return None
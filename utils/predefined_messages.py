@@ -1,7 +1,11 @@
 """predefined_messages.py
 Contains utilities related to the predefined messages function.
 """
-from utils.general import STATIC_DATA_DIRECTORY, get_json
+from utils.general import STATIC_DATA_DIRECTORY, aget_json, paginate_embed
+from utils.autocomplete import PrefixIndex
+from utils.models import ModelCache
+from nextcord import Embed
+from typing import Dict, List, Optional
 import os, logging
 
 PREDEFINED_MESSAGES_PATH = os.path.join(
@@ -10,22 +14,79 @@ PREDEFINED_MESSAGES_PATH = os.path.join(
 
 # Logging
 logger = logging.getLogger(__name__)
+# Index of predefined message names for autocompleting them (see autocomplete.py)
+predefined_message_index_cache = ModelCache(
+    PREDEFINED_MESSAGES_PATH,
+    lambda predefined_messages: PrefixIndex(predefined_messages.keys()),
+)
+
 
+async def get_predefined_messages(copy=True):
+    """Function to get predefined message fluid_data.
 
-def get_predefined_messages():
-    """Function to get predefined message fluid_data."""
-    return get_json(PREDEFINED_MESSAGES_PATH)
+    :param copy: If False, the in-memory data is returned. Only use this for read-only access."""
+    return await aget_json(PREDEFINED_MESSAGES_PATH, copy=copy)
 
 
-def get_predefined_message(name):
+async def get_predefined_message(name):
     """Function to get a certain predefined message.
 
     :param name: The name of the predefined message.
 
     :returns: A dictionary with information if the predefined message is found,
     None if it isn't."""
-    if name not in get_predefined_messages():
+    predefined_messages = await get_predefined_messages(copy=False)
+    if name not in predefined_messages:
         logger.info(f'Requested predefined message "{name}" not found.')
     else:
         logger.info(f"Returning predefined message for {name}...")
-        return get_predefined_messages()[name]
+        return predefined_messages[name]
+
+
+def create_predefined_message_embeds(predefined_message: Dict) -> List[Embed]:
+    """Converts a predefined message into embeds that can be sent.
+
+    :param predefined_message: The predefined message.
+
+    :returns: The message, split into multiple embeds if it has too many fields to fit in one."""
+    final_message = Embed(
+        title=predefined_message["title"]
+        if "title" in predefined_message
+        else "Information",
+        description=predefined_message.get(
+            "message", Embed.Empty
+        ),  # Messages that only consist of fields do not have descriptions
+        color=predefined_message["color"],
+    )
+    for field in predefined_message.get("fields", []):
+        # Add field
+        final_message.add_field(
+            name=field["name"],
+            value=field["value"],
+            inline=False if "inline" not in field else field["inline"],
+        )  # All fields must have a name and a value.
+    return paginate_embed(final_message)
+
+
+# Rendered embeds of every predefined message, rendered again only when the predefined messages file has changed
+predefined_message_embeds_cache = ModelCache(
+    PREDEFINED_MESSAGES_PATH,
+    lambda predefined_messages: {
+        name: create_predefined_message_embeds(predefined_message)
+        for name, predefined_message in predefined_messages.items()
+    },
+)
+
+
+async def get_predefined_message_embeds(name) -> Optional[List[Embed]]:
+    """Function to get a certain predefined message as embeds that can be sent.
+    The returned embeds are shared between calls, so they must not be modified.
+
+    :param name: The name of the predefined message.
+
+    :returns: The embeds of the predefined message if it is found, None if it isn't."""
+    predefined_message_embeds = await predefined_message_embeds_cache.get()
+    if name not in predefined_message_embeds:
+        logger.info(f'Requested predefined message "{name}" not found.')
+        return None
+    return predefined_message_embeds[name]
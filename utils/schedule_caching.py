@@ -1,55 +1,98 @@
 """schedule_caching.py
 This file contains some helper functions for handling schedules.
 The bot can handle schedules by caching them from the SSIS Schedule API a few times a day,
-and that is basically everything that this file handles."""
-import datetime
+and that is basically everything that this file handles.
+
+Only the schedules of classes that are stale (not downloaded today, or downloaded more than SCHEDULE_REFRESH_INTERVAL seconds ago)
+are downloaded. They are downloaded concurrently, at most SCHEDULE_DOWNLOAD_CONCURRENCY at a time, and all downloaded schedules
+are saved with one write. How long the downloads take and how often they fail is recorded per class and shown by the stats command.
+
+Every cached schedule also has a hash of its lessons (see schedule_changes.py). If a schedule for the same day is downloaded
+again and its hash has changed, the changes are returned by cache_schedules() so that subscribers can be notified."""
+import asyncio, datetime, json, time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import aiohttp
 
 from utils.general import (
     write_json,
-    get_json,
+    aget_json,
+    awrite_json,
     get_active_classes,
+    get_file_lock,
+    string_to_localized_datetime,
+    get_api_url,
     CACHED_SCHEDULE_DATA_FILEPATH,
     get_now,
-    BASE_TIMEZONE,
 )
-import aiohttp, logging, os
+import logging, os
+from utils.http_client import http_client
+from utils.schedule_changes import ScheduleDiff, diff_lessons, get_lessons_hash
+from utils.schedule_index import parse_lessons
 
 logger = logging.getLogger(__name__)
 
 # Constants
 DEFAULT_SCHEDULE_JSON = {"schedules": {}, "downloaded_at": None}
+SCHEDULE_API_URL = get_api_url(
+    "SSIS_DISCORD_BOT_SCHEDULE_API_URL", "https://api.ssis.nu/cal", "/cal"
+)
 CACHED_SCHEDULE_TIMEOUT = (
     60 * 60 * 12
 )  # Value in seconds - require caching at least every 12 hours (60 sec * 60 min * 12 hours)
 MINIMUM_TIME_BETWEEN_CACHES = (
     60 * 15
 )  # Value in seconds - allow caching max once every 15 minutes
+# Value in seconds - download a schedule again if it was downloaded more than this long ago. The default (25 minutes) is a bit
+# shorter than how often schedules are downloaded (every 30 minutes, see the Schedules cog), so that a download that finished a
+# few seconds into the previous run is still repeated, and a cancelled or moved lesson is noticed within 30 minutes
+SCHEDULE_REFRESH_INTERVAL = 60 * int(
+    os.getenv("SSIS_DISCORD_BOT_SCHEDULE_REFRESH_INTERVAL", 25)
+)
+# How many schedules that can be downloaded at the same time
+SCHEDULE_DOWNLOAD_CONCURRENCY = int(
+    os.getenv("SSIS_DISCORD_BOT_SCHEDULE_DOWNLOAD_CONCURRENCY", 4)
+)
+
+
+@dataclass
+class ScheduleDownloadStats:
+    __slots__ = ("downloads", "failures", "total_duration", "last_duration")
+    downloads: int
+    failures: int
+    total_duration: float  # The total time (in seconds) that the downloads took
+    last_duration: float
+
+
+# Mapping: class name --> statistics about downloading the schedule of the class
+schedule_download_stats: Dict[str, ScheduleDownloadStats] = {}
 
 # Helper functions
-def get_schedule_file():
+async def get_schedule_file():
     """Gets content in the cached schedule file"""
-    return get_json(CACHED_SCHEDULE_DATA_FILEPATH)
+    return await aget_json(CACHED_SCHEDULE_DATA_FILEPATH)
 
 
-def update_schedule_file(new_content):
+async def update_schedule_file(new_content):
     """Updates the schedule file with new content.
 
     :param new_content: New content to write to the file."""
-    write_json(CACHED_SCHEDULE_DATA_FILEPATH, new_content)
+    await awrite_json(CACHED_SCHEDULE_DATA_FILEPATH, new_content)
 
 
 # Create file if doesn't exists
 if not os.path.exists(CACHED_SCHEDULE_DATA_FILEPATH):
     logger.info("Creating schedule information file...")
-    update_schedule_file(DEFAULT_SCHEDULE_JSON)
+    write_json(CACHED_SCHEDULE_DATA_FILEPATH, DEFAULT_SCHEDULE_JSON)
 
 
-def get_cached_schedules():
+async def get_cached_schedules():
     """Gets all cached schedules for all active classes.
     If there are no cached schedules for a class, that class's content
     gets replaced with None instead."""
     logger.debug("Getting cached schedules...")
-    cached_schedules = get_schedule_file()
+    cached_schedules = await get_schedule_file()
     wanted_classes = get_active_classes()
     now = get_now()
     schedules = {}
@@ -59,9 +102,9 @@ def get_cached_schedules():
         )
         if class_name in cached_schedules["schedules"]:
             logger.debug("Class found in file, checking if it has been cached today...")
-            schedule_cached_at = datetime.datetime.fromisoformat(
+            schedule_cached_at = string_to_localized_datetime(
                 cached_schedules["schedules"][class_name]["cached_at"]
-            ).astimezone(BASE_TIMEZONE)
+            )
             if (now - schedule_cached_at).total_seconds() <= CACHED_SCHEDULE_TIMEOUT:
                 logger.debug("Schedule has been cached within the allowed timeout.")
                 schedule_data = cached_schedules["schedules"][class_name]
@@ -77,69 +120,197 @@ def get_cached_schedules():
     return schedules  # Return parsed schedule fluid_data
 
 
-async def cache_schedules():
-    """Attempts to cache schedules by downloading them from SSIS's schedule server."""
-    logger.info("Attempting to caching schedules...")
-    cached_schedules = get_schedule_file()
-    now = get_now()
-    last_cached_at = cached_schedules["downloaded_at"]
-    last_cached_at_parsed = (
-        datetime.datetime.fromisoformat(last_cached_at).astimezone(BASE_TIMEZONE)
-        if last_cached_at != None
-        else None
+def is_schedule_stale(class_schedule: Optional[Dict], now: datetime.datetime) -> bool:
+    """Checks if a cached schedule should be downloaded again.
+
+    :param class_schedule: The cached schedule of the class, or None if it has not been cached.
+
+    :param now: The current time."""
+    if class_schedule is None:
+        return True
+    schedule_cached_at = string_to_localized_datetime(class_schedule["cached_at"])
+    return (
+        schedule_cached_at.date() != now.date()
+        or (now - schedule_cached_at).total_seconds() >= SCHEDULE_REFRESH_INTERVAL
+    )
+
+
+async def download_class_schedule(class_name: str) -> Optional[Dict]:
+    """Downloads the schedule of a class from the SSIS API.
+
+    :param class_name: The name of the class, for example "TE20A".
+
+    :returns: The schedule, an empty dictionary if the class has no schedule today or None if the download failed.
+    """
+    logger.debug(f"Downloading schedule for {class_name}...")
+    download_started_at = time.monotonic()
+    class_schedule = None
+    try:
+        async with http_client.get(
+            SCHEDULE_API_URL,
+            params={"room": class_name},
+            headers={"User-Agent": "Python/SSIS Discord Bot Schedule Parser"},
+        ) as request:
+            if request.status == 200:
+                # Parse content - we get nothing if there is no schedule available
+                content = await request.text()
+                if len(content.strip()) == 0:
+                    logger.info(f"No schedule available for {class_name} today.")
+                    class_schedule = {}
+                else:
+                    class_schedule = json.loads(content)
+            else:
+                logger.critical(
+                    f"Request to SSIS API for {class_name} failed with status code {request.status}."
+                )
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        logger.critical(
+            f"Something failed in the request to the SSIS API for {class_name} (error {e!r} occurred).",
+            exc_info=True,
+        )
+    download_duration = time.monotonic() - download_started_at
+    class_stats = schedule_download_stats.setdefault(
+        class_name, ScheduleDownloadStats(0, 0, 0.0, 0.0)
     )
+    class_stats.downloads += 1
+    class_stats.total_duration += download_duration
+    class_stats.last_duration = download_duration
+    if class_schedule is None:
+        class_stats.failures += 1
+    return class_schedule
+
+
+def get_schedule_diff(
+    class_name: str,
+    previous_class_schedule: Optional[Dict],
+    class_schedule: Dict,
+    now: datetime.datetime,
+) -> Optional[ScheduleDiff]:
+    """Checks if a schedule has changed since it was previously downloaded.
+
+    :param class_name: The class that the schedule belongs to.
+
+    :param previous_class_schedule: The previously cached schedule of the class, or None.
+
+    :param class_schedule: The new cached schedule of the class.
+
+    :param now: When the new schedule was downloaded.
+
+    :returns: The changes, or None if the schedule has not changed (or if the previous schedule was for another day).
+    """
+    if previous_class_schedule is None:
+        return None
     if (
-        last_cached_at_parsed == None
-        or (now - last_cached_at_parsed).total_seconds() >= MINIMUM_TIME_BETWEEN_CACHES
+        previous_class_schedule.get("content_hash", None)
+        == class_schedule["content_hash"]
     ):
-        logger.info("Caching is allowed. Downloading...")
+        return None  # (the lessons only need to be compared if the hash has changed)
+    previous_day = string_to_localized_datetime(
+        previous_class_schedule["cached_at"]
+    ).date()
+    if previous_day != now.date():
+        return None
+    schedule_diff = diff_lessons(
+        class_name,
+        now.date(),
+        parse_lessons(
+            class_name, previous_class_schedule["schedule_content"], previous_day
+        ),
+        parse_lessons(class_name, class_schedule["schedule_content"], now.date()),
+    )
+    return schedule_diff if not schedule_diff.is_empty else None
+
+
+async def cache_schedules() -> List[ScheduleDiff]:
+    """Attempts to cache schedules by downloading the stale ones from SSIS's schedule server.
+
+    :returns: The changes in schedules that had already been downloaded today."""
+    logger.info("Attempting to caching schedules...")
+    async with get_file_lock(CACHED_SCHEDULE_DATA_FILEPATH):
+        cached_schedules = await get_schedule_file()
+        now = get_now()
+        last_cached_at = cached_schedules["downloaded_at"]
+        last_cached_at_parsed = (
+            string_to_localized_datetime(last_cached_at)
+            if last_cached_at != None
+            else None
+        )
+        if (
+            last_cached_at_parsed != None
+            and (now - last_cached_at_parsed).total_seconds()
+            < MINIMUM_TIME_BETWEEN_CACHES
+        ):
+            logger.critical(
+                f"Will not cache schedules - time since last cache is too little! {last_cached_at_parsed} was last cache time."
+            )
+            return []
         # Get all classes that we should download
-        classes_to_retrieve = get_active_classes()
-        for class_to_retrieve in classes_to_retrieve:
-            logger.debug(f"Downloading schedule for {class_to_retrieve}...")
-            async with aiohttp.ClientSession() as session:
-                try:
-                    async with session.get(
-                        "https://api.ssis.nu/cal",
-                        params={"room": class_to_retrieve},
-                        headers={
-                            "User-Agent": "Python/SSIS Discord Bot Schedule Parser"
-                        },
-                    ) as request:
-                        if request.status == 200:
-                            logger.info("Request to SSIS API succeeded.")
-                            # Parse content - we get nothing if there is no schedule available
-                            content = await request.text()
-                            if len(content) == 0:
-                                logger.info("No schedule available for class today.")
-                                raw_class_schedule = {}
-                            else:
-                                logger.info("Schedule available for today.")
-                                raw_class_schedule = await request.json()
-                        else:
-                            logger.critical(
-                                f"Request to SSIS API failed with status code {request.status}."
-                            )
-                            raw_class_schedule = {}
-                    await session.close()
-                except Exception as e:
-                    logger.critical(
-                        f"Something failed in the request to the SSIS API (error {e} occurred).",
-                        exc_info=True,
-                    )
-                    raw_class_schedule = {}
-            logger.info(f"Schedule for {class_to_retrieve}: {raw_class_schedule}")
+        classes_to_retrieve = [
+            class_name
+            for class_name in get_active_classes()
+            if is_schedule_stale(
+                cached_schedules["schedules"].get(class_name, None), now
+            )
+        ]
+        if len(classes_to_retrieve) == 0:
+            logger.info("All cached schedules are up to date.")
+            return []
+        logger.info(
+            f"Caching is allowed. Downloading {len(classes_to_retrieve)} schedules..."
+        )
+        download_semaphore = asyncio.Semaphore(SCHEDULE_DOWNLOAD_CONCURRENCY)
+
+        async def download_with_limit(class_name: str) -> Optional[Dict]:
+            async with download_semaphore:
+                return await download_class_schedule(class_name)
+
+        downloaded_schedules = await asyncio.gather(
+            *[download_with_limit(class_name) for class_name in classes_to_retrieve]
+        )
+        schedule_diffs = []
+        for class_name, schedule_content in zip(
+            classes_to_retrieve, downloaded_schedules
+        ):
+            if schedule_content is None:  # (keep the previous schedule, if any)
+                continue
             # Generate schedule content and save
             class_schedule = {
                 "cached_at": str(now),
-                "schedule_content": raw_class_schedule,
+                "schedule_content": schedule_content,
+                "content_hash": get_lessons_hash(
+                    parse_lessons(class_name, schedule_content, now.date())
+                ),
             }
-            cached_schedules[class_to_retrieve] = class_schedule
-        logger.info("Writing update schedule fluid_data...")
+            schedule_diff = get_schedule_diff(
+                class_name,
+                cached_schedules["schedules"].get(class_name, None),
+                class_schedule,
+                now,
+            )
+            if schedule_diff is not None:
+                logger.info(f"The schedule of {class_name} has changed.")
+                schedule_diffs.append(schedule_diff)
+            cached_schedules["schedules"][class_name] = class_schedule
+        failed_downloads = downloaded_schedules.count(None)
+        logger.info(
+            f"Writing update schedule fluid_data ({len(classes_to_retrieve) - failed_downloads} downloaded, {failed_downloads} failed)..."
+        )
         cached_schedules["downloaded_at"] = str(now)
-        update_schedule_file(cached_schedules)
+        await update_schedule_file(cached_schedules)
         logger.info("Cached schedules updated.")
-    else:
-        logger.critical(
-            f"Will not cache schedules - time since last cache is too little! {last_cached_at_parsed} was last cache time."
-        )
+        return schedule_diffs
+
+
+def get_schedule_download_stats() -> Dict[str, Dict[str, object]]:
+    """Returns statistics about downloading the schedule of every class."""
+    return {
+        class_name: {
+            "downloads": class_stats.downloads,
+            "failures": class_stats.failures,
+            "average_duration_ms": round(
+                class_stats.total_duration / class_stats.downloads * 1000, 2
+            ),
+            "last_duration_ms": round(class_stats.last_duration * 1000, 2),
+        }
+        for class_name, class_stats in schedule_download_stats.items()
+    }
@@ -0,0 +1,120 @@
+"""schedule_changes.py
+Contains functions for finding out how the schedule of a class has changed between two downloads.
+
+Every cached schedule is stored together with a hash of its lessons (see get_lessons_hash()). The lessons are normalized
+before hashing, so a schedule that is downloaded again without any changes gets the same hash even if the schedule API
+returns the lessons in a different order. When a schedule is downloaded, the old and new hashes are compared first, and
+the lessons are only compared one by one (see diff_lessons()) if the hashes differ."""
+import datetime, hashlib, json
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+from utils.schedule_index import Lesson
+
+
+@dataclass
+class ScheduleDiff:
+    __slots__ = ("class_name", "day", "added", "removed", "moved")
+    class_name: str
+    day: datetime.date
+    added: List[Lesson]
+    removed: List[Lesson]  # For example cancelled lessons
+    moved: List[
+        Tuple[Lesson, Lesson]
+    ]  # (before, after) for lessons that changed time or room
+
+    @property
+    def is_empty(self) -> bool:
+        return len(self.added) == 0 and len(self.removed) == 0 and len(self.moved) == 0
+
+
+def get_lesson_key(lesson: Lesson) -> Tuple[str, str, str, str]:
+    """Gets a key that identifies a lesson and everything about it.
+
+    :param lesson: The lesson."""
+    return (
+        lesson.name,
+        lesson.start.isoformat(),
+        lesson.end.isoformat(),
+        lesson.room or "",
+    )
+
+
+def get_lessons_hash(lessons: List[Lesson]) -> str:
+    """Calculates a hash of a list of lessons that does not depend on the order of the lessons.
+
+    :param lessons: The lessons."""
+    return hashlib.sha256(
+        json.dumps(sorted(get_lesson_key(lesson) for lesson in lessons)).encode("UTF-8")
+    ).hexdigest()
+
+
+def diff_lessons(
+    class_name: str,
+    day: datetime.date,
+    old_lessons: List[Lesson],
+    new_lessons: List[Lesson],
+) -> ScheduleDiff:
+    """Finds the lessons that have been added, removed or moved in a schedule. A changed lesson is counted as moved
+    if there is a changed lesson with the same name in the new schedule, and as removed or added otherwise.
+
+    :param class_name: The class that the schedule belongs to.
+
+    :param day: The day of the schedule.
+
+    :param old_lessons: The lessons before the change.
+
+    :param new_lessons: The lessons after the change."""
+    old_keys = {get_lesson_key(lesson) for lesson in old_lessons}
+    new_keys = {get_lesson_key(lesson) for lesson in new_lessons}
+    # Lessons that are exactly the same are not interesting
+    changed_old_lessons = sorted(
+        [lesson for lesson in old_lessons if get_lesson_key(lesson) not in new_keys],
+        key=lambda lesson: lesson.start,
+    )
+    changed_new_lessons = sorted(
+        [lesson for lesson in new_lessons if get_lesson_key(lesson) not in old_keys],
+        key=lambda lesson: lesson.start,
+    )
+    # A lesson with the same name in both schedules is assumed to have been moved. If a class has several lessons
+    # with the same name on a day, the lessons are paired by how close their start times are, closest first, so
+    # that one lesson being cancelled or moved does not pair up two lessons that have not changed places.
+    # Mapping: lesson name --> indexes of the new lessons with the name
+    new_lesson_indexes_by_name: Dict[str, List[int]] = {}
+    for new_index, lesson in enumerate(changed_new_lessons):
+        new_lesson_indexes_by_name.setdefault(lesson.name, []).append(new_index)
+    candidate_pairs = sorted(
+        (
+            abs(
+                (
+                    changed_new_lessons[new_index].start - old_lesson.start
+                ).total_seconds()
+            ),
+            old_index,
+            new_index,
+        )
+        for old_index, old_lesson in enumerate(changed_old_lessons)
+        for new_index in new_lesson_indexes_by_name.get(old_lesson.name, [])
+    )
+    # Mapping: index of an old lesson --> index of the new lesson that it was moved to
+    moved_to: Dict[int, int] = {}
+    paired_new_indexes = set()
+    for start_difference, old_index, new_index in candidate_pairs:
+        if old_index not in moved_to and new_index not in paired_new_indexes:
+            moved_to[old_index] = new_index
+            paired_new_indexes.add(new_index)
+    moved = [
+        (old_lesson, changed_new_lessons[moved_to[old_index]])
+        for old_index, old_lesson in enumerate(changed_old_lessons)
+        if old_index in moved_to
+    ]
+    removed = [
+        old_lesson
+        for old_index, old_lesson in enumerate(changed_old_lessons)
+        if old_index not in moved_to
+    ]
+    added = [
+        new_lesson
+        for new_index, new_lesson in enumerate(changed_new_lessons)
+        if new_index not in paired_new_indexes
+    ]
+    return ScheduleDiff(class_name, day, added, removed, moved)
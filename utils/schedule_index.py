@@ -0,0 +1,269 @@
+"""schedule_index.py
+Contains an index of the lessons in the cached schedules (see schedule_caching.py), for looking up what a class has at a certain time.
+
+The schedules from the SSIS schedule API are cached as they were downloaded. Here, they are parsed into lessons once
+per download (the index is rebuilt when the cached schedules file changes). The lessons of every class are kept sorted by
+start time, so the current and next lesson of a class are found with a binary search instead of by going through the
+raw schedule on every call.
+
+The parser is tolerant: a schedule can be a list of lessons or a dictionary with the lessons under "lessons", "events"
+or "schedule", and the start, end and name of a lesson are read from the first of a few common keys that is present
+(see LESSON_START_KEYS etc.). Times can be full ISO timestamps or HH:MM on the day that the schedule was downloaded.
+Lessons that can not be parsed are skipped."""
+import datetime, logging, os, pytz
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from utils.general import (
+    BASE_TIMEZONE,
+    CACHED_SCHEDULE_DATA_FILEPATH,
+    get_now,
+    string_to_localized_datetime,
+)
+from utils.models import ModelCache
+
+logger = logging.getLogger(__name__)
+
+LESSON_LIST_KEYS = ["lessons", "events", "schedule"]
+LESSON_START_KEYS = ["start", "start_time", "starts_at", "dtstart", "from"]
+LESSON_END_KEYS = ["end", "end_time", "ends_at", "dtend", "to"]
+LESSON_NAME_KEYS = ["name", "title", "summary", "course", "subject"]
+LESSON_ROOM_KEYS = ["room", "location", "classroom"]
+
+
+@dataclass
+class Lesson:
+    __slots__ = ("class_name", "name", "start", "end", "room")
+    class_name: str
+    name: str
+    start: datetime.datetime  # (in BASE_TIMEZONE)
+    end: datetime.datetime
+    room: Optional[str]
+
+
+def get_first_value(data: Dict, keys: List[str]):
+    """Gets the value of the first key in a list that is present in a dictionary.
+
+    :param data: The dictionary.
+
+    :param keys: The keys to look for, in order.
+
+    :returns: The value, or None if none of the keys are present."""
+    for key in keys:
+        if data.get(key, None) is not None:
+            return data[key]
+    return None
+
+
+def parse_lesson_time(value, day: datetime.date) -> datetime.datetime:
+    """Parses the start or end time of a lesson.
+
+    :param value: An ISO timestamp, or a time on the form HH:MM.
+
+    :param day: The day that times on the form HH:MM are on.
+
+    :raises ValueError: If the time can not be parsed."""
+    if not isinstance(value, str):
+        raise ValueError(f"Expected a time, got {value!r}.")
+    if len(value) <= 5:  # HH:MM
+        return pytz.timezone(BASE_TIMEZONE).localize(
+            datetime.datetime.combine(day, datetime.time.fromisoformat(value.zfill(5)))
+        )
+    lesson_time = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if lesson_time.tzinfo is None:
+        return pytz.timezone(BASE_TIMEZONE).localize(lesson_time)
+    return lesson_time.astimezone(pytz.timezone(BASE_TIMEZONE))
+
+
+def parse_lessons(
+    class_name: str, schedule_content, day: datetime.date
+) -> List[Lesson]:
+    """Parses the lessons in a schedule from the schedule API.
+
+    :param class_name: The class that the schedule belongs to.
+
+    :param schedule_content: The schedule as returned by the schedule API.
+
+    :param day: The day that the schedule was downloaded, for times without a date.
+
+    :returns: The lessons that could be parsed, in no particular order."""
+    if isinstance(schedule_content, dict):
+        schedule_content = get_first_value(schedule_content, LESSON_LIST_KEYS) or []
+    if not isinstance(schedule_content, list):
+        logger.warning(f"Unknown schedule format for {class_name}. Skipping.")
+        return []
+    lessons = []
+    for lesson_data in schedule_content:
+        try:
+            if not isinstance(lesson_data, dict):
+                raise ValueError(f"Expected a lesson, got {lesson_data!r}.")
+            lesson = Lesson(
+                class_name,
+                str(get_first_value(lesson_data, LESSON_NAME_KEYS) or "Lektion"),
+                parse_lesson_time(get_first_value(lesson_data, LESSON_START_KEYS), day),
+                parse_lesson_time(get_first_value(lesson_data, LESSON_END_KEYS), day),
+                get_first_value(lesson_data, LESSON_ROOM_KEYS),
+            )
+        except ValueError as e:
+            logger.debug(
+                f"Skipping lesson for {class_name} that can not be parsed: {e}"
+            )
+            continue
+        if lesson.end > lesson.start:
+            lessons.append(lesson)
+    return lessons
+
+
+class ClassSchedule:
+    def __init__(self, class_name: str, lessons: List[Lesson]):
+        """Indexes the lessons of a class.
+
+        :param class_name: The name of the class.
+
+        :param lessons: The lessons of the class."""
+        self.class_name = class_name
+        self.lessons = sorted(lessons, key=lambda lesson: (lesson.start, lesson.end))
+        self.starts = [lesson.start for lesson in self.lessons]
+        # The latest end of any lesson up to and including every index, so that lessons that overlap
+        # a shorter lesson that started later are found as well
+        self.latest_ends: List[datetime.datetime] = []
+        for lesson in self.lessons:
+            self.latest_ends.append(
+                max(lesson.end, self.latest_ends[-1])
+                if len(self.latest_ends) > 0
+                else lesson.end
+            )
+
+    def current_lesson(self, at: datetime.datetime) -> Optional[Lesson]:
+        """Gets the lesson that the class has at a certain time.
+
+        :param at: The time.
+
+        :returns: The lesson, or None if the class does not have a lesson then. If lessons overlap, the one that started last.
+        """
+        lesson_index = bisect_right(self.starts, at) - 1
+        while lesson_index >= 0 and self.latest_ends[lesson_index] > at:
+            if self.lessons[lesson_index].end > at:
+                return self.lessons[lesson_index]
+            lesson_index -= 1
+        return None
+
+    def next_lesson(self, at: datetime.datetime) -> Optional[Lesson]:
+        """Gets the first lesson that starts after a certain time.
+
+        :param at: The time.
+
+        :returns: The lesson, or None if the class has no more lessons in the schedule."""
+        lesson_index = bisect_right(self.starts, at)
+        return self.lessons[lesson_index] if lesson_index < len(self.lessons) else None
+
+    def previous_lesson(self, at: datetime.datetime) -> Optional[Lesson]:
+        """Gets the last lesson that started at or before a certain time.
+
+        :param at: The time.
+
+        :returns: The lesson, or None if the class had no lessons before then."""
+        lesson_index = bisect_right(self.starts, at) - 1
+        return self.lessons[lesson_index] if lesson_index >= 0 else None
+
+    def __len__(self) -> int:
+        return len(self.lessons)
+
+
+class ScheduleIndex:
+    def __init__(self, class_schedules: Dict[str, ClassSchedule]):
+        """Initializes the index. Use parse_schedule_index() to build it from the cached schedules.
+
+        :param class_schedules: Mapping: class name --> the schedule of the class."""
+        self.class_schedules = class_schedules
+
+    def current_lesson(
+        self, class_name: str, at: Optional[datetime.datetime] = None
+    ) -> Optional[Lesson]:
+        """Gets the lesson that a class has at a certain time.
+
+        :param class_name: The name of the class, for example "TE20A".
+
+        :param at: The time. Defaults to now."""
+        class_schedule = self.class_schedules.get(class_name, None)
+        if class_schedule is None:
+            return None
+        return class_schedule.current_lesson(at or get_now())
+
+    def next_lesson(
+        self, class_name: str, at: Optional[datetime.datetime] = None
+    ) -> Optional[Lesson]:
+        """Gets the next lesson of a class after a certain time.
+
+        :param class_name: The name of the class, for example "TE20A".
+
+        :param at: The time. Defaults to now."""
+        class_schedule = self.class_schedules.get(class_name, None)
+        if class_schedule is None:
+            return None
+        return class_schedule.next_lesson(at or get_now())
+
+    def previous_lesson(
+        self, class_name: str, at: Optional[datetime.datetime] = None
+    ) -> Optional[Lesson]:
+        """Gets the last lesson of a class that started at or before a certain time.
+
+        :param class_name: The name of the class, for example "TE20A".
+
+        :param at: The time. Defaults to now."""
+        class_schedule = self.class_schedules.get(class_name, None)
+        if class_schedule is None:
+            return None
+        return class_schedule.previous_lesson(at or get_now())
+
+    def free_classes_at(self, at: Optional[datetime.datetime] = None) -> List[str]:
+        """Gets the classes that do not have a lesson at a certain time. Classes without a cached schedule are not included.
+
+        :param at: The time. Defaults to now."""
+        at = at or get_now()
+        return [
+            class_name
+            for class_name, class_schedule in self.class_schedules.items()
+            if class_schedule.current_lesson(at) is None
+        ]
+
+    def __len__(self) -> int:
+        return sum(
+            len(class_schedule) for class_schedule in self.class_schedules.values()
+        )
+
+
+def parse_schedule_index(cached_schedules) -> ScheduleIndex:
+    """Builds the schedule index from the cached schedules file.
+
+    :param cached_schedules: The content of the cached schedules file."""
+    class_schedules = {}
+    for class_name, class_schedule_data in cached_schedules["schedules"].items():
+        try:
+            cached_at = string_to_localized_datetime(class_schedule_data["cached_at"])
+        except (KeyError, TypeError, ValueError):
+            logger.warning(f"Cached schedule for {class_name} is invalid. Skipping.")
+            continue
+        class_schedules[class_name] = ClassSchedule(
+            class_name,
+            parse_lessons(
+                class_name,
+                class_schedule_data.get("schedule_content", None),
+                cached_at.date(),
+            ),
+        )
+    schedule_index = ScheduleIndex(class_schedules)
+    logger.info(
+        f"Schedule index built with {len(schedule_index)} lessons for {len(class_schedules)} classes."
+    )
+    return schedule_index
+
+
+schedule_index_cache = ModelCache(CACHED_SCHEDULE_DATA_FILEPATH, parse_schedule_index)
+
+
+async def get_schedule_index() -> ScheduleIndex:
+    """Gets the index of the cached schedules. It is rebuilt when new schedules have been downloaded."""
+    if not os.path.exists(CACHED_SCHEDULE_DATA_FILEPATH):
+        return ScheduleIndex({})
+    return await schedule_index_cache.get()
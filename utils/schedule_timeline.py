@@ -0,0 +1,105 @@
+"""schedule_timeline.py
+Contains a timeline of the schedule notifications ("Matte starts in 5 minutes") that should be sent during a day.
+
+Instead of waking up every few minutes to check if any class has a lesson that starts soon, the timeline is
+precomputed from the schedule index (see schedule_index.py) every time schedules have been downloaded. The events are
+kept sorted by when they should be sent, and events for different classes at the same time are grouped together, so the
+sender can sleep until the next event and then send everything that is due at once.
+
+Events up to a certain time are only handed out once (see pop_due()), and when the timeline is rebuilt, events that
+were handed out by the previous timeline are left out, so rebuilding it after a download never sends a notification twice.
+"""
+import datetime, logging, os
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import List, Optional
+from utils.schedule_index import Lesson, ScheduleIndex
+
+logger = logging.getLogger(__name__)
+
+# How long (in minutes) before a lesson starts that its notification is sent
+SCHEDULE_NOTIFICATION_LEAD_TIME = int(
+    os.getenv("SSIS_DISCORD_BOT_SCHEDULE_NOTIFICATION_LEAD_TIME", 5)
+)
+
+
+@dataclass
+class ScheduleNotificationEvent:
+    __slots__ = ("notify_at", "lesson")
+    notify_at: datetime.datetime
+    lesson: Lesson  # The lesson that is about to start. The class is lesson.class_name
+
+
+class ScheduleTimeline:
+    def __init__(
+        self,
+        events: List[ScheduleNotificationEvent],
+        notified_until: datetime.datetime,
+    ):
+        """Initializes the timeline. Use build_schedule_timeline() to build it from the schedule index.
+
+        :param events: The notification events. They do not have to be sorted.
+
+        :param notified_until: Events at or before this have already been handed out and are never returned.
+        """
+        self.events = sorted(
+            [event for event in events if event.notify_at > notified_until],
+            key=lambda event: (event.notify_at, event.lesson.class_name),
+        )
+        self.notify_ats = [event.notify_at for event in self.events]
+        self.notified_until = notified_until
+        self.next_event_index = 0
+
+    @property
+    def next_event_at(self) -> Optional[datetime.datetime]:
+        """When the next event that has not been handed out should be sent, or None if there are no more events."""
+        if self.next_event_index >= len(self.events):
+            return None
+        return self.events[self.next_event_index].notify_at
+
+    def pop_due(self, now: datetime.datetime) -> List[ScheduleNotificationEvent]:
+        """Hands out the events that are due. Every event is only handed out once.
+
+        :param now: The current time.
+
+        :returns: The events that should be sent at or before now, in order."""
+        due_until_index = bisect_right(self.notify_ats, now, lo=self.next_event_index)
+        due_events = self.events[self.next_event_index : due_until_index]
+        self.next_event_index = due_until_index
+        self.notified_until = max(self.notified_until, now)
+        return due_events
+
+    def __len__(self) -> int:
+        return len(self.events) - self.next_event_index
+
+
+def build_schedule_timeline(
+    schedule_index: ScheduleIndex,
+    classes: List[str],
+    notified_until: datetime.datetime,
+) -> ScheduleTimeline:
+    """Builds the timeline for the rest of the day.
+
+    :param schedule_index: The index of the cached schedules.
+
+    :param classes: The classes to send notifications for.
+
+    :param notified_until: When the previous timeline handed out events until, or now if there is no previous timeline.
+    """
+    lead_time = datetime.timedelta(minutes=SCHEDULE_NOTIFICATION_LEAD_TIME)
+    events = []
+    for class_name in classes:
+        class_schedule = schedule_index.class_schedules.get(class_name, None)
+        if class_schedule is None:
+            continue
+        for lesson in class_schedule.lessons:
+            # (events at or before notified_until are left out by ScheduleTimeline)
+            if lesson.start.date() == notified_until.date():
+                events.append(
+                    ScheduleNotificationEvent(lesson.start - lead_time, lesson)
+                )
+    schedule_timeline = ScheduleTimeline(events, notified_until)
+    logger.info(
+        f"Schedule timeline built with {len(schedule_timeline)} notifications for the rest of the day."
+    )
+    return schedule_timeline
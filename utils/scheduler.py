@@ -0,0 +1,406 @@
+"""scheduler.py
+Contains a scheduler that runs jobs of the cogs at certain times of day, like cron.
+
+Jobs are declared with wall-clock rules in the bot's timezone (see BASE_TIMEZONE), for example:
+* "weekdays 07:30": every Monday to Friday at 07:30.
+* "monday 06:00": every Monday at 06:00.
+* "mon,wed 08:00,12:00": Mondays and Wednesdays at 08:00 and 12:00.
+* "weekdays 08:00-18:00/5": every 5 minutes from 08:00 to 18:00 (inclusive) on weekdays.
+* "daily 00:05": every day at 00:05.
+Jobs can also skip holidays, which are listed in holidays.json in the static data directory.
+
+Instead of every cog waking up regularly to check if it has something to do, the scheduler sleeps until the next job
+is due. A job is never run twice at the same time: if it is still running when it is due again, that run is skipped.
+The number of runs and how long they take are recorded per job and shown by the stats command.
+The scheduler is started and stopped together with the bot (see SSISBot in main.py)."""
+import asyncio, datetime, logging, os, re, time, pytz
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from nextcord import Client
+from utils.general import BASE_TIMEZONE, HOLIDAYS_FILEPATH, get_now
+from utils.models import ModelCache
+
+logger = logging.getLogger(__name__)
+
+# The longest time (in seconds) that the scheduler sleeps before checking the time again,
+# so that jobs still run on time if the system clock is adjusted
+SCHEDULER_MAX_SLEEP = 300
+# How many days ahead to look for the next run of a job before giving up
+SCHEDULER_MAX_LOOKAHEAD_DAYS = 400
+DAY_GROUPS = {
+    "daily": {1, 2, 3, 4, 5, 6, 7},
+    "weekdays": {1, 2, 3, 4, 5},
+    "weekends": {6, 7},
+}
+DAY_NAMES = {  # Mapping: day name --> ISO weekday
+    "monday": 1,
+    "tuesday": 2,
+    "wednesday": 3,
+    "thursday": 4,
+    "friday": 5,
+    "saturday": 6,
+    "sunday": 7,
+}
+TIME_REGEX = re.compile(r"^(\d{1,2}):(\d{2})$")
+# A time range with an interval in minutes, for example 08:00-18:00/5
+TIME_RANGE_REGEX = re.compile(r"^(\d{1,2}:\d{2})-(\d{1,2}:\d{2})/(\d+)$")
+
+
+def parse_time(time_text: str) -> datetime.time:
+    """Parses a time of day written as HH:MM.
+
+    :param time_text: The time, for example "07:30"."""
+    match = TIME_REGEX.match(time_text)
+    if match is None:
+        raise ValueError(f"Invalid time {time_text!r} (expected HH:MM).")
+    return datetime.time(int(match.group(1)), int(match.group(2)))
+
+
+def parse_weekday(day_name: str) -> int:
+    """Parses the name of a day of the week.
+
+    :param day_name: The name of the day in English, for example "monday" or "mon".
+
+    :returns: The ISO weekday (1 for Monday)."""
+    for full_day_name, weekday in DAY_NAMES.items():
+        if len(day_name) >= 3 and full_day_name.startswith(day_name):
+            return weekday
+    raise ValueError(f"Invalid day {day_name!r}.")
+
+
+@dataclass
+class ScheduleRule:
+    __slots__ = ("text", "weekdays", "times")
+    text: str  # The rule as it was written
+    weekdays: Set[int]  # ISO weekdays (1 for Monday) that the rule runs on
+    times: List[datetime.time]  # Sorted times of day that the rule runs at
+
+    @classmethod
+    def parse(cls, text: str) -> "ScheduleRule":
+        """Parses a rule such as "weekdays 07:30" (see the top of this file).
+
+        :param text: The rule."""
+        try:
+            days_text, times_text = text.lower().split()
+        except ValueError:
+            raise ValueError(
+                f"Invalid schedule rule {text!r} (expected <days> <times>)."
+            )
+        weekdays = set()
+        for day_text in days_text.split(","):
+            if day_text in DAY_GROUPS:
+                weekdays |= DAY_GROUPS[day_text]
+            else:
+                weekdays.add(parse_weekday(day_text))
+        times = set()
+        for time_text in times_text.split(","):
+            time_range_match = TIME_RANGE_REGEX.match(time_text)
+            if time_range_match is None:
+                times.add(parse_time(time_text))
+                continue
+            range_start = parse_time(time_range_match.group(1))
+            range_end = parse_time(time_range_match.group(2))
+            interval = int(time_range_match.group(3))
+            if interval <= 0:
+                raise ValueError(f"Invalid interval in schedule rule {text!r}.")
+            minute = range_start.hour * 60 + range_start.minute
+            while minute <= range_end.hour * 60 + range_end.minute:
+                times.add(datetime.time(minute // 60, minute % 60))
+                minute += interval
+        return cls(text, weekdays, sorted(times))
+
+    def get_next_run(
+        self,
+        after: datetime.datetime,
+        is_skipped: Callable[[datetime.date], bool] = lambda date: False,
+    ) -> Optional[datetime.datetime]:
+        """Gets when the rule next runs.
+
+        :param after: The returned time is after this.
+
+        :param is_skipped: A function that is called with a date and returns True if the rule should not run on it.
+
+        :returns: The next run, or None if the rule does not run in the foreseeable future."""
+        timezone = pytz.timezone(BASE_TIMEZONE)
+        after = after.astimezone(timezone)
+        for day_offset in range(SCHEDULER_MAX_LOOKAHEAD_DAYS):
+            date = after.date() + datetime.timedelta(days=day_offset)
+            if date.isoweekday() not in self.weekdays or is_skipped(date):
+                continue
+            for time_of_day in self.times:
+                # (normalize() moves times that do not exist because of daylight saving time forward)
+                run_at = timezone.normalize(
+                    timezone.localize(datetime.datetime.combine(date, time_of_day))
+                )
+                if run_at > after:
+                    return run_at
+        return None
+
+
+def parse_holidays(holidays_data) -> List[Tuple[datetime.date, datetime.date]]:
+    """Parses the holidays file.
+
+    :param holidays_data: The content of the holidays file.
+
+    :returns: A list of (first day, last day) of every holiday."""
+    return [
+        (
+            datetime.date.fromisoformat(holiday["from"]),
+            datetime.date.fromisoformat(holiday.get("to", holiday["from"])),
+        )
+        for holiday in holidays_data["holidays"]
+    ]
+
+
+holidays_cache = ModelCache(HOLIDAYS_FILEPATH, parse_holidays)
+# The day that the bot last warned about the holidays file being outdated, so that it only warns once a day
+holidays_outdated_warned_at: Optional[datetime.date] = None
+
+
+async def get_holidays() -> List[Tuple[datetime.date, datetime.date]]:
+    """Gets the holidays as a list of (first day, last day). Returns an empty list if there is no holidays file.
+    Logs a warning if all the holidays in the file have passed, since the file then needs to be updated."""
+    global holidays_outdated_warned_at
+    if not os.path.exists(HOLIDAYS_FILEPATH):
+        return []
+    holidays = await holidays_cache.get()
+    today = get_now().date()
+    if (
+        len(holidays) > 0
+        and max(last_day for first_day, last_day in holidays) < today
+        and holidays_outdated_warned_at != today
+    ):
+        logger.warning(
+            f"All holidays in {HOLIDAYS_FILEPATH} have passed, so jobs will run during school breaks. Add the holidays for the coming school year to the file."
+        )
+        holidays_outdated_warned_at = today
+    return holidays
+
+
+@dataclass
+class JobStats:
+    __slots__ = (
+        "runs",
+        "failures",
+        "skipped",
+        "total_duration",
+        "max_duration",
+        "last_run_at",
+    )
+    runs: int
+    failures: int  # Runs that raised an exception
+    skipped: int  # Runs that were skipped because the previous run had not finished
+    total_duration: float  # The total time (in seconds) that the runs took
+    max_duration: float
+    last_run_at: Optional[datetime.datetime]
+
+
+class Job:
+    def __init__(
+        self,
+        name: str,
+        rule: ScheduleRule,
+        function: Callable[[], Awaitable],
+        skip_holidays: bool,
+        run_at_start: bool,
+    ):
+        """Initializes a job. Use Scheduler.add_job() to create jobs.
+
+        :param name: The name of the job.
+
+        :param rule: When the job runs.
+
+        :param function: A coroutine function that is called to run the job.
+
+        :param skip_holidays: Whether the job should not run on holidays.
+
+        :param run_at_start: Whether the job should also run as soon as the scheduler has started."""
+        self.name = name
+        self.rule = rule
+        self.function = function
+        self.skip_holidays = skip_holidays
+        self.run_at_start = run_at_start
+        self.next_run_at: Optional[datetime.datetime] = None
+        self.task: Optional[asyncio.Task] = None  # The current run
+        self.stats = JobStats(0, 0, 0, 0.0, 0.0, None)
+
+    def schedule_next_run(
+        self,
+        after: datetime.datetime,
+        holidays: List[Tuple[datetime.date, datetime.date]],
+    ):
+        """Calculates when the job should run next.
+
+        :param after: The next run is after this.
+
+        :param holidays: The holidays, see get_holidays()."""
+        self.next_run_at = self.rule.get_next_run(
+            after,
+            lambda date: self.skip_holidays
+            and any(first_day <= date <= last_day for first_day, last_day in holidays),
+        )
+
+    @property
+    def is_running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+
+class Scheduler:
+    def __init__(self):
+        """Initializes the scheduler. Jobs can be added before it has been started."""
+        self.jobs: Dict[str, Job] = {}
+        self.runner_task: Optional[asyncio.Task] = None
+        # Set to wake up the scheduler when the jobs have changed. Created when the scheduler is started,
+        # since it must be created from the event loop
+        self.jobs_changed: Optional[asyncio.Event] = None
+
+    def add_job(
+        self,
+        name: str,
+        rule: str,
+        function: Callable[[], Awaitable],
+        skip_holidays: bool = False,
+        run_at_start: bool = False,
+    ):
+        """Adds a job, replacing any job with the same name.
+
+        :param name: The name of the job, for example "menu_subscriptions".
+
+        :param rule: When the job runs, for example "weekdays 07:30" (see the top of this file).
+
+        :param function: A coroutine function that is called to run the job.
+
+        :param skip_holidays: Whether the job should not run on holidays (see holidays.json).
+
+        :param run_at_start: Whether the job should also run as soon as the scheduler has started."""
+        self.jobs[name] = Job(
+            name, ScheduleRule.parse(rule), function, skip_holidays, run_at_start
+        )
+        logger.info(f"Added job {name} ({rule}).")
+        if self.jobs_changed is not None:
+            self.jobs_changed.set()
+
+    def remove_job(self, name: str):
+        """Removes a job. A run that is in progress is not stopped.
+
+        :param name: The name of the job."""
+        if self.jobs.pop(name, None) is not None and self.jobs_changed is not None:
+            self.jobs_changed.set()
+
+    def start(self, bot: Client):
+        """Starts running jobs once the bot is ready.
+
+        :param bot: The bot."""
+        if self.runner_task is not None and not self.runner_task.done():
+            return
+        logger.info("Starting scheduler...")
+        self.jobs_changed = asyncio.Event()
+        self.runner_task = asyncio.create_task(self.run(bot))
+
+    async def stop(self):
+        """Stops the scheduler and cancels all runs that are in progress."""
+        if self.runner_task is None:
+            return
+        logger.info("Stopping scheduler...")
+        tasks_to_cancel = [self.runner_task] + [
+            job.task for job in self.jobs.values() if job.is_running
+        ]
+        for task in tasks_to_cancel:
+            task.cancel()
+        await asyncio.gather(*tasks_to_cancel, return_exceptions=True)
+        self.runner_task = None
+
+    async def run(self, bot: Client):
+        """Runs jobs when they are due until cancelled.
+
+        :param bot: The bot."""
+        await bot.wait_until_ready()
+        logger.info(f"Scheduler running with {len(self.jobs)} jobs.")
+        while True:
+            self.jobs_changed.clear()
+            now = get_now()
+            holidays = await get_holidays()
+            for job in list(self.jobs.values()):
+                if job.next_run_at is None:
+                    if job.run_at_start:
+                        job.next_run_at = now
+                    else:
+                        job.schedule_next_run(now, holidays)
+                if job.next_run_at is not None and job.next_run_at <= now:
+                    self.run_job(job)
+                    job.schedule_next_run(now, holidays)
+            next_runs = [
+                job.next_run_at
+                for job in self.jobs.values()
+                if job.next_run_at is not None
+            ]
+            sleep_time = SCHEDULER_MAX_SLEEP
+            if len(next_runs) > 0:
+                sleep_time = min(
+                    max((min(next_runs) - get_now()).total_seconds(), 0),
+                    SCHEDULER_MAX_SLEEP,
+                )
+            try:
+                await asyncio.wait_for(self.jobs_changed.wait(), sleep_time)
+            except asyncio.TimeoutError:
+                pass
+
+    def run_job(self, job: Job):
+        """Starts a run of a job in the background, unless the previous run is still in progress.
+
+        :param job: The job."""
+        if job.is_running:
+            logger.warning(
+                f"Job {job.name} is still running from {job.stats.last_run_at}. Skipping this run."
+            )
+            job.stats.skipped += 1
+            return
+        logger.info(f"Running job {job.name}...")
+        job.task = asyncio.create_task(self.execute_job(job))
+
+    @staticmethod
+    async def execute_job(job: Job):
+        """Runs a job and records how it went.
+
+        :param job: The job."""
+        job.stats.last_run_at = get_now()
+        started_at = time.monotonic()
+        try:
+            await job.function()
+        except Exception as e:
+            logger.critical(f"Job {job.name} failed: {e}", exc_info=True)
+            job.stats.failures += 1
+        finally:
+            duration = time.monotonic() - started_at
+            job.stats.runs += 1
+            job.stats.total_duration += duration
+            job.stats.max_duration = max(job.stats.max_duration, duration)
+            logger.info(f"Job {job.name} finished in {round(duration, 2)} s.")
+
+    def get_stats(self) -> Dict[str, Dict[str, object]]:
+        """Returns statistics about every job."""
+        return {
+            name: {
+                "rule": job.rule.text,
+                "runs": job.stats.runs,
+                "failures": job.stats.failures,
+                "skipped": job.stats.skipped,
+                "average_duration_ms": round(
+                    job.stats.total_duration / job.stats.runs * 1000, 2
+                )
+                if job.stats.runs > 0
+                else None,
+                "max_duration_ms": round(job.stats.max_duration * 1000, 2),
+                "last_run_at": job.stats.last_run_at.strftime("%Y-%m-%d %H:%M")
+                if job.stats.last_run_at is not None
+                else None,
+                "next_run_at": job.next_run_at.strftime("%Y-%m-%d %H:%M")
+                if job.next_run_at is not None
+                else None,
+            }
+            for name, job in self.jobs.items()
+        }
+
+
+# The scheduler is shared by the whole bot.
+scheduler = Scheduler()
@@ -0,0 +1,194 @@
+"""stub_server.py
+Contains a local stand-in for the services that the bot depends on, for running the bot without internet access,
+for example in CI or when benchmarking.
+
+The stub server replays the responses in the stub_fixtures directory in the static data directory:
+* GET /menu/api/ and /menu/api/<menu ID>/<week>: the menu API (menu.json).
+* GET /pentry/api/pentryansvar: the pentryansvar API (pentryansvar.json).
+* GET /cal?room=<class>: the SSIS schedule API (schedules.json, with the schedule of every class that is listed and
+  the "default" schedule for other classes).
+* GET /healthchecks/<anything>: Healthchecks pings.
+* GET /stats: how many requests the stub server has answered, per service.
+
+Run it with python -m utils.stub_server and point the bot at it by setting SSIS_DISCORD_BOT_STUB_SERVER_URL
+(see get_api_url() in general.py). Latency, errors and ETag behaviour can be configured, see --help."""
+import argparse, asyncio, hashlib, json, logging, os, random
+from dataclasses import dataclass
+from typing import Dict, Optional
+from aiohttp import web
+from utils.general import STUB_FIXTURES_DIRECTORY, get_json
+
+logger = logging.getLogger(__name__)
+
+# How the stub server uses ETags:
+# "conditional": the responses have ETags and conditional requests are answered with 304 Not Modified if they match.
+# "changing": the responses have ETags that change on every request, so conditional requests never match.
+# "none": the responses have no ETags.
+ETAG_MODES = ["conditional", "changing", "none"]
+
+
+@dataclass
+class StubServerSettings:
+    __slots__ = ("latency", "latency_jitter", "error_rate", "etag_mode")
+    latency: float  # Time (in seconds) that every response is delayed
+    latency_jitter: float  # A random extra delay of up to this many seconds
+    error_rate: float  # The share of requests (0-1) that are answered with 503 Service Unavailable
+    etag_mode: str  # See ETAG_MODES
+
+
+class StubServer:
+    def __init__(self, settings: StubServerSettings, fixtures_directory: str):
+        """Initializes the stub server.
+
+        :param settings: How the stub server behaves.
+
+        :param fixtures_directory: The directory with the responses to replay."""
+        self.settings = settings
+        self.fixtures_directory = fixtures_directory
+        # Mapping: service --> {"requests": ..., "not_modified": ..., "errors": ...}
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def get_fixture(self, filename: str):
+        """Gets the content of a fixture file.
+
+        :param filename: The name of the file in the fixtures directory."""
+        return get_json(os.path.join(self.fixtures_directory, filename))
+
+    async def respond(
+        self, request: web.Request, service: str, body: Optional[str]
+    ) -> web.Response:
+        """Answers a request like the real service would, with the configured latency, errors and ETags.
+
+        :param request: The request.
+
+        :param service: The name of the service, for the statistics.
+
+        :param body: The body of the response, or None to answer with 404 Not Found."""
+        service_stats = self.stats.setdefault(
+            service, {"requests": 0, "not_modified": 0, "errors": 0}
+        )
+        service_stats["requests"] += 1
+        await asyncio.sleep(
+            self.settings.latency + random.uniform(0, self.settings.latency_jitter)
+        )
+        if random.random() < self.settings.error_rate:
+            service_stats["errors"] += 1
+            return web.Response(status=503, text="Service Unavailable")
+        if body is None:
+            return web.Response(status=404, text="Not Found")
+        headers = {}
+        if self.settings.etag_mode != "none":
+            etag_content = body
+            if self.settings.etag_mode == "changing":
+                etag_content += str(service_stats["requests"])
+            etag = f'"{hashlib.sha1(etag_content.encode("UTF-8")).hexdigest()}"'
+            headers["ETag"] = etag
+            if request.headers.get("If-None-Match", None) == etag:
+                service_stats["not_modified"] += 1
+                return web.Response(status=304, headers=headers)
+        return web.Response(text=body, content_type="application/json", headers=headers)
+
+    async def handle_menu(self, request: web.Request) -> web.Response:
+        """Answers a request to the menu API."""
+        menu_data = self.get_fixture("menu.json")
+        if "week" in request.match_info:
+            try:
+                menu_data["menu"]["week_number"] = int(request.match_info["week"])
+            except ValueError:
+                return await self.respond(request, "menu", None)
+        return await self.respond(request, "menu", json.dumps(menu_data))
+
+    async def handle_pentryansvar(self, request: web.Request) -> web.Response:
+        """Answers a request to the pentryansvar API."""
+        return await self.respond(
+            request, "pentryansvar", json.dumps(self.get_fixture("pentryansvar.json"))
+        )
+
+    async def handle_schedule(self, request: web.Request) -> web.Response:
+        """Answers a request to the SSIS schedule API."""
+        schedules = self.get_fixture("schedules.json")
+        class_name = request.query.get("room", "")
+        return await self.respond(
+            request,
+            "schedule",
+            json.dumps(schedules.get(class_name, schedules["default"])),
+        )
+
+    async def handle_healthchecks(self, request: web.Request) -> web.Response:
+        """Answers a Healthchecks ping."""
+        return await self.respond(request, "healthchecks", '"OK"')
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        """Returns how many requests the stub server has answered."""
+        return web.json_response(self.stats)
+
+    def create_app(self) -> web.Application:
+        """Creates the web application for the stub server, for example for running it inside a benchmark."""
+        app = web.Application()
+        app.router.add_get("/menu/api/", self.handle_menu)
+        app.router.add_get("/menu/api/{menu_id}/{week}", self.handle_menu)
+        app.router.add_get("/pentry/api/pentryansvar", self.handle_pentryansvar)
+        app.router.add_get("/cal", self.handle_schedule)
+        app.router.add_route("*", "/healthchecks/{path:.*}", self.handle_healthchecks)
+        app.router.add_get("/stats", self.handle_stats)
+        return app
+
+
+def main():
+    """Runs the stub server from the command line."""
+    parser = argparse.ArgumentParser(
+        description="Runs a local stand-in for the services that the SSIS Discord bot depends on."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Time (in seconds) that every response is delayed.",
+    )
+    parser.add_argument(
+        "--latency-jitter",
+        type=float,
+        default=0.0,
+        help="A random extra delay of up to this many seconds.",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="The share of requests (0-1) that fail with 503 Service Unavailable.",
+    )
+    parser.add_argument(
+        "--etag-mode",
+        choices=ETAG_MODES,
+        default="conditional",
+        help="How ETags are used (see stub_server.py).",
+    )
+    parser.add_argument(
+        "--fixtures-directory",
+        default=STUB_FIXTURES_DIRECTORY,
+        help="The directory with the responses to replay.",
+    )
+    arguments = parser.parse_args()
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+    stub_server = StubServer(
+        StubServerSettings(
+            arguments.latency,
+            arguments.latency_jitter,
+            arguments.error_rate,
+            arguments.etag_mode,
+        ),
+        arguments.fixtures_directory,
+    )
+    logger.info(
+        f"Point the bot at the stub server with SSIS_DISCORD_BOT_STUB_SERVER_URL=http://{arguments.host}:{arguments.port}"
+    )
+    web.run_app(stub_server.create_app(), host=arguments.host, port=arguments.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,314 @@
 """subscription.py
 Commands for handling people that has subscribed to receiving messages for different things.
 
-Subscriptions are split in categories: for example "menu", "schedule", etc."""
+Subscriptions are split in categories: for example "menu", "schedule", etc.
+
+Subscriptions are stored in a JSON file by default. Subscribers being added or removed and
+notification times are appended to a journal (see journal.py) instead of rewriting the whole file.
+
+By setting the environment variable SSIS_DISCORD_BOT_SUBSCRIPTION_STORAGE to "sqlite", subscriptions are
+instead stored in an SQLite database (see subscription_sqlite.py). The first time the database is created,
+any existing subscriptions in the JSON file are imported to it.
+
+Notifications are sent for a period, for example a day ("2023-03-13") or a week ("2023-W11"). Every subscriber stores
+the period that they were last notified for, so a subscriber is never notified twice for the same period, even if the
+bot is restarted in the middle of sending. To avoid writing to disk once per recipient, deliveries are recorded
+in batches by a NotificationCheckpoint.
+
+With the JSON storage engine, who is due to be notified is looked up in a priority queue per subcategory
+(see notification_queue.py), which is built from the stored subscriptions when the bot starts and updated whenever someone
+subscribes, unsubscribes or is notified. The SQLite storage engine answers the same question with an indexed query instead,
+so no queues are kept in memory when it is used."""
 from utils.general import (
     get_json,
-    write_json,
+    aget_json,
+    get_active_classes,
+    get_file_lock,
+    run_file_io,
     SUBSCRIPTIONS_DATA_FILEPATH,
     SUBSCRIPTIONS_SCHEMA_FILEPATH,
-    BASE_TIMEZONE,
+    SUBSCRIPTIONS_DATABASE_FILEPATH,
 )
+from utils.subscription_sqlite import SQLiteSubscriptionStorage
+from utils.document_store import document_store
+from utils.notification_queue import NotificationQueue
+from utils.journal import Journal
+from utils.models import ModelCache, SubscriptionBucket
+from utils.autocomplete import PrefixIndex
 from nextcord import Member
-import logging, os, datetime, pytz
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import asyncio, logging, os, datetime, time
 
 # Set up logging
 logger = logging.getLogger(__name__)
 DEFAULT_SUBSCRIPTION_FILE_CONTENT = {"subscriptions": {}}
+# Categories that have one subcategory per active class (see get_active_classes()), named after the class in lowercase,
+# for example "schema/te24a". The classes are added to the subcategories that are listed in the available subscriptions file.
+CLASS_SUBSCRIPTION_CATEGORIES = ["schema"]
+STORAGE_ENGINE_JSON = "json"
+STORAGE_ENGINE_SQLITE = "sqlite"
+SUBSCRIPTION_STORAGE_ENGINE = os.getenv(
+    "SSIS_DISCORD_BOT_SUBSCRIPTION_STORAGE", STORAGE_ENGINE_JSON
+).lower()
+if SUBSCRIPTION_STORAGE_ENGINE not in [STORAGE_ENGINE_JSON, STORAGE_ENGINE_SQLITE]:
+    raise ValueError(
+        f"Invalid subscription storage engine {SUBSCRIPTION_STORAGE_ENGINE}."
+    )
+# A NotificationCheckpoint saves who has been notified after this many deliveries...
+NOTIFICATION_CHECKPOINT_SIZE = int(
+    os.getenv("SSIS_DISCORD_BOT_NOTIFICATION_CHECKPOINT_SIZE", 20)
+)
+# ...or when this many seconds have passed since the last save, whichever comes first
+NOTIFICATION_CHECKPOINT_INTERVAL = float(
+    os.getenv("SSIS_DISCORD_BOT_NOTIFICATION_CHECKPOINT_INTERVAL", 5)
+)
+sqlite_storage = None  # Set below if the SQLite storage engine is used
+subscriptions_journal = None  # Set below if the JSON storage engine is used
+# Mapping: (category name, subcategory name) --> queue of the subscribers that are due to be notified.
+# Only used with the JSON storage engine
+notification_queues: Dict[Tuple[str, str], NotificationQueue] = {}
+# The version of the subscriptions document that the queues are up to date with.
+# If the document is changed by something else than the functions below (such as someone editing the file), the queues are rebuilt.
+notification_queues_version: Optional[int] = None
+
+
+def read_subscriptions(copy=True):
+    """Gets content of the subscription file. This function blocks,
+    so use get_subscriptions() from coroutines.
+
+    :param copy: If False, the in-memory data is returned. Only use this for read-only access."""
+    if sqlite_storage is not None:
+        return sqlite_storage.export()
+    return get_json(SUBSCRIPTIONS_DATA_FILEPATH, copy=copy)
+
+
+def write_subscriptions(new_content):
+    """Updates the subscription file with new content. This function blocks,
+    so use update_subscriptions() from coroutines."""
+    if sqlite_storage is not None:
+        sqlite_storage.replace_all(new_content)
+        return
+    subscriptions_journal.replace(new_content)
+
+
+async def get_subscriptions(copy=True):
+    """Gets content of the subscription file.
+
+    :param copy: If False, the in-memory data is returned. Only use this for read-only access."""
+    if sqlite_storage is not None:
+        return await run_file_io(sqlite_storage.export)
+    return await aget_json(SUBSCRIPTIONS_DATA_FILEPATH, copy=copy)
+
+
+async def update_subscriptions(new_content):
+    """Updates the subscription file with new content.
+    If you have read the content before changing it, hold the lock from get_subscriptions_lock() while doing so.
+    """
+    if sqlite_storage is not None:
+        await run_file_io(sqlite_storage.replace_all, new_content)
+        return
+    await subscriptions_journal.areplace(new_content)
+
+
+def get_subscriptions_lock():
+    """Gets the lock that should be held while doing read-modify-write cycles on subscriptions."""
+    return get_file_lock(SUBSCRIPTIONS_DATA_FILEPATH)
+
+
+def parse_subscription_buckets(
+    subscription_data,
+) -> Dict[Tuple[str, str], SubscriptionBucket]:
+    """Parses the content of the subscription file into models.
+
+    :param subscription_data: The content of the subscription file.
+
+    :returns: Mapping: (category name, subcategory name) --> bucket with the subscribers of the subcategory.
+    """
+    return {
+        (category_name, subcategory_name): SubscriptionBucket.from_json(
+            category_name, subcategory_name, subcategory_data
+        )
+        for category_name, category_data in subscription_data["subscriptions"].items()
+        for subcategory_name, subcategory_data in category_data.items()
+    }
+
+
+subscription_buckets_cache = ModelCache(
+    SUBSCRIPTIONS_DATA_FILEPATH, parse_subscription_buckets
+)
+
+
+async def get_subscription_bucket(
+    category_name: str, subcategory_name: str
+) -> Optional[SubscriptionBucket]:
+    """Gets the subscribers of a subcategory when the JSON storage engine is used.
+    The returned bucket must not be modified.
+
+    :param category_name: Category name for the subscription, for example "menu".
+
+    :param subcategory_name: Subcategory name for the subscription, for example "daily".
+
+    :returns: The bucket, or None if the subcategory does not exist."""
+    return (await subscription_buckets_cache.get()).get(
+        (category_name, subcategory_name), None
+    )
+
+
+def build_notification_queues(subscription_data, version: int):
+    """Rebuilds the notification queues of all subcategories from the stored subscriptions (JSON storage engine only).
+
+    :param subscription_data: The content of the subscription file.
+
+    :param version: The version of the subscriptions document that the data is from.
+    """
+    global notification_queues, notification_queues_version
+    notification_queues = {
+        (category_name, subcategory_name): NotificationQueue.from_json(subcategory_data)
+        for category_name, category_data in subscription_data["subscriptions"].items()
+        for subcategory_name, subcategory_data in category_data.items()
+    }
+    notification_queues_version = version
+    logger.info(
+        f"Built notification queues for {sum(len(queue) for queue in notification_queues.values())} subscribers."
+    )
+
+
+async def get_notification_queue(
+    category_name: str, subcategory_name: str
+) -> Optional[NotificationQueue]:
+    """Gets the notification queue of a subcategory, rebuilding the queues if the subscriptions have been changed elsewhere.
+    Only used with the JSON storage engine.
+
+    :param category_name: Category name for the subscription, for example "menu".
+
+    :param subcategory_name: Subcategory name for the subscription, for example "daily".
+
+    :returns: The queue, or None if the subcategory does not exist."""
+    subscription_data, version = await run_file_io(
+        document_store.get_with_version, SUBSCRIPTIONS_DATA_FILEPATH
+    )
+    if version != notification_queues_version:
+        logger.info("Subscriptions have changed. Rebuilding notification queues...")
+        # (built from the event loop since journals change the document in place from there)
+        build_notification_queues(subscription_data, version)
+    return notification_queues.get((category_name, subcategory_name), None)
+
+
+def update_notification_queue(
+    category_name: str,
+    subcategory_name: str,
+    update_function: Callable[[NotificationQueue], None],
+    new_version: int,
+):
+    """Applies a change that has just been saved to the notification queue of a subcategory (JSON storage engine only).
+
+    :param category_name: Category name for the subscription, for example "menu".
+
+    :param subcategory_name: Subcategory name for the subscription, for example "daily".
+
+    :param update_function: A function that is called with the queue and changes it.
+
+    :param new_version: The version of the subscriptions document after the change.
+    """
+    global notification_queues_version
+    if notification_queues_version != new_version - 1:
+        # The queues are already outdated and will be rebuilt the next time they are used
+        return
+    notification_queues_version = new_version
+    notification_queue = notification_queues.get(
+        (category_name, subcategory_name), None
+    )
+    if notification_queue is not None:
+        update_function(notification_queue)
+
+
+def add_class_subcategories(subscriptions_schema):
+    """Adds the active classes as subcategories of the categories in CLASS_SUBSCRIPTION_CATEGORIES.
+
+    :param subscriptions_schema: The content of the available subscriptions file. It is not changed.
+
+    :returns: The available subscriptions with the classes added."""
+    class_subcategories = [class_name.lower() for class_name in get_active_classes()]
+    return {
+        category_name: {
+            **category_data,
+            "subcategories": category_data["subcategories"]
+            + [
+                subcategory
+                for subcategory in class_subcategories
+                if subcategory not in category_data["subcategories"]
+            ],
+        }
+        if category_name in CLASS_SUBSCRIPTION_CATEGORIES
+        else category_data
+        for category_name, category_data in subscriptions_schema.items()
+    }
+
+
+def parse_subscription_indexes(
+    subscriptions_schema,
+) -> Tuple[PrefixIndex, Dict[str, PrefixIndex]]:
+    """Builds indexes for autocompleting subscription categories and subcategories (see autocomplete.py).
+
+    :param subscriptions_schema: The content of the available subscriptions file.
+
+    :returns: An index of category names and a mapping: category name --> index of its subcategory names.
+    """
+    subscriptions_schema = add_class_subcategories(subscriptions_schema)
+    return PrefixIndex(subscriptions_schema.keys()), {
+        category_name: PrefixIndex(category_data["subcategories"])
+        for category_name, category_data in subscriptions_schema.items()
+    }
+
+
+subscription_indexes_cache = ModelCache(
+    SUBSCRIPTIONS_SCHEMA_FILEPATH, parse_subscription_indexes
+)
+
+
+async def search_categories(query: Optional[str]) -> List[str]:
+    """Finds subscription categories starting with a query, for autocompleting them.
+
+    :param query: What the user has typed so far."""
+    category_index, _ = await subscription_indexes_cache.get()
+    return category_index.search(query)
 
 
-def get_subscriptions():
-    """Gets content of the subscription file."""
-    return get_json(SUBSCRIPTIONS_DATA_FILEPATH)
+async def search_subcategories(
+    category_name: Optional[str], query: Optional[str]
+) -> List[str]:
+    """Finds subcategories of a subscription category starting with a query, for autocompleting them.
 
+    :param category_name: The category that the subcategories belong to.
 
-def update_subscriptions(new_content):
-    """Updates the subscription file with new content."""
-    write_json(SUBSCRIPTIONS_DATA_FILEPATH, new_content)
+    :param query: What the user has typed so far.
+
+    :returns: The matching subcategories, or an empty list if the category does not exist."""
+    _, subcategory_indexes = await subscription_indexes_cache.get()
+    if category_name not in subcategory_indexes:
+        return []
+    return subcategory_indexes[category_name].search(query)
 
 
 def get_available_subscriptions():
-    """Gets the available subscriptions."""
-    return get_json(SUBSCRIPTIONS_SCHEMA_FILEPATH)
+    """Gets the available subscriptions, including the subcategories for the active classes."""
+    return add_class_subcategories(get_json(SUBSCRIPTIONS_SCHEMA_FILEPATH))
+
+
+async def subscription_exists(category_name: str, subcategory_name: str) -> bool:
+    """Checks if a user can subscribe to something.
+
+    :param category_name: Category name for the subscription, for example "menu".
+
+    :param subcategory_name: Subcategory name for the subscription, for example "daily"."""
+    if sqlite_storage is not None:
+        return await run_file_io(
+            sqlite_storage.has_subcategory, category_name, subcategory_name
+        )
+    return await get_subscription_bucket(category_name, subcategory_name) is not None
 
 
-def is_subscribed_to(user: Member, category_name: str, subcategory_name: str):
+async def is_subscribed_to(user: Member, category_name: str, subcategory_name: str):
     '''Check if a user is subscribed to something or not.
 
     :param user: The user to check if it is subscribed or not.
@@ -40,24 +316,26 @@ def is_subscribed_to(user: Member, category_name: str, subcategory_name: str):
     :param category_name: Category name for the subscription, for example "menu".
 
     :param subcategory_name: Subcategory name for the subscription, for example "daily"'''
-    subscription_file = get_subscriptions()
-    if (
-        category_name in subscription_file["subscriptions"]
-        and subcategory_name in subscription_file["subscriptions"][category_name]
-    ):
-        return (
-            str(user.id)
-            in subscription_file["subscriptions"][category_name][subcategory_name][
-                "subscriptions"
-            ]
-        )
+    if sqlite_storage is not None:
+        if await run_file_io(
+            sqlite_storage.has_subcategory, category_name, subcategory_name
+        ):
+            return await run_file_io(
+                sqlite_storage.is_subscribed, category_name, subcategory_name, user.id
+            )
+        message = f"Requested subscription fluid_data for {category_name}:{subcategory_name} which does not seem to exist."
+        logger.warning(message)
+        raise Exception(message)
+    subscription_bucket = await get_subscription_bucket(category_name, subcategory_name)
+    if subscription_bucket is not None:
+        return user.id in subscription_bucket.subscribers
     else:
         message = f"Requested subscription fluid_data for {category_name}:{subcategory_name} which does not seem to exist."
         logger.warning(message)
         raise Exception(message)
 
 
-def change_subscriber_status(
+async def change_subscriber_status(
     category_name: str, subcategory_name: str, user: Member, add=True
 ):
     """Adds or removes subscriber to something.
@@ -71,28 +349,63 @@ def change_subscriber_status(
     :param add: True to add user, False to remove user.
     """
     logger.info(f"Adding/removing subscriber to {category_name}:{subcategory_name}...")
-    subscribed = is_subscribed_to(user, category_name, subcategory_name)
-    # Validate that user can be added or removed (must be not in/in database depending on action)
-    if add and not subscribed or not add and subscribed:
-        # Perform action to user
-        subscription_data = get_subscriptions()
-        if add:
-            subscription_data["subscriptions"][category_name][subcategory_name][
-                "subscriptions"
-            ][str(user.id)] = {"last_notified_at": None}
+    async with get_subscriptions_lock():
+        subscribed = await is_subscribed_to(user, category_name, subcategory_name)
+        # Validate that user can be added or removed (must be not in/in database depending on action)
+        if add and not subscribed or not add and subscribed:
+            # Perform action to user
+            if sqlite_storage is not None:
+                await run_file_io(
+                    sqlite_storage.set_subscribed,
+                    category_name,
+                    subcategory_name,
+                    user.id,
+                    add,
+                )
+            else:
+                new_version = await subscriptions_journal.aappend(
+                    "change_subscriber_status",
+                    category=category_name,
+                    subcategory=subcategory_name,
+                    user_id=user.id,
+                    add=add,
+                )
+                update_notification_queue(
+                    category_name,
+                    subcategory_name,
+                    lambda notification_queue: notification_queue.add(user.id)
+                    if add
+                    else notification_queue.remove(user.id),
+                    new_version,
+                )
+            logger.info("User was added/removed to subscription.")
         else:
-            del subscription_data["subscriptions"][category_name][subcategory_name][
-                "subscriptions"
-            ][str(user.id)]
-        update_subscriptions(subscription_data)
-        logger.info("User was added/removed to subscription.")
-    else:
-        logger.warning(
-            "User is already subscribed or unsubscribed! You should create a check for this and handle it somewhere else."
+            logger.warning(
+                "User is already subscribed or unsubscribed! You should create a check for this and handle it somewhere else."
+            )
+
+
+async def get_subscribers(category_name: str, subcategory_name: str) -> List[int]:
+    """Gets the IDs of all subscribers of a subcategory.
+
+    :param category_name: Category name for the subscription, for example "schema".
+
+    :param subcategory_name: Subcategory name for the subscription, for example "te20a".
+
+    :returns: The IDs of the subscribers, or an empty list if the subcategory does not exist."""
+    if sqlite_storage is not None:
+        return await run_file_io(
+            sqlite_storage.get_subscribers, category_name, subcategory_name
         )
+    notification_queue = await get_notification_queue(category_name, subcategory_name)
+    if notification_queue is None:
+        return []
+    return list(notification_queue.subscribers.keys())
 
 
-def get_users_not_notified_after(timestamp, category_name, subcategory_name):
+async def get_users_not_notified_after(
+    timestamp, category_name, subcategory_name, period: Optional[str] = None
+):
     """Retrieves a list of users that has not been notified within a certain timespan.
 
     :param timestamp: Any users not notified after or at this will be returned.
@@ -101,36 +414,244 @@ def get_users_not_notified_after(timestamp, category_name, subcategory_name):
 
     :param subcategory_name: The subscription subcategory to check.
 
+    :param period: If set, users that have already been notified for this period are not returned.
+
     :returns: A list of user IDs that have not been notified."""
     logger.debug(
         f"Getting users not notified after {timestamp} in {category_name}/{subcategory_name}..."
     )
-    # Get the category
-    subcategory_data = get_subscriptions()["subscriptions"][category_name][
-        subcategory_name
-    ]["subscriptions"]
-    subscribers_to_notify = []
-    for user_id, subscription_data in subcategory_data.items():
-        if subscription_data["last_notified_at"] != None:
-            if (
-                datetime.datetime.fromisoformat(
-                    subscription_data["last_notified_at"]
-                ).astimezone(tz=pytz.timezone(BASE_TIMEZONE))
-                >= timestamp
-            ):
-                continue
-        subscribers_to_notify.append(int(user_id))
-    return subscribers_to_notify  # Return list of subscribers to notification
+    if sqlite_storage is not None:
+        if not await run_file_io(
+            sqlite_storage.has_subcategory, category_name, subcategory_name
+        ):
+            raise KeyError(
+                f"Subscription {category_name}:{subcategory_name} does not exist."
+            )
+        # (an indexed range scan, see subscription_sqlite.py)
+        return await run_file_io(
+            sqlite_storage.get_users_not_notified_after,
+            timestamp,
+            category_name,
+            subcategory_name,
+            period,
+        )
+    notification_queue = await get_notification_queue(category_name, subcategory_name)
+    if notification_queue is None:
+        raise KeyError(
+            f"Subscription {category_name}:{subcategory_name} does not exist."
+        )
+    return notification_queue.get_due(
+        timestamp, period
+    )  # Return list of subscribers to notification
+
+
+async def mark_users_notified(
+    user_ids: Iterable[int],
+    category_name: str,
+    subcategory_name: str,
+    notified_at: datetime.datetime,
+    period: Optional[str] = None,
+):
+    """Sets the time that multiple users were last notified at in one batch.
+
+    :param user_ids: The IDs of the users that were notified.
+
+    :param category_name: The subscription category.
+
+    :param subcategory_name: The subscription subcategory.
+
+    :param notified_at: When the users were notified.
+
+    :param period: The period that the users were notified for, for example "2023-03-13"."""
+    user_ids = list(user_ids)
+    async with get_subscriptions_lock():
+        if sqlite_storage is not None:
+            await run_file_io(
+                sqlite_storage.mark_users_notified,
+                category_name,
+                subcategory_name,
+                user_ids,
+                notified_at,
+                period,
+            )
+        else:
+            new_version = await subscriptions_journal.aappend(
+                "mark_users_notified",
+                category=category_name,
+                subcategory=subcategory_name,
+                user_ids=user_ids,
+                notified_at=str(notified_at),
+                period=period,
+            )
+
+            def mark_notified(notification_queue: NotificationQueue):
+                for user_id in user_ids:
+                    notification_queue.mark_notified(user_id, notified_at, period)
+
+            update_notification_queue(
+                category_name, subcategory_name, mark_notified, new_version
+            )
+
+
+class NotificationCheckpoint:
+    def __init__(
+        self,
+        category_name: str,
+        subcategory_name: str,
+        notified_at: datetime.datetime,
+        period: str,
+        checkpoint_size: int = NOTIFICATION_CHECKPOINT_SIZE,
+        checkpoint_interval: float = NOTIFICATION_CHECKPOINT_INTERVAL,
+    ):
+        """Records users that have been notified for a period, saving them in batches.
+        Use it as an async context manager and pass record() as on_delivered to fan_out():
+        anything that has not been saved yet is saved when the block exits, even if sending was cancelled.
 
+        :param category_name: The subscription category.
 
+        :param subcategory_name: The subscription subcategory.
+
+        :param notified_at: When the users were notified.
+
+        :param period: The period that the users are notified for, for example "2023-03-13".
+
+        :param checkpoint_size: Save after this many users have been recorded.
+
+        :param checkpoint_interval: Save when this many seconds have passed since the last save."""
+        self.category_name = category_name
+        self.subcategory_name = subcategory_name
+        self.notified_at = notified_at
+        self.period = period
+        self.checkpoint_size = checkpoint_size
+        self.checkpoint_interval = checkpoint_interval
+        self.pending_user_ids: List[int] = []
+        self.saved_count = 0
+        self.last_saved_at = time.monotonic()
+
+    async def record(self, user_id: int):
+        """Records that a user has been notified, saving the batch if it is due.
+
+        :param user_id: The ID of the user."""
+        self.pending_user_ids.append(user_id)
+        if (
+            len(self.pending_user_ids) >= self.checkpoint_size
+            or time.monotonic() - self.last_saved_at >= self.checkpoint_interval
+        ):
+            await self.flush()
+
+    async def flush(self):
+        """Saves all users that have been recorded but not saved yet."""
+        self.last_saved_at = time.monotonic()
+        if len(self.pending_user_ids) == 0:
+            return
+        # Swap the list before saving so that users recorded while saving end up in the next batch
+        user_ids, self.pending_user_ids = self.pending_user_ids, []
+        await mark_users_notified(
+            user_ids,
+            self.category_name,
+            self.subcategory_name,
+            self.notified_at,
+            self.period,
+        )
+        self.saved_count += len(user_ids)
+        logger.debug(
+            f"Checkpointed {len(user_ids)} notified users for {self.category_name}:{self.subcategory_name} ({self.period})."
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        # Shield the final save so that a cancelled send still records who was notified
+        await asyncio.shield(self.flush())
+
+
+# Journal operations. These must be idempotent, see journal.py.
+def get_journal_record_subscribers(subscription_data, record):
+    """Gets the subscribers of the subcategory that a journal record is about.
+
+    :param subscription_data: The content of the subscription file.
+
+    :param record: The journal record.
+
+    :returns: A dictionary with the subscribers, or None if the subcategory does not exist."""
+    subcategory_data = (
+        subscription_data["subscriptions"]
+        .get(record["category"], {})
+        .get(record["subcategory"], None)
+    )
+    if subcategory_data is None:
+        logger.warning(
+            f"Subscription {record['category']}:{record['subcategory']} in journal record does not exist."
+        )
+        return None
+    return subcategory_data["subscriptions"]
+
+
+def apply_change_subscriber_status(subscription_data, record):
+    """Applies a change_subscriber_status journal record.
+
+    :param subscription_data: The content of the subscription file.
+
+    :param record: The journal record."""
+    subscribers = get_journal_record_subscribers(subscription_data, record)
+    if subscribers is None:
+        return
+    if record["add"]:
+        subscribers.setdefault(str(record["user_id"]), {"last_notified_at": None})
+    else:
+        subscribers.pop(str(record["user_id"]), None)
+
+
+def apply_mark_users_notified(subscription_data, record):
+    """Applies a mark_users_notified journal record.
+
+    :param subscription_data: The content of the subscription file.
+
+    :param record: The journal record."""
+    subscribers = get_journal_record_subscribers(subscription_data, record)
+    if subscribers is None:
+        return
+    for user_id in record["user_ids"]:
+        if str(user_id) in subscribers:  # (the user might have unsubscribed)
+            subscribers[str(user_id)]["last_notified_at"] = record["notified_at"]
+            if record.get("period", None) is not None:
+                subscribers[str(user_id)]["last_notified_period"] = record["period"]
+
+
+def create_subscriptions_journal() -> Journal:
+    """Creates the journal of the subscriptions JSON file."""
+    return Journal(
+        SUBSCRIPTIONS_DATA_FILEPATH,
+        {
+            "change_subscriber_status": apply_change_subscriber_status,
+            "mark_users_notified": apply_mark_users_notified,
+        },
+    )
+
+
+if SUBSCRIPTION_STORAGE_ENGINE == STORAGE_ENGINE_SQLITE:
+    logger.info("Using the SQLite storage engine for subscriptions.")
+    if not os.path.exists(SUBSCRIPTIONS_DATABASE_FILEPATH) and os.path.exists(
+        SUBSCRIPTIONS_DATA_FILEPATH
+    ):
+        # The new database is filled by importing the JSON file, so the changes that are still in its journal
+        # are folded into the file first. Otherwise, they would be lost for good.
+        logger.info("Compacting the subscriptions journal before importing it...")
+        create_subscriptions_journal().compact()
+    sqlite_storage = SQLiteSubscriptionStorage(
+        SUBSCRIPTIONS_DATABASE_FILEPATH, SUBSCRIPTIONS_DATA_FILEPATH
+    )
+else:
+    subscriptions_journal = create_subscriptions_journal()
 # Make sure that subscription file exists
-if not os.path.exists(SUBSCRIPTIONS_DATA_FILEPATH):
+if not os.path.exists(SUBSCRIPTIONS_DATA_FILEPATH) and sqlite_storage is None:
     logger.info("Creating subscriptions fluid_data file...")
-    update_subscriptions(DEFAULT_SUBSCRIPTION_FILE_CONTENT)
+    write_subscriptions(DEFAULT_SUBSCRIPTION_FILE_CONTENT)
 # Make sure that subscription file includes the schema
 logger.info("Ensuring that subscription file matches schema...")
 subscriptions_schema = get_available_subscriptions()
-subscriptions = get_subscriptions()
+subscriptions = read_subscriptions()
 for category_name, category_data in subscriptions_schema.items():
     file_changed = False
     if category_name not in subscriptions["subscriptions"]:
@@ -146,6 +667,11 @@ for category_name, category_data in subscriptions_schema.items():
             file_changed = True
     if file_changed:
         logger.info("Updating subscriptions file...")
-        update_subscriptions(subscriptions)
+        write_subscriptions(subscriptions)
     else:
         logger.info("Subscription file matches schema. All good!")
+# Build the queues of who is due to be notified from the stored subscriptions
+if sqlite_storage is None:
+    build_notification_queues(
+        *document_store.get_with_version(SUBSCRIPTIONS_DATA_FILEPATH)
+    )
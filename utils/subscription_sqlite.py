@@ -0,0 +1,328 @@
+"""subscription_sqlite.py
+An optional SQLite storage engine for subscriptions (see subscription.py).
+With the JSON storage engine, finding out who should be notified means loading every subscriber
+and parsing their last notification timestamps. Here, each subscriber is a row keyed by
+(category, subcategory, user_id) and the last notification time is stored as a UNIX timestamp with an index on it,
+which turns that into a single indexed range scan.
+
+Subscribers that have never been notified are stored with a last notification time of 0,
+which keeps the "who should be notified?" query a single range scan instead of also having to look for NULLs.
+The period that a subscriber was last notified for (see NotificationCheckpoint in subscription.py) is stored next to it.
+Databases created before periods were introduced get the column added when they are opened."""
+import datetime, functools, logging, os, sqlite3, threading
+from typing import Dict, Iterable, List, Optional
+import pytz
+from utils.general import BASE_TIMEZONE, get_json
+
+logger = logging.getLogger(__name__)
+
+# Value of last_notified_at for subscribers that have never been notified
+NEVER_NOTIFIED = 0.0
+DATABASE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS subcategories (
+    category TEXT NOT NULL,
+    subcategory TEXT NOT NULL,
+    PRIMARY KEY (category, subcategory)
+);
+CREATE TABLE IF NOT EXISTS subscriptions (
+    category TEXT NOT NULL,
+    subcategory TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    last_notified_at REAL NOT NULL DEFAULT 0,
+    last_notified_period TEXT,
+    PRIMARY KEY (category, subcategory, user_id)
+);
+CREATE INDEX IF NOT EXISTS subscriptions_by_last_notified_at
+    ON subscriptions (category, subcategory, last_notified_at);
+"""
+
+
+def timestamp_to_string(timestamp: float):
+    """Converts a stored last notification time to the format used in the subscriptions JSON file.
+
+    :param timestamp: The stored UNIX timestamp."""
+    if timestamp == NEVER_NOTIFIED:
+        return None
+    return str(
+        datetime.datetime.fromtimestamp(timestamp, tz=pytz.timezone(BASE_TIMEZONE))
+    )
+
+
+def string_to_timestamp(timestamp_string) -> float:
+    """Converts a last notification time from the subscriptions JSON file to a stored UNIX timestamp.
+
+    :param timestamp_string: The timestamp as an ISO-formatted string, or None."""
+    if timestamp_string is None:
+        return NEVER_NOTIFIED
+    return datetime.datetime.fromisoformat(timestamp_string).timestamp()
+
+
+def synchronized(method):
+    """Decorator that makes a method of the storage hold the storage lock while running."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+class SQLiteSubscriptionStorage:
+    def __init__(self, database_filepath: str, json_filepath: str = None):
+        """Opens (and creates if needed) the subscription database.
+
+        :param database_filepath: Path to the SQLite database file.
+
+        :param json_filepath: Path to a subscriptions JSON file. If the database is created
+        by this call and this file exists, its subscriptions are imported into the database."""
+        database_is_new = not os.path.exists(database_filepath)
+        # The storage is used from the file I/O thread pool, so the connection is shared between
+        # threads. The lock makes sure that only one thread uses it at a time.
+        self.connection = sqlite3.connect(database_filepath, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.connection.executescript(DATABASE_SCHEMA)
+        self.migrate()
+        if (
+            database_is_new
+            and json_filepath is not None
+            and os.path.exists(json_filepath)
+        ):
+            logger.info(f"Importing subscriptions from {json_filepath}...")
+            self.import_from_json(json_filepath)
+
+    @synchronized
+    def migrate(self):
+        """Adds columns that are missing in databases created by older versions of the bot."""
+        subscription_columns = [
+            row[1]
+            for row in self.connection.execute("PRAGMA table_info(subscriptions)")
+        ]
+        if "last_notified_period" not in subscription_columns:
+            logger.info("Adding last_notified_period column to subscriptions...")
+            with self.connection:
+                self.connection.execute(
+                    "ALTER TABLE subscriptions ADD COLUMN last_notified_period TEXT"
+                )
+
+    @synchronized
+    def import_from_json(self, json_filepath: str):
+        """Imports all subscriptions from a subscriptions JSON file into the database.
+
+        :param json_filepath: Path to the subscriptions JSON file."""
+        self.replace_all(get_json(json_filepath, copy=False))
+        logger.info("Subscriptions imported to the database.")
+
+    @synchronized
+    def has_subcategory(self, category_name: str, subcategory_name: str) -> bool:
+        """Checks if a subscription subcategory exists.
+
+        :param category_name: Category name for the subscription, for example "menu".
+
+        :param subcategory_name: Subcategory name for the subscription, for example "daily"."""
+        return (
+            self.connection.execute(
+                "SELECT 1 FROM subcategories WHERE category = ? AND subcategory = ?",
+                (category_name, subcategory_name),
+            ).fetchone()
+            is not None
+        )
+
+    @synchronized
+    def add_subcategory(self, category_name: str, subcategory_name: str):
+        """Adds a subscription subcategory if it does not exist.
+
+        :param category_name: Category name for the subscription, for example "menu".
+
+        :param subcategory_name: Subcategory name for the subscription, for example "daily"."""
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO subcategories (category, subcategory) VALUES (?, ?)",
+                (category_name, subcategory_name),
+            )
+
+    @synchronized
+    def is_subscribed(
+        self, category_name: str, subcategory_name: str, user_id: int
+    ) -> bool:
+        """Checks if a user is subscribed to a subcategory.
+
+        :param category_name: Category name for the subscription, for example "menu".
+
+        :param subcategory_name: Subcategory name for the subscription, for example "daily".
+
+        :param user_id: The ID of the user."""
+        return (
+            self.connection.execute(
+                "SELECT 1 FROM subscriptions WHERE category = ? AND subcategory = ? AND user_id = ?",
+                (category_name, subcategory_name, user_id),
+            ).fetchone()
+            is not None
+        )
+
+    @synchronized
+    def set_subscribed(
+        self, category_name: str, subcategory_name: str, user_id: int, add: bool
+    ):
+        """Adds or removes a subscriber.
+
+        :param category_name: Category name for the subscription, for example "menu".
+
+        :param subcategory_name: Subcategory name for the subscription, for example "daily".
+
+        :param user_id: The ID of the user.
+
+        :param add: True to add the user, False to remove the user."""
+        with self.connection:
+            if add:
+                self.connection.execute(
+                    "INSERT OR IGNORE INTO subscriptions (category, subcategory, user_id, last_notified_at) VALUES (?, ?, ?, ?)",
+                    (category_name, subcategory_name, user_id, NEVER_NOTIFIED),
+                )
+            else:
+                self.connection.execute(
+                    "DELETE FROM subscriptions WHERE category = ? AND subcategory = ? AND user_id = ?",
+                    (category_name, subcategory_name, user_id),
+                )
+
+    @synchronized
+    def get_users_not_notified_after(
+        self,
+        timestamp: datetime.datetime,
+        category_name: str,
+        subcategory_name: str,
+        period: Optional[str] = None,
+    ) -> List[int]:
+        """Retrieves a list of users that has not been notified after a certain time.
+
+        :param timestamp: Any users not notified after or at this will be returned.
+
+        :param category_name: The subscription category to check.
+
+        :param subcategory_name: The subscription subcategory to check.
+
+        :param period: If set, users that have already been notified for this period are not returned."""
+        query = "SELECT user_id FROM subscriptions WHERE category = ? AND subcategory = ? AND last_notified_at < ?"
+        parameters = [category_name, subcategory_name, timestamp.timestamp()]
+        if period is not None:
+            query += " AND (last_notified_period IS NULL OR last_notified_period != ?)"
+            parameters.append(period)
+        query += " ORDER BY last_notified_at"  # (the ones that have waited the longest first)
+        return [row[0] for row in self.connection.execute(query, parameters)]
+
+    @synchronized
+    def get_subscribers(self, category_name: str, subcategory_name: str) -> List[int]:
+        """Retrieves the IDs of all subscribers of a subcategory.
+
+        :param category_name: The subscription category.
+
+        :param subcategory_name: The subscription subcategory."""
+        return [
+            row[0]
+            for row in self.connection.execute(
+                "SELECT user_id FROM subscriptions WHERE category = ? AND subcategory = ?",
+                (category_name, subcategory_name),
+            )
+        ]
+
+    @synchronized
+    def mark_users_notified(
+        self,
+        category_name: str,
+        subcategory_name: str,
+        user_ids: Iterable[int],
+        notified_at: datetime.datetime,
+        period: Optional[str] = None,
+    ):
+        """Sets the last notification time for multiple users in one batch.
+
+        :param category_name: The subscription category.
+
+        :param subcategory_name: The subscription subcategory.
+
+        :param user_ids: The IDs of the users that were notified.
+
+        :param notified_at: When the users were notified.
+
+        :param period: The period that the users were notified for. If None, the stored period is kept."""
+        notified_at_timestamp = notified_at.timestamp()
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE subscriptions SET last_notified_at = ?, last_notified_period = COALESCE(?, last_notified_period) "
+                "WHERE category = ? AND subcategory = ? AND user_id = ?",
+                [
+                    (
+                        notified_at_timestamp,
+                        period,
+                        category_name,
+                        subcategory_name,
+                        user_id,
+                    )
+                    for user_id in user_ids
+                ],
+            )
+
+    @synchronized
+    def export(self) -> Dict:
+        """Returns all subscriptions in the same format as the subscriptions JSON file."""
+        subscriptions = {}
+        for category_name, subcategory_name in self.connection.execute(
+            "SELECT category, subcategory FROM subcategories"
+        ):
+            subscriptions.setdefault(category_name, {})[subcategory_name] = {
+                "subscriptions": {}
+            }
+        for (
+            category_name,
+            subcategory_name,
+            user_id,
+            last_notified_at,
+            last_notified_period,
+        ) in self.connection.execute(
+            "SELECT category, subcategory, user_id, last_notified_at, last_notified_period FROM subscriptions"
+        ):
+            subcategory_data = subscriptions.setdefault(category_name, {}).setdefault(
+                subcategory_name, {"subscriptions": {}}
+            )
+            subcategory_data["subscriptions"][str(user_id)] = {
+                "last_notified_at": timestamp_to_string(last_notified_at),
+                "last_notified_period": last_notified_period,
+            }
+        return {"subscriptions": subscriptions}
+
+    @synchronized
+    def replace_all(self, subscription_data: Dict):
+        """Replaces the content of the database with subscriptions in the subscriptions JSON file format.
+
+        :param subscription_data: The subscriptions, in the same format as the subscriptions JSON file.
+        """
+        subcategory_rows = []
+        subscription_rows = []
+        for category_name, category_data in subscription_data["subscriptions"].items():
+            for subcategory_name, subcategory_data in category_data.items():
+                subcategory_rows.append((category_name, subcategory_name))
+                for user_id, user_subscription_data in subcategory_data[
+                    "subscriptions"
+                ].items():
+                    subscription_rows.append(
+                        (
+                            category_name,
+                            subcategory_name,
+                            int(user_id),
+                            string_to_timestamp(
+                                user_subscription_data["last_notified_at"]
+                            ),
+                            user_subscription_data.get("last_notified_period", None),
+                        )
+                    )
+        with self.connection:
+            self.connection.execute("DELETE FROM subcategories")
+            self.connection.execute("DELETE FROM subscriptions")
+            self.connection.executemany(
+                "INSERT INTO subcategories (category, subcategory) VALUES (?, ?)",
+                subcategory_rows,
+            )
+            self.connection.executemany(
+                "INSERT INTO subscriptions (category, subcategory, user_id, last_notified_at, last_notified_period) VALUES (?, ?, ?, ?, ?)",
+                subscription_rows,
+            )